@@ -0,0 +1,114 @@
+"""
+Ring buffer of readings waiting to be published as a batch
+
+Readings are packed into a preallocated bytearray, so sampling allocates no
+memory. When full the oldest reading is overwritten and counted as lost by the
+controller through the gap in sequence numbers.
+
+In deep sleep RAM is lost, so the buffer can be turned into bytes to be kept
+in RTC memory, or saved to flash if it does not fit.
+"""
+
+import struct
+
+from payload import (
+    BATCH_RECORD_FORMAT,
+    BATCH_RECORD_SIZE,
+    MAX_BATCH,
+    pack_batch_header,
+)
+
+_META_FORMAT = "<IHH"  # First sequence, start index and count
+
+
+class ReadingBuffer:
+    def __init__(self, capacity):
+        if not 0 < capacity <= MAX_BATCH:
+            raise ValueError("capacity must be between 1 and 255")
+        self.capacity = capacity
+        self.records = bytearray(capacity * BATCH_RECORD_SIZE)
+        self.first_sequence = 0  # Sequence number of the oldest reading
+        self.start = 0  # Index of the oldest reading
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def full(self):
+        return self.count == self.capacity
+
+    def append(self, timestamp, temperature, humidity):
+        if self.count == self.capacity:
+            # Overwrite the oldest reading
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+            self.first_sequence = (self.first_sequence + 1) & 0xFFFFFFFF
+        else:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        struct.pack_into(
+            BATCH_RECORD_FORMAT,
+            self.records,
+            index * BATCH_RECORD_SIZE,
+            timestamp,
+            temperature,
+            humidity,
+        )
+
+    def pack(self):
+        """All readings as a batch message, oldest first"""
+        header = pack_batch_header(self.first_sequence, self.count)
+        end = self.start + self.count
+        if end <= self.capacity:
+            body = self.records[self.start * BATCH_RECORD_SIZE:end * BATCH_RECORD_SIZE]
+        else:
+            body = (
+                self.records[self.start * BATCH_RECORD_SIZE:]
+                + self.records[:(end - self.capacity) * BATCH_RECORD_SIZE]
+            )
+        return header + body
+
+    def clear(self):
+        """Forgets all readings after they are published"""
+        self.first_sequence = (self.first_sequence + self.count) & 0xFFFFFFFF
+        self.start = 0
+        self.count = 0
+
+    def backfill(self, timestamp, interval):
+        """Sets the time of readings taken before the clock was set
+
+        Assumes one reading per interval, the newest at timestamp.
+        """
+        for i in range(self.count):
+            offset = ((self.start + i) % self.capacity) * BATCH_RECORD_SIZE
+            if not struct.unpack_from("<I", self.records, offset)[0]:
+                taken = timestamp - (self.count - 1 - i) * interval
+                struct.pack_into("<I", self.records, offset, taken)
+
+    def dumps(self):
+        meta = struct.pack(_META_FORMAT, self.first_sequence, self.start, self.count)
+        return meta + self.records
+
+    def loads(self, data):
+        """Restores dumped readings, returns False if not dumped with this capacity"""
+        meta_size = struct.calcsize(_META_FORMAT)
+        if len(data) != meta_size + len(self.records):
+            return False
+        self.first_sequence, self.start, self.count = struct.unpack_from(
+            _META_FORMAT, data
+        )
+        self.records[:] = data[meta_size:]
+        return True
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.dumps())
+
+    def load(self, path):
+        """Restores a saved buffer, returns False if there is none"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        return self.loads(data)
@@ -2,10 +2,13 @@
     Get devices
 """
 
+from array import array
 import machine
-from utime import sleep
+from utime import sleep, sleep_ms, ticks_diff, ticks_ms
 from dht import DHT22
 
+from filters import median, trimmed_mean
+
 
 board_led = machine.Pin('LED', machine.Pin.OUT)
 
@@ -49,14 +52,19 @@ class Sensor:
 
 
 class BoardTemperatureSensor(Sensor):
-    def __init__(self, pin=4, constants=(27, 0.706, 0.001721), id = "board_temperature_sensor"):
+    def __init__(self, pin=4, constants=(27, 0.706, 0.001721), id = "board_temperature_sensor", oversampling=16):
         self.id = id
         self.a, self.b, self.c = constants
         self.conv_fact = 3.3/65535
         self.sensor = machine.ADC(pin)
+        self.oversampling = oversampling
+        self._samples = array("f", [0.0] * oversampling)
     
     def _read_volt(self):
-        return self.sensor.read_u16() * self.conv_fact
+        """Trimmed mean of several ADC reads, the ADC of the RP2040 is noisy"""
+        for i in range(self.oversampling):
+            self._samples[i] = self.sensor.read_u16()
+        return trimmed_mean(self._samples, self.oversampling) * self.conv_fact
     
     def read(self):
         voltage = self._read_volt()
@@ -65,26 +73,86 @@ class BoardTemperatureSensor(Sensor):
     
     
 class ExternalSensor(Sensor):
-    """External temperature sensor based on DHT22"""
+    """External temperature sensor based on DHT22
+    
+    A reading is the median of a burst of samples, which removes the occasional
+    spike. Failed samples are retried with backoff, the DHT22 can only be
+    sampled every 2 seconds. The burst ends early rather than run past
+    `max_duration_ms`, a sleeping device should not stay awake for retries.
+    """
+    
+    MIN_INTERVAL_MS = 2000
+    TEMPERATURE_RANGE = (-40, 80)
+    HUMIDITY_RANGE = (0, 100)
     
-    def __init__(self, pin_no, id="external_temperature_sensor"):
+    def __init__(self, pin_no, id="external_temperature_sensor", samples=3, max_attempts=6, max_duration_ms=10000):
         self.id = id
         self.sensor = DHT22(machine.Pin(pin_no, machine.Pin.PULL_UP))
+        self.samples = samples
+        self.max_attempts = max_attempts
+        self.max_duration_ms = max_duration_ms
+        self._temperatures = array("f", [0.0] * samples)
+        self._humidities = array("f", [0.0] * samples)
+        self._last_measure = None
+    
+    def _remaining(self, interval_ms):
+        """Milliseconds until an interval has passed since the last measurement"""
+        if self._last_measure is None:
+            return 0
+        return max(0, interval_ms - ticks_diff(ticks_ms(), self._last_measure))
+    
+    def _measure(self, index):
+        """Stores one sample at index, False if it failed or is out of range"""
+        try:
+            self.sensor.measure()
+        except OSError as e:
+            print(e)
+            return False
+        finally:
+            self._last_measure = ticks_ms()
+        temperature = self.sensor.temperature()
+        humidity = self.sensor.humidity()
+        low, high = self.TEMPERATURE_RANGE
+        if not low <= temperature <= high:
+            return False
+        low, high = self.HUMIDITY_RANGE
+        if not low <= humidity <= high:
+            return False
+        self._temperatures[index] = temperature
+        self._humidities[index] = humidity
+        return True
     
     def read(self):
         """Reads temperature and humidity as a dictionary.
 
+        The quality is the share of the samples of the burst that succeeded.
         If unsucessfull return None.
         """
-        try:
-            self.sensor.measure()
-            temperature = self.sensor.temperature()
-            humidity = self.sensor.humidity()
-            
-            return {"temperature": temperature, "humidity": humidity}
-        except OSError as e:
-            print(e)
+        n = 0
+        failures = 0
+        interval = self.MIN_INTERVAL_MS
+        started = ticks_ms()
+        for _ in range(self.max_attempts):
+            if n == self.samples:
+                break
+            remaining = self._remaining(interval)
+            if ticks_diff(ticks_ms(), started) + remaining > self.max_duration_ms:
+                break
+            sleep_ms(remaining)
+            if not self._measure(n):
+                failures += 1
+                interval = min(interval * 2, 4 * self.MIN_INTERVAL_MS)  # Backoff
+                continue
+            interval = self.MIN_INTERVAL_MS
+            n += 1
+        
+        if n == 0:
             return None
+        return {
+            "temperature": median(self._temperatures, n),
+            "humidity": median(self._humidities, n),
+            "quality": n / (n + failures),
+        }
     
     
     
\ No newline at end of file
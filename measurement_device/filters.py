@@ -0,0 +1,45 @@
+"""
+Robust statistics over preallocated buffers
+
+Works in place on the first `n` values of an `array`, so filtering allocates
+no memory on MicroPython.
+"""
+
+
+def sort_in_place(values, n):
+    """Insertion sort of the first n values, fast for the few samples of a burst"""
+    for i in range(1, n):
+        value = values[i]
+        j = i - 1
+        while j >= 0 and values[j] > value:
+            values[j + 1] = values[j]
+            j -= 1
+        values[j + 1] = value
+
+
+def median(values, n):
+    """Median of the first n values, sorts them in place"""
+    if n == 0:
+        raise ValueError("no values")
+    sort_in_place(values, n)
+    middle = n // 2
+    if n % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def trimmed_mean(values, n, trim=0.25):
+    """Mean of the first n values without the `trim` share lowest and highest
+
+    Sorts the values in place.
+    """
+    if n == 0:
+        raise ValueError("no values")
+    sort_in_place(values, n)
+    k = int(n * trim)
+    if n - 2 * k <= 0:
+        return median(values, n)
+    total = 0.0
+    for i in range(k, n - k):
+        total += values[i]
+    return total / (n - 2 * k)
@@ -2,16 +2,20 @@ from utime import sleep
 from wifi import WiFi
 import machine
 import json
+import struct
 
 from umqtt.simple import MQTTClient
 
 from config import config
 import devices
 from devices import blink_board
+import payload
+from batch import ReadingBuffer
 
 
-# indicate start of machine
-blink_board(1, 2)
+# indicate start of machine, not when waking up from deep sleep
+if machine.reset_cause() != getattr(machine, "DEEPSLEEP_RESET", None):
+    blink_board(1, 2)
 
 
 MQTT_SERVER = config["mqtt_server"]
@@ -20,6 +24,18 @@ NETWORK_SSID = config['SSID']
 NETWORK_PASSWORD = config['password']
 SAMPLE_RATE = config["sample_rate"]
 ROOT_TOPIC = config["root_topic"]
+PAYLOAD_FORMAT = config.get("payload_format", "text")  # "text" or "binary"
+BATCH_SIZE = config.get("batch_size", 1)  # Readings per publish, batched if above 1
+SLEEP_MODE = config.get("sleep_mode", "light")  # "light" or "deep" when batched
+SENSOR = config.get("sensor", "external")  # "external" or "board"
+# Samples per reading, a sleeping device spends less time awake with fewer
+SENSOR_SAMPLES = config.get("sensor_samples", 1 if BATCH_SIZE > 1 else 3)
+SENSOR_TIMEOUT_MS = config.get("sensor_timeout_ms", 10000)  # Longest read
+BATCH_FILE = "batch.bin"
+# Start of the RTC memory kept over deep sleep, the estimated unix time at wake
+# up or 0, followed by the buffer if it fits
+WAKE_FORMAT = "<I"
+WAKE_SIZE = struct.calcsize(WAKE_FORMAT)
 
 
 def reset():
@@ -35,11 +51,114 @@ def mqtt_connect():
 
 # Setup devices
 board_temperature_sensor = devices.BoardTemperatureSensor()
-environment_sensor = devices.ExternalSensor(pin_no=DHT_DATA_PIN)
+environment_sensor = devices.ExternalSensor(
+    pin_no=DHT_DATA_PIN,
+    samples=SENSOR_SAMPLES,
+    max_duration_ms=SENSOR_TIMEOUT_MS,
+)
 sensors = [board_temperature_sensor, environment_sensor]
 
+
+def read_sensor():
+    """Reads temperature and humidity of the configured sensor, None if failed"""
+    if SENSOR == "board":
+        reading = board_temperature_sensor.read()
+        return {"temperature": reading["temperature"], "humidity": float("nan")}
+    return environment_sensor.read()
+
+
+def flush_batch(wifi, buffer):
+    """Connects, publishes all buffered readings in one message and disconnects
+
+    The clock is synced while connected, it drifts between batches and is not
+    set at all before the first one. Readings are kept if publishing fails and
+    retried at the next sample.
+    """
+    try:
+        wifi.connect(NETWORK_SSID, NETWORK_PASSWORD)
+        if payload.sync_clock():
+            # Readings without time get the time they are received by the
+            # controller otherwise
+            buffer.backfill(payload.unix_time(), SAMPLE_RATE)
+        client_id = wifi.get_mac()
+        client = MQTTClient(client_id, MQTT_SERVER, keepalive=60)
+        client.connect()
+        # Not retained, a batch is history and not the current value
+        client.publish(f"{client_id}/{ROOT_TOPIC}/reading", buffer.pack())
+        client.disconnect()
+        print(f"published batch of {len(buffer)} readings")
+        buffer.clear()
+    except (RuntimeError, OSError) as e:
+        print("Failed to publish batch:", e)
+    finally:
+        wifi.disconnect()
+
+
+def save_state(buffer):
+    """Keeps the buffer and the time over deep sleep
+
+    Both go in RTC memory, which survives deep sleep but not a power loss. The
+    buffer is only saved to flash if it does not fit or there is no RTC memory.
+    """
+    rtc = machine.RTC()
+    if not hasattr(rtc, "memory"):  # Not on every port, e.g. the Pico W
+        buffer.save(BATCH_FILE)
+        return
+    now = payload.unix_time()
+    wake = struct.pack(WAKE_FORMAT, now + SAMPLE_RATE if now else 0)
+    try:
+        rtc.memory(wake + buffer.dumps())
+    except ValueError:  # Larger than the RTC memory
+        rtc.memory(wake)
+        buffer.save(BATCH_FILE)
+
+
+def restore_state(buffer):
+    """Restores the buffer and the clock after waking up from deep sleep"""
+    if machine.reset_cause() != getattr(machine, "DEEPSLEEP_RESET", None):
+        buffer.load(BATCH_FILE)  # Only saved if not kept in RTC memory
+        return
+    state = machine.RTC().memory()
+    if len(state) < WAKE_SIZE:
+        return
+    wake_time = struct.unpack_from(WAKE_FORMAT, state)[0]
+    if wake_time and not payload.unix_time():
+        payload.set_clock(wake_time)
+    if len(state) == WAKE_SIZE:
+        buffer.load(BATCH_FILE)
+    else:
+        buffer.loads(state[WAKE_SIZE:])
+
+
+def run_batched(wifi):
+    """Samples into a ring buffer and only connects to publish full batches
+
+    Sleeps between samples with Wi-Fi turned off. In deep sleep RAM is lost and
+    the device restarts when woken up, see `save_state`.
+    """
+    buffer = ReadingBuffer(BATCH_SIZE)
+    if SLEEP_MODE == "deep":
+        restore_state(buffer)
+    wifi.disconnect()
+    while True:
+        reading = read_sensor()
+        if reading:
+            buffer.append(
+                payload.unix_time(), reading["temperature"], reading["humidity"]
+            )
+        if buffer.full():
+            flush_batch(wifi, buffer)
+        if SLEEP_MODE == "deep":
+            save_state(buffer)
+            machine.deepsleep(SAMPLE_RATE * 1000)
+        machine.lightsleep(SAMPLE_RATE * 1000)
+
+
 # Connect to network
 wifi = WiFi()
+if BATCH_SIZE > 1:
+    run_batched(wifi)
+
 try:
     wifi.connect(NETWORK_SSID, NETWORK_PASSWORD)
 except RuntimeError as e:
@@ -49,6 +168,9 @@ except RuntimeError as e:
 
 CLIENT_ID = wifi.get_mac()
 
+if PAYLOAD_FORMAT == "binary":
+    payload.sync_clock()
+
 # Connect to MQTT Broker
 try:
     client = mqtt_connect()
@@ -67,11 +189,30 @@ def publish_reading(client, reading):
     client.publish(f"{CLIENT_ID}/{ROOT_TOPIC}/humidity", str(reading["humidity"]), retain=True)
     print(f"published to : {CLIENT_ID}/{ROOT_TOPIC}")
 
+def publish_binary_reading(client, sequence, reading):
+    """Publishes all fields of a reading in one packed message"""
+    msg = payload.pack_reading(
+        sequence, payload.unix_time(), reading["temperature"], reading["humidity"]
+    )
+    client.publish(f"{CLIENT_ID}/{ROOT_TOPIC}/reading", msg, retain=True)
+    print(f"published reading {sequence} to : {CLIENT_ID}/{ROOT_TOPIC}")
+
 # Publish loop
+sequence = 0
+status = None
 while True:
     sleep(SAMPLE_RATE)
     reading = environment_sensor.read()
-    if reading:
+    if PAYLOAD_FORMAT == "binary":
+        # Status is only published when changed, the reading is enough otherwise
+        if reading:
+            publish_binary_reading(client, sequence, reading)
+            sequence += 1
+        new_status = "OK" if reading else "NOT_OK"
+        if new_status != status:
+            publish_status(client, new_status)
+            status = new_status
+    elif reading:
         publish_reading(client, reading)
         publish_status(client, "OK")
     else:
@@ -0,0 +1,82 @@
+"""
+Packed binary payload of a reading
+
+One message on `{device_mac_address}/{root_topic}/reading` carries all fields
+of a reading instead of one text message per field:
+
+    version     uint8   Format version, 1
+    sequence    uint32  Incremented per reading, restarts at 0 after reset
+    timestamp   uint32  Unix time of the reading, 0 if the clock is not set
+    temperature float32 °C
+    humidity    float32 %
+
+Little endian, 17 bytes. Must match `controller.mqtt.READING`.
+"""
+
+import struct
+import time
+
+READING_FORMAT = "<BIIff"
+READING_VERSION = 1
+
+# Seconds from 1970 to the epoch of the port, 2000 on older MicroPython ports
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+MIN_VALID_TIME = 1672531200  # 2023-01-01, earlier means the clock is not set
+
+
+def sync_clock():
+    """Sets the clock from NTP, returns True if successful"""
+    try:
+        import ntptime
+        ntptime.settime()
+        return True
+    except (ImportError, OSError) as e:
+        print("Could not sync clock:", e)
+        return False
+
+
+def set_clock(timestamp):
+    """Sets the clock to a unix time, e.g. estimated before a deep sleep"""
+    import machine
+    tm = time.gmtime(int(timestamp) - EPOCH_OFFSET)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+
+def unix_time():
+    """Current unix time, 0 if the clock is not set"""
+    now = time.time() + EPOCH_OFFSET
+    return now if now >= MIN_VALID_TIME else 0
+
+
+def pack_reading(sequence, timestamp, temperature, humidity):
+    return struct.pack(
+        READING_FORMAT,
+        READING_VERSION,
+        sequence & 0xFFFFFFFF,
+        timestamp,
+        temperature,
+        humidity,
+    )
+
+
+# Batch of readings, version 2:
+#
+#     version         uint8   2
+#     count           uint8   Number of readings
+#     first sequence  uint32  Sequence number of the first reading
+#
+# followed by `count` records of timestamp (uint32), temperature and humidity
+# (float32), oldest first. The sequence number of a record is the first
+# sequence plus its index. Must match `controller.mqtt.BATCH_HEADER`.
+BATCH_VERSION = 2
+BATCH_HEADER_FORMAT = "<BBI"
+BATCH_RECORD_FORMAT = "<Iff"
+BATCH_HEADER_SIZE = struct.calcsize(BATCH_HEADER_FORMAT)
+BATCH_RECORD_SIZE = struct.calcsize(BATCH_RECORD_FORMAT)
+MAX_BATCH = 255
+
+
+def pack_batch_header(first_sequence, count):
+    return struct.pack(
+        BATCH_HEADER_FORMAT, BATCH_VERSION, count, first_sequence & 0xFFFFFFFF
+    )
@@ -12,6 +12,7 @@ class WiFi:
         self.wlan.active(True)
     
     def connect(self, ssid: str, password: str, max_wait=60):
+        self.wlan.active(True)
         self.wlan.connect(ssid, password)
         while max_wait > 0:
             if self.wlan.status() < 0 or self.wlan.status() >=3:
@@ -34,3 +35,7 @@ class WiFi:
         else:
             None
 
+    def disconnect(self):
+        """Disconnects and turns the radio off to save power"""
+        self.wlan.disconnect()
+        self.wlan.active(False)
@@ -0,0 +1,231 @@
+"""End-to-end load benchmark of the MQTT path
+
+Publishes synthetic H60 register traffic and sensor traffic through an in-process
+broker to the dispatcher, `Rego1000` and `MQTTSensorGroup` as set up in main,
+and measures throughput, ingest-to-store latency, dropped messages and memory
+growth. Also measures the publish rate of `Rego1000.set_variable`.
+
+Results are written as JSON so they can be compared between releases:
+
+    python -m controller.benchmark --rate 10000 --devices 50 --output bench.json
+"""
+
+import argparse
+import asyncio
+from array import array
+import json
+import platform
+import resource
+import sys
+import time
+from typing import Optional
+
+import aiomqtt
+
+from controller.broker import InProcessBroker, delivery_latency
+from controller.mqtt import MQTTSensorGroup
+from husdata.controllers import Rego1000
+from husdata.dispatcher import MessageDispatcher
+from husdata.registers import ID_C30
+
+TICK = 0.01  # Seconds between publish bursts
+SENSOR_TOPIC = "+/bench/+/temperature"
+
+
+class _Latencies:
+    def __init__(self) -> None:
+        self.values = array("d")
+
+    def add(self, message: aiomqtt.Message) -> None:
+        latency = delivery_latency(message)
+        if latency is not None:
+            self.values.append(latency)
+
+
+class _TimedRego(Rego1000):
+    latencies: _Latencies
+
+    def _update_data_from_message(self, message: aiomqtt.Message) -> None:
+        super()._update_data_from_message(message)
+        self.latencies.add(message)
+
+
+class _TimedSensorGroup(MQTTSensorGroup):
+    latencies: _Latencies
+
+    def update_from_message(self, message: aiomqtt.Message) -> None:
+        super().update_from_message(message)
+        self.latencies.add(message)
+
+
+def percentile(values: array, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _max_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def _publish_load(
+    broker: InProcessBroker,
+    heatpump_ids: list[str],
+    devices: int,
+    rate: float,
+    duration: float,
+    sensor_share: float,
+) -> int:
+    registers = [idx.value for idx in ID_C30]
+    per_tick = rate * TICK
+    budget = 0.0
+    sent = 0
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    next_tick = loop.time()
+    while loop.time() < end:
+        budget += per_tick
+        while budget >= 1:
+            budget -= 1
+            if sent % 1000 < sensor_share * 1000:
+                device = sent % devices
+                topic = f"dev{device}/bench/room{device}/temperature"
+                broker.publish(topic, 20 + (sent % 50) / 10)
+            else:
+                heatpump_id = heatpump_ids[sent % len(heatpump_ids)]
+                idx = registers[sent % len(registers)]
+                payload = "1" if idx.startswith("1") else f"{(sent % 400) / 10:.1f}"
+                broker.publish(f"{heatpump_id}/HP/{idx}", payload)
+            sent += 1
+        next_tick += TICK
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+    return sent
+
+
+async def _set_variable_rate(rego: Rego1000, calls: int) -> float:
+    writable = sorted(rego.WRITABLE_VARS)
+    started = time.perf_counter()
+    for i in range(calls):
+        await rego.set_variable(writable[i % len(writable)], i % 10)
+    return calls / (time.perf_counter() - started)
+
+
+async def run_benchmark(
+    rate: float = 1000,
+    devices: int = 20,
+    heatpumps: int = 1,
+    duration: float = 5.0,
+    sensor_share: float = 0.5,
+    queue_size: int = 1000,
+    set_variable_calls: int = 10_000,
+) -> dict:
+    """Runs the benchmark and returns the results
+
+    Args:
+        rate: Published messages per second
+        devices: Number of simulated sensor devices
+        heatpumps: Number of simulated H60 gateways
+        duration: Seconds to publish
+        sensor_share: Share of messages that are sensor readings
+        queue_size: Size of each consumer queue in the dispatcher
+        set_variable_calls: Number of calls when measuring set_variable
+    """
+    broker = InProcessBroker()
+    client = broker.client()
+    dispatcher = MessageDispatcher(client, maxsize=queue_size)
+    latencies = _Latencies()
+    heatpump_ids = [f"hp{i:04d}" for i in range(heatpumps)]
+
+    sensor = _TimedSensorGroup(client, SENSOR_TOPIC, "temperature", dispatcher=dispatcher)
+    sensor.latencies = latencies
+    gateways = []
+    for heatpump_id in heatpump_ids:
+        rego = _TimedRego(
+            client, id=heatpump_id, topic=f"{heatpump_id}/HP/#", dispatcher=dispatcher
+        )
+        rego.latencies = latencies
+        gateways.append(rego)
+
+    rss_before = _max_rss_kb()
+    async with asyncio.TaskGroup() as tg:
+        consumers = [
+            tg.create_task(dispatcher.run()),
+            tg.create_task(sensor.start_sensor()),
+            *(tg.create_task(rego.start()) for rego in gateways),
+        ]
+        await asyncio.sleep(0)  # Let consumers subscribe
+
+        started = time.perf_counter()
+        sent = await _publish_load(
+            broker, heatpump_ids, devices, rate, duration, sensor_share
+        )
+        while client.pending or dispatcher.backlog:
+            await asyncio.sleep(TICK)
+        elapsed = time.perf_counter() - started
+
+        set_rate = await _set_variable_rate(gateways[0], set_variable_calls)
+        for task in consumers:
+            task.cancel()
+
+    return {
+        "config": dict(
+            rate=rate,
+            devices=devices,
+            heatpumps=heatpumps,
+            duration=duration,
+            sensor_share=sensor_share,
+            queue_size=queue_size,
+        ),
+        "ingest": dict(
+            sent=sent,
+            stored=len(latencies.values),
+            dropped=dispatcher.dropped,
+            messages_per_s=len(latencies.values) / elapsed,
+            latency_p50_ms=_ms(percentile(latencies.values, 50)),
+            latency_p99_ms=_ms(percentile(latencies.values, 99)),
+        ),
+        "set_variable": dict(calls=set_variable_calls, calls_per_s=set_rate),
+        "memory": dict(max_rss_growth_kb=_max_rss_kb() - rss_before),
+        "environment": dict(
+            python=sys.version.split()[0],
+            machine=platform.machine(),
+            timestamp=time.time(),
+        ),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=1000, help="Messages per second")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--heatpumps", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds")
+    parser.add_argument("--sensor-share", type=float, default=0.5)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(
+        run_benchmark(
+            rate=args.rate,
+            devices=args.devices,
+            heatpumps=args.heatpumps,
+            duration=args.duration,
+            sensor_share=args.sensor_share,
+            queue_size=args.queue_size,
+        )
+    )
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""In-process MQTT broker stand-in
+
+Routes messages between `BrokerClient`s in the same event loop without any
+network, for benchmarks and tests of the MQTT path. The clients implement the
+parts of `aiomqtt.Client` used by this repository.
+"""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Optional
+
+import aiomqtt
+
+from husdata.dispatcher import TopicTrie
+
+
+class BrokerMessage(aiomqtt.Message):
+    """Message stamped with the time it was published"""
+
+    def __init__(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        super().__init__(topic, payload, qos=0, retain=retain, mid=0, properties=None)
+        self.published_at = time.perf_counter()
+
+
+def _to_bytes(payload: Any) -> bytes:
+    if payload is None:
+        return b""
+    if isinstance(payload, bytes):
+        return payload
+    return str(payload).encode("utf-8")
+
+
+class InProcessBroker:
+    def __init__(self) -> None:
+        self._subscriptions = TopicTrie()
+        self._retained: dict[str, BrokerMessage] = {}
+        self.published: int = 0
+
+    def client(self) -> "BrokerClient":
+        return BrokerClient(self)
+
+    def _subscribe(self, client: "BrokerClient", topic: str) -> None:
+        self._subscriptions.insert(topic, client)
+        probe = TopicTrie()
+        probe.insert(topic, True)
+        for retained_topic, message in self._retained.items():
+            if probe.match(retained_topic):
+                client._deliver(message)
+
+    def publish(self, topic: str, payload: Any = None, retain: bool = False) -> None:
+        message = BrokerMessage(topic, _to_bytes(payload), retain)
+        self.published += 1
+        if retain:
+            self._retained[topic] = message
+        # A client gets a message once even if several of its filters match
+        for client in dict.fromkeys(self._subscriptions.match(topic)):
+            client._deliver(message)
+
+
+class BrokerClient:
+    """Client of an `InProcessBroker` with the interface of `aiomqtt.Client`"""
+
+    def __init__(self, broker: InProcessBroker) -> None:
+        self.broker = broker
+        self._queue: asyncio.Queue[BrokerMessage] = asyncio.Queue()
+        self.topics: list[str] = []
+
+    async def __aenter__(self) -> "BrokerClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    def _deliver(self, message: BrokerMessage) -> None:
+        self._queue.put_nowait(message)
+
+    @property
+    def pending(self) -> int:
+        """Messages delivered to the client but not yet read"""
+        return self._queue.qsize()
+
+    async def subscribe(self, topic: str, *args, **kwargs) -> None:
+        self.topics.append(topic)
+        self.broker._subscribe(self, topic)
+
+    async def publish(
+        self,
+        topic: str,
+        payload: Any = None,
+        qos: int = 0,
+        retain: bool = False,
+        *args,
+        **kwargs,
+    ) -> None:
+        self.broker.publish(topic, payload, retain)
+
+    async def _messages(self) -> AsyncIterator[BrokerMessage]:
+        while True:
+            yield await self._queue.get()
+
+    @property
+    def messages(self) -> AsyncIterator[BrokerMessage]:
+        return self._messages()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(topics={self.topics})"
+
+
+def delivery_latency(message: aiomqtt.Message) -> Optional[float]:
+    """Seconds since a broker message was published"""
+    published_at = getattr(message, "published_at", None)
+    if published_at is None:
+        return None
+    return time.perf_counter() - published_at
@@ -3,6 +3,7 @@
 This module contains a data structre and method for reading environment variables. 
 """
 import logging
+from typing import Optional
 
 from pydantic import ConfigDict
 from pydantic_settings import BaseSettings
@@ -11,11 +12,60 @@ logger = logging.getLogger(__name__)
 
 
 class Config(BaseSettings):
+    STRATEGY: str = "proportional"  # Or "predictive"
     STRATEGY_INFLUENCE: float = 3.0
     STRATEGY_PERIOD: int = 3600
+    STRATEGY_CONFIRM_TIMEOUT: Optional[float] = None
+    STRATEGY_ALIGN: bool = False
+    STRATEGY_JITTER: float = 0.0
+    STRATEGY_REACTIVE: bool = False
+    STRATEGY_DEADBAND: float = 0.2
+    STRATEGY_DEBOUNCE: float = 30.0
+    # Predictive strategy, new offsets every STRATEGY_PERIOD
+    PREDICTIVE_SAMPLE_PERIOD: float = 60.0
+    PREDICTIVE_HORIZON: float = 6 * 3600.0
+    PREDICTIVE_OFFSET_STEP: float = 1.0
+    PREDICTIVE_FORGETTING: float = 0.999
+    PREDICTIVE_MIN_SAMPLES: int = 720
+    # Heat pump id to topic filter of its temperature sensors
+    SITES: dict[str, str] = {"8cce4efb8623": "+/firstfloor/+/temperature"}
+    LOG_FILE: Optional[str] = "log_controller.txt"
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    LOG_MAX_BYTES: int = 10_000_000
+    LOG_BACKUP_COUNT: int = 5
+    LOG_ROTATE_WHEN: Optional[str] = None  # E.g. "midnight", by size if not set
+    LOG_RATE_LIMIT: int = 10  # Equal messages per module and period
+    LOG_RATE_PERIOD: float = 60.0
+    HOST: str = "0.0.0.0"
+    PORT: int = 80  # Metrics endpoint, workers use the following ports
+    WORKERS: int = 1
+    WORKER_HEARTBEAT_INTERVAL: float = 5.0
+    WORKER_HEARTBEAT_TIMEOUT: float = 30.0
+    WORKER_MAX_RESTARTS: int = 5
+    WORKER_STABLE_PERIOD: float = 3600.0  # Healthy seconds that reset restarts
     MQTT_HOST: str
     MQTT_PORT: int = 1883
     MQTT_CLIENT_ID: str = "controller.climate_control"
+    MQTT_QUEUE_SIZE: int = 1000
+    MQTT_RECONNECT_MIN: float = 1.0
+    MQTT_RECONNECT_MAX: float = 60.0
+    MQTT_OFFLINE_BUFFER_SIZE: int = 100
+    SENSOR_AGGREGATE: str = "mean"
+    SENSOR_STALE_TIMEOUT: float = 600.0
+    # Also subscribe to binary readings next to the text temperature topics
+    SENSOR_BINARY: bool = True
+    HISTORY_CAPACITY: int = 60_480
+    STORAGE_DIR: str = "data"
+    STORAGE_SEGMENT_DURATION: int = 86400
+    STORAGE_FLUSH_INTERVAL: float = 60.0
+    STORAGE_RESUME_PERIOD: int = 7 * 86400
+    WRITE_MAX_PER_PERIOD: int = 6
+    WRITE_BUDGET_PERIOD: float = 60.0
+    WRITE_TOLERANCE: float = 0.05
+    SNAPSHOT_ENABLED: bool = True
+    SNAPSHOT_INTERVAL: float = 60.0
+    SNAPSHOT_MAX_AGE: float = 3600.0  # Older state is not restored at startup
 
 
     model_config = ConfigDict(
@@ -0,0 +1,164 @@
+"""Supervised MQTT connection
+
+`ConnectionManager` stands in for `aiomqtt.Client` and keeps the connection up.
+When the broker goes away it reconnects with exponential backoff and restores
+all subscriptions, so the dispatcher, gateways and sensors keep running with
+their state. Publishes made while offline are kept in a bounded buffer and sent
+once connected again, only the latest per topic since a later write to a
+register supersedes an earlier one.
+"""
+
+import asyncio
+from collections import OrderedDict
+import logging
+import random
+from typing import Any, AsyncIterator, NoReturn
+import weakref
+
+import aiomqtt
+
+from husdata.metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+CONNECTED = REGISTRY.gauge("mqtt_connected", "1 if connected to the broker")
+RECONNECTS = REGISTRY.counter("mqtt_reconnects_total", "Reconnects to the broker")
+BUFFERED = REGISTRY.gauge("mqtt_offline_buffer", "Publishes waiting for a connection")
+DISCARDED = REGISTRY.counter(
+    "mqtt_offline_discarded_total", "Publishes dropped from a full offline buffer"
+)
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        client: aiomqtt.Client,
+        min_delay: float = 1.0,
+        max_delay: float = 60.0,
+        buffer_size: int = 100,
+        queue_size: int = 1000,
+    ) -> None:
+        """
+        Args:
+            client: Reusable client to connect with
+            min_delay: Seconds before the first reconnect attempt
+            max_delay: Longest delay between reconnect attempts
+            buffer_size: Topics with publishes kept while offline
+            queue_size: Received messages waiting to be read
+        """
+        self.client = client
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.buffer_size = buffer_size
+        self.connected = asyncio.Event()
+        self.reconnects: int = 0
+        # Topic filter to subscription arguments
+        self._subscriptions: dict[str, tuple[tuple, dict]] = {}
+        # Topic to latest publish arguments while offline
+        self._buffer: OrderedDict[str, tuple[Any, tuple, dict]] = OrderedDict()
+        self._queue: asyncio.Queue[aiomqtt.Message] = asyncio.Queue(queue_size)
+        manager = weakref.ref(self)  # Not kept alive by the registry
+        BUFFERED.set_function(
+            lambda: 0 if (alive := manager()) is None else len(alive._buffer)
+        )
+
+    async def __aenter__(self) -> "ConnectionManager":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    @property
+    def topics(self) -> list[str]:
+        return list(self._subscriptions)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    async def subscribe(self, topic: str, *args, **kwargs) -> None:
+        """Subscribes now if connected and again after every reconnect"""
+        self._subscriptions[topic] = (args, kwargs)
+        if self.connected.is_set():
+            try:
+                await self.client.subscribe(topic, *args, **kwargs)
+            except aiomqtt.MqttError as e:
+                log.warning(f"Could not subscribe to {topic}, retries on connect: {e}")
+
+    async def unsubscribe(self, topic: str, *args, **kwargs) -> None:
+        self._subscriptions.pop(topic, None)
+        if self.connected.is_set():
+            try:
+                await self.client.unsubscribe(topic, *args, **kwargs)
+            except aiomqtt.MqttError as e:
+                log.warning(f"Could not unsubscribe from {topic}: {e}")
+
+    async def publish(self, topic: str, payload: Any = None, *args, **kwargs) -> None:
+        """Publishes now if connected, otherwise when connected again"""
+        if self.connected.is_set():
+            try:
+                await self.client.publish(topic, payload, *args, **kwargs)
+                return
+            except aiomqtt.MqttError as e:
+                log.warning(f"Could not publish to {topic}, buffers it: {e}")
+        self._buffer.pop(topic, None)
+        self._buffer[topic] = (payload, args, kwargs)
+        if len(self._buffer) > self.buffer_size:
+            dropped, _ = self._buffer.popitem(last=False)
+            DISCARDED.inc()
+            log.warning(f"Offline buffer full, dropped publish to {dropped}")
+
+    async def _restore(self) -> None:
+        """Restores subscriptions and sends publishes buffered while offline"""
+        restored: set[str] = set()
+        # Until done, also subscriptions made while restoring
+        while pending := [t for t in self._subscriptions if t not in restored]:
+            for topic in pending:
+                if topic in self._subscriptions:
+                    args, kwargs = self._subscriptions[topic]
+                    await self.client.subscribe(topic, *args, **kwargs)
+                restored.add(topic)
+        if self._buffer:
+            log.info(f"Sending {len(self._buffer)} publishes buffered while offline")
+        while self._buffer:
+            topic, entry = next(iter(self._buffer.items()))
+            payload, args, kwargs = entry
+            await self.client.publish(topic, payload, *args, **kwargs)
+            # Keep a publish made meanwhile to the same topic
+            if self._buffer.get(topic) is entry:
+                del self._buffer[topic]
+
+    async def _messages(self) -> AsyncIterator[aiomqtt.Message]:
+        while True:
+            yield await self._queue.get()
+
+    @property
+    def messages(self) -> AsyncIterator[aiomqtt.Message]:
+        """Messages of all connections"""
+        return self._messages()
+
+    async def run(self) -> NoReturn:
+        """Connects and reconnects until cancelled"""
+        delay = self.min_delay
+        while True:
+            try:
+                async with self.client:
+                    await self._restore()
+                    self.connected.set()
+                    CONNECTED.set(1)
+                    log.info("Connected to MQTT broker")
+                    delay = self.min_delay
+                    async for message in self.client.messages:
+                        await self._queue.put(message)
+            except aiomqtt.MqttError as e:
+                log.warning(f"MQTT connection failed: {e}")
+            finally:
+                self.connected.clear()
+                CONNECTED.set(0)
+
+            wait = random.uniform(delay / 2, delay)
+            log.info(f"Reconnecting to MQTT broker in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.max_delay)
+            self.reconnects += 1
+            RECONNECTS.inc()
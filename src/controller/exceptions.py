@@ -6,4 +6,7 @@ class StrategyError(Exception):
     pass
 
 class AlreadyRegisteredError(StrategyError):
-    pass
\ No newline at end of file
+    pass
+
+class WorkerError(Exception):
+    pass
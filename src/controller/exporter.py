@@ -0,0 +1,68 @@
+"""HTTP endpoint serving metrics in the Prometheus text format
+
+    GET /metrics
+
+Only what is needed to be scraped, one request per connection. The endpoint runs
+next to the control tasks and never stops them, if it fails it is logged and
+the controller keeps running without metrics.
+"""
+
+import asyncio
+import logging
+from husdata.metrics import REGISTRY, Registry
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _response(status: str, body: bytes, content_type: str = "text/plain") -> bytes:
+    head = (
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode("ascii") + body
+
+
+class MetricsServer:
+    def __init__(
+        self, host: str = "0.0.0.0", port: int = 80, registry: Registry = REGISTRY
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            method, path, *_ = request.split(b"\r\n", 1)[0].decode("ascii").split()
+            if method != "GET":
+                response = _response("405 Method Not Allowed", b"")
+            elif path.split("?", 1)[0] in ("/", "/metrics"):
+                body = self.registry.render().encode("utf-8")
+                response = _response("200 OK", body, CONTENT_TYPE)
+            else:
+                response = _response("404 Not Found", b"")
+            writer.write(response)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                TimeoutError, UnicodeDecodeError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self) -> None:
+        """Serves until cancelled, returns if the server fails"""
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+            log.info(f"Serving metrics on {self.host}:{self.port}")
+            async with server:
+                await server.serve_forever()
+        except OSError as e:
+            log.error(f"Could not serve metrics on {self.host}:{self.port}: {e}")
+        except Exception:
+            log.exception("Metrics server failed, continues without metrics")
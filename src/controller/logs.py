@@ -0,0 +1,217 @@
+"""Logging off the event loop
+
+Loggers only put records on a queue, a `QueueListener` thread formats them and
+does the file and console I/O, so slow storage never stalls the event loop. The
+log file is rotated by size or time and written as JSON lines, and repeated
+messages are rate limited per module before they are queued.
+"""
+
+import atexit
+from collections import OrderedDict
+import copy
+import json
+import logging
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+import queue
+import time
+from typing import Optional
+
+FORMAT = "%(asctime)s::%(levelname)s::%(name)s::%(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` equal messages of a module per `period`
+
+    Messages are equal if they are logged from the same line, so messages
+    formatted with different values, e.g. by f-strings, are limited together.
+    The number of suppressed messages is added to the next one that is
+    let through. Errors are never suppressed.
+    """
+
+    def __init__(self, rate: int = 10, period: float = 60.0, max_keys: int = 1024):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self.max_keys = max_keys
+        # Key to tokens, time of last refill and number of suppressed records
+        self._buckets: OrderedDict[tuple, list] = OrderedDict()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.rate), now, 0]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            tokens = bucket[0] + (now - bucket[1]) * self.rate / self.period
+            bucket[0] = min(float(self.rate), tokens)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.msg} ({bucket[2]} similar suppressed)"
+            bucket[2] = 0
+        return True
+
+
+class StoppableListener(QueueListener):
+    """A `QueueListener` that can be stopped more than once
+
+    `setup_logging` stops the listener at exit, this makes that a no-op when the
+    caller has stopped it already.
+    """
+
+    running: bool = False
+
+    def start(self) -> None:
+        super().start()
+        self.running = True
+
+    def stop(self) -> None:
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+class TracebackQueueHandler(QueueHandler):
+    """Queues records with the exception and stack kept in their own fields
+
+    `QueueHandler` merges them into the message, which leaves nothing for the
+    `JsonFormatter` of the listener. The traceback is formatted here, as the
+    exception itself should not cross to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    filename: Optional[str] = "log_controller.txt",
+    level: int | str = logging.INFO,
+    json_format: bool = True,
+    max_bytes: int = 10_000_000,
+    backup_count: int = 5,
+    rotate_when: Optional[str] = None,
+    rate: int = 10,
+    period: float = 60.0,
+    console: bool = True,
+) -> StoppableListener:
+    """Routes all logging through a queue to a file and the console
+
+    Replaces all handlers of the root logger, call once at startup.
+
+    Args:
+        filename: Log file, no file if None
+        level: Level of the root logger
+        json_format: Write the file as JSON lines, otherwise as text
+        max_bytes: Size the file is rotated at, if not rotated by time
+        backup_count: Number of rotated files to keep
+        rotate_when: Rotate by time instead, e.g. "midnight", see
+            `TimedRotatingFileHandler`
+        rate: Equal messages of a module let through per period
+        period: Seconds of the rate limit
+        console: Log to the console as well
+
+    Returns:
+        The started listener, stopped at exit
+    """
+    handlers: list[logging.Handler] = []
+    if filename is not None:
+        if rotate_when is not None:
+            file_handler: logging.Handler = TimedRotatingFileHandler(
+                filename, when=rotate_when, backupCount=backup_count, encoding="utf-8"
+            )
+        else:
+            file_handler = RotatingFileHandler(
+                filename,
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding="utf-8",
+            )
+        file_handler.setFormatter(
+            JsonFormatter() if json_format else logging.Formatter(FORMAT)
+        )
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(FORMAT))
+        handlers.append(console_handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate, period))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = StoppableListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging_from_config(
+    config, filename: Optional[str] = None
+) -> StoppableListener:
+    """Sets up logging with the `LOG_*` parameters of a `Config`
+
+    Args:
+        config: Configuration parameters
+        filename: Log file instead of `LOG_FILE`
+    """
+    return setup_logging(
+        filename=filename or config.LOG_FILE,
+        level=config.LOG_LEVEL,
+        json_format=config.LOG_JSON,
+        max_bytes=config.LOG_MAX_BYTES,
+        backup_count=config.LOG_BACKUP_COUNT,
+        rotate_when=config.LOG_ROTATE_WHEN,
+        rate=config.LOG_RATE_LIMIT,
+        period=config.LOG_RATE_PERIOD,
+    )
@@ -1,77 +1,87 @@
 """
-Main script that starts all coroutines.
+Main entry point that starts all coroutines.
 - Creates and starts the Strategies
 - Starts logging of all signals
 - Initiates logging
+
+Importing this module is cheap, config, logging and the MQTT stack are set up
+by `main` when the controller is started, e.g. with `climate-control`.
 """
 
 # Builtin packages
+import argparse
 import asyncio
-
-import aiomqtt
-from controller.mqtt import MQTTSensor
-from controller.config import read_config
-from controller.strategies import OffsetOutdoorTemperatureStrategy
-from husdata.controllers import Rego1000
 import logging
 import sys
 import traceback
+from typing import TYPE_CHECKING, Optional
 
+if TYPE_CHECKING:
+    from controller.config import Config
 
-# Setting up logging
-FORMAT = "%(asctime)s::%(levelname)s::%(name)s::%(message)s"
-logging.basicConfig(
-    level=logging.INFO, filename="log_controller.txt", filemode="w", format=FORMAT
-)
 log = logging.getLogger(__name__)
 
 
-# Log to console as well.
-consoleHandler = logging.StreamHandler()
-logFormatter = logging.Formatter(FORMAT)
-consoleHandler.setFormatter(logFormatter)
-
-# Add consolHandler to all loggers
-for name, item in logging.root.manager.loggerDict.items():
-    if isinstance(item, logging.Logger):
-        item.addHandler(consoleHandler)
-
-
 # Logg all unhandled exceptions
 def exception_handler(*exc_info):
     msg = "".join(traceback.format_exception(*exc_info))
     log.exception(f"Unhandled exception: {msg}")
 
 
-sys.excepthook = exception_handler
-
-config = read_config()
-
-async def main():
-    client = aiomqtt.Client(config.MQTT_HOST, username="climate-control")
-
-    temperature_sensor = MQTTSensor(
-        client,
-        "+/firstfloor/+/temperature",
-        name="temperature",
-    )
-    rego = Rego1000(client, id="8cce4efb8623", topic="8cce4efb8623/HP/#")
-
-    strategy = OffsetOutdoorTemperatureStrategy(
-        rego=rego,
-        temperature_sensor=temperature_sensor,
-        influence=config.STRATEGY_INFLUENCE,
-        period=config.STRATEGY_PERIOD,
-    )
-
-    async with client:
+async def run(config: "Config") -> None:
+    """Runs the sites of the config, in worker processes if more than one worker"""
+    from controller.runtime import run_sites
+
+    if config.WORKERS > 1:
+        from controller.exporter import MetricsServer
+        from controller.workers import Supervisor
+
+        supervisor = Supervisor(
+            config.SITES,
+            config,
+            workers=config.WORKERS,
+            heartbeat_interval=config.WORKER_HEARTBEAT_INTERVAL,
+            heartbeat_timeout=config.WORKER_HEARTBEAT_TIMEOUT,
+            max_restarts=config.WORKER_MAX_RESTARTS,
+            stable_period=config.WORKER_STABLE_PERIOD,
+        )
+        metrics = MetricsServer(config.HOST, config.PORT)
         async with asyncio.TaskGroup() as tg:
-            tg.create_task(temperature_sensor.start_sensor())
-            tg.create_task(rego.start())
-            tg.create_task(strategy.start())
+            tg.create_task(metrics.run())
+            tg.create_task(supervisor.run())
+    else:
+        await run_sites(config, config.SITES)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs the climate controller")
+    parser.add_argument("--env-file", help="Read configuration from this file")
+    parser.add_argument("--log-level", help="Overrides LOG_LEVEL")
+    parser.add_argument("--workers", type=int, help="Overrides WORKERS")
+    args = parser.parse_args(argv)
+
+    from controller.config import read_config
+    from controller.logs import setup_logging_from_config
+
+    overrides = {}
+    if args.env_file is not None:
+        overrides["_env_file"] = args.env_file
+    if args.log_level is not None:
+        overrides["LOG_LEVEL"] = args.log_level
+    if args.workers is not None:
+        overrides["WORKERS"] = args.workers
+    config = read_config(**overrides)
+    setup_logging_from_config(config)
+    sys.excepthook = exception_handler
 
-
-if __name__ == "__main__":
     log.info("Main entrypoint started")
-    asyncio.run(main())
+    try:
+        asyncio.run(run(config))
+    except KeyboardInterrupt:
+        pass
     log.info("stoped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
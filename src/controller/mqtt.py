@@ -3,36 +3,192 @@
 
 Subscribe to temperature sensors and H60?
 
+Sensors publish either one text message per field, e.g. the temperature as
+`21.5` on `{id}/{root_topic}/temperature`, or all fields of a reading packed in
+one binary message on `{id}/{root_topic}/reading`, see `READING`.
 """
 
+import asyncio
+from bisect import bisect_left, insort
+from collections import OrderedDict
 from datetime import datetime
 import logging
-from typing import Optional, NoReturn
+import math
+import struct
+import time
+from typing import TYPE_CHECKING, Optional, NoReturn
 
-import aiomqtt
+from husdata.dispatcher import MessageDispatcher, message_timestamp
+from husdata.events import ChangeNotifier
+from husdata.history import History
+from husdata.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import aiomqtt
 
 log = logging.getLogger(__name__)
 
+LOST_READINGS = REGISTRY.counter(
+    "sensor_lost_readings_total", "Readings missing in the sequence", ("sensor",)
+)
+VALUE_AGE = REGISTRY.gauge(
+    "sensor_value_age_seconds", "Seconds since the last value of a sensor", ("sensor",)
+)
+
+# Version, sequence number, unix time of the reading or 0 if the device clock
+# is not set, temperature and humidity. See `measurement_device/payload.py`.
+READING = struct.Struct("<BIIff")
+READING_VERSION = 1
+# Batch of readings, version, count and sequence number of the first reading,
+# followed by `count` records of unix time, temperature and humidity
+BATCH_HEADER = struct.Struct("<BBI")
+BATCH_RECORD = struct.Struct("<Iff")
+BATCH_VERSION = 2
+READING_FIELDS = ("temperature", "humidity")
+READING_LEVEL = "reading"  # Last level of the topic of binary readings
+SEQUENCE_MODULO = 1 << 32
+
+
+def loop_time() -> float:
+    """Time of the running event loop, virtual in a replay, else monotonic"""
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
+
 
 class MQTTSensor:
     """Sensor to handle callback from subscription. 
     """
 
-    def __init__(self, client: aiomqtt.Client, topic: str, name: str) -> None:
+    value: Optional[float] = None  # Until the first update
+
+    def __init__(
+        self,
+        client: "aiomqtt.Client",
+        topic: str,
+        name: str,
+        dispatcher: Optional[MessageDispatcher] = None,
+        history: Optional[History] = None,
+        reading_topic: Optional[str] = None,
+        field: str = "temperature",
+    ) -> None:
+        """
+        Args:
+            client: MQTT client
+            topic: Topic filter of text values
+            name: Name of the sensor
+            dispatcher: Shared dispatcher to receive messages from
+            history: History to append all values to
+            reading_topic: Topic filter of binary readings, its last level must
+                be `reading`. Not subscribed to if not given.
+            field: Field of binary readings to use, see `READING_FIELDS`
+        """
         self.client = client
         self.topic: str = topic
+        self.reading_topic = reading_topic
+        self._field_index = READING_FIELDS.index(field)
         self.name = name
+        self.dispatcher = dispatcher
+        self.history = history
+        self.changes = ChangeNotifier()
         self.id: str = None
-        self.value: float = None
         self.timestamp: Optional[datetime] = None
+        # Last sequence number of binary readings per device id
+        self.sequences: dict[str, int] = {}
+        self.lost: int = 0
+        self._lost = LOST_READINGS.labels(name)
+        VALUE_AGE.labels(name).set_function(self.age)
 
-    def update_from_message(self, message: aiomqtt.Message) -> None:
+    def age(self) -> Optional[float]:
+        """Seconds since the last value"""
+        if self.timestamp is None:
+            return None
+        return time.time() - self.timestamp.timestamp()
+
+    @property
+    def topics(self) -> list[str]:
+        if self.reading_topic is None:
+            return [self.topic]
+        return [self.topic, self.reading_topic]
+
+    def update_from_message(self, message: "aiomqtt.Message") -> None:
         """Update sensor with new values"""
         topic = message.topic.value
         topic_parts = topic.split("/")
-        self.id = topic_parts[0],
-        self.value = float(message.payload)
-        self.timestamp = datetime.now()
+        if self.reading_topic is not None and topic_parts[-1] == READING_LEVEL:
+            self._update_from_reading(
+                topic_parts[0], message.payload, message_timestamp(message)
+            )
+            return
+        timestamp = datetime.fromtimestamp(message_timestamp(message))
+        self._update(topic_parts[0], float(message.payload), timestamp)
+
+    def _update_from_reading(
+        self, device_id: str, payload: bytes, received: float
+    ) -> None:
+        version = payload[0] if payload else None
+        if version == READING_VERSION and len(payload) >= READING.size:
+            _, sequence, timestamp, *values = READING.unpack_from(payload)
+            self._update_sample(device_id, sequence, timestamp, values, received)
+        elif version == BATCH_VERSION and len(payload) >= BATCH_HEADER.size:
+            _, count, first = BATCH_HEADER.unpack_from(payload)
+            end = BATCH_HEADER.size + count * BATCH_RECORD.size
+            if len(payload) < end:
+                log.warning(f"Truncated batch from {device_id} to {self.name}")
+                return
+            records = BATCH_RECORD.iter_unpack(payload[BATCH_HEADER.size : end])
+            for i, (timestamp, *values) in enumerate(records):
+                sequence = (first + i) % SEQUENCE_MODULO
+                self._update_sample(device_id, sequence, timestamp, values, received)
+        else:
+            log.warning(f"Unknown reading format from {device_id} to {self.name}")
+
+    def _update_sample(
+        self,
+        device_id: str,
+        sequence: int,
+        timestamp: int,
+        values: list[float],
+        received: float,
+    ) -> None:
+        """Updates with one reading, at the time it was sampled if known"""
+        if not self._check_sequence(device_id, sequence):
+            return
+        value = values[self._field_index]
+        self._update(device_id, value, datetime.fromtimestamp(timestamp or received))
+
+    def _check_sequence(self, device_id: str, sequence: int) -> bool:
+        """Counts readings lost since the last one, False for a duplicate"""
+        last = self.sequences.get(device_id)
+        self.sequences[device_id] = sequence
+        if last is None:
+            return True
+        gap = (sequence - last) % SEQUENCE_MODULO
+        if gap == 0:
+            return False  # E.g. the retained reading again after resubscribing
+        if gap > SEQUENCE_MODULO // 2:
+            log.info(f"Device {device_id} of {self.name} restarted its sequence")
+        elif gap > 1:
+            self.lost += gap - 1
+            self._lost.inc(gap - 1)
+            log.warning(f"Lost {gap - 1} readings from {device_id} to {self.name}")
+        return True
+
+    def _update(self, device_id: str, value: float, timestamp: datetime) -> None:
+        if not math.isfinite(value):
+            log.debug(f"Ignored {value} from {device_id} on {self.name}")
+            return
+        self.id = device_id
+        self.value = value
+        self.timestamp = timestamp
+        self._record()
+
+    def _record(self) -> None:
+        """Passes the current value on to history and change watchers"""
+        if self.history is not None:
+            self.history.append(self.name, self.value, self.timestamp.timestamp())
+        self.changes.notify(self.name, self.value)
     
     def to_dict(self) -> dict:
         return dict(
@@ -42,11 +198,46 @@ class MQTTSensor:
             timestamp=self.timestamp.isoformat() if self.timestamp is not None else None
         )
 
+    def snapshot(self) -> dict:
+        """State to restore after a restart, see `controller.snapshot`"""
+        return dict(
+            id=self.id,
+            value=self.value,
+            timestamp=self.timestamp.timestamp() if self.timestamp is not None else None,
+            sequences=self.sequences,
+        )
+
+    def restore(self, state: dict, max_age: float) -> None:
+        """Restores a snapshot, values older than max_age seconds are skipped
+
+        Sequence numbers are always restored, so retained readings seen before
+        the restart are not counted again.
+        """
+        for device_id, sequence in state["sequences"].items():
+            self.sequences.setdefault(device_id, sequence)
+        if self.timestamp is not None or state["timestamp"] is None:
+            return  # Already updated, or nothing to restore
+        if time.time() - state["timestamp"] > max_age:
+            return
+        self._restore_value(state)
+
+    def _restore_value(self, state: dict) -> None:
+        self.id = state["id"]
+        self.value = state["value"]
+        self.timestamp = datetime.fromtimestamp(state["timestamp"])
+
 
     async def start_sensor(self) -> NoReturn:
-        await self.client.subscribe(self.topic)
+        topics = self.topics
+        if self.dispatcher is not None:
+            subscription = await self.dispatcher.subscribe_many(topics)
+            while True:
+                self.update_from_message(await subscription.get())
+
+        for topic in topics:
+            await self.client.subscribe(topic)
         async for message in self.client.messages:
-            if not message.topic.matches(self.topic):
+            if not any(message.topic.matches(topic) for topic in topics):
                 continue
             self.update_from_message(message)
 
@@ -54,3 +245,149 @@ class MQTTSensor:
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}(id={self.id})"
 
+
+
+class MQTTSensorGroup(MQTTSensor):
+    """Sensor aggregating the readings of all devices matching a topic
+
+    Readings are kept per device id, the first level of the topic, and the
+    aggregate is maintained on every update instead of computed on read. Devices
+    that have not published within `stale_timeout` are dropped.
+
+    Aggregates:
+        mean: Mean of all devices
+        weighted: Mean weighted by `weights` per device id, default weight 1
+        median: Median of all devices
+        min: Lowest reading of all devices
+    """
+
+    AGGREGATES = {"mean", "weighted", "median", "min"}
+
+    def __init__(
+        self,
+        client: "aiomqtt.Client",
+        topic: str,
+        name: str,
+        aggregate: str = "mean",
+        stale_timeout: Optional[float] = 600.0,
+        weights: Optional[dict[str, float]] = None,
+        dispatcher: Optional[MessageDispatcher] = None,
+        history: Optional[History] = None,
+        reading_topic: Optional[str] = None,
+        field: str = "temperature",
+    ) -> None:
+        if aggregate not in self.AGGREGATES:
+            raise ValueError(f"Aggregate must be one of {self.AGGREGATES}")
+        self.aggregate = aggregate
+        self.stale_timeout = stale_timeout
+        self.weights = weights or {}
+        # Device id to value and loop time of update, oldest update first
+        self.devices: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        # Values in order, O(n) to maintain so only kept for order statistics
+        self._keep_sorted = aggregate in ("median", "min")
+        self._sorted: list[float] = []
+        self._weighted_sum = 0.0
+        self._weight_total = 0.0
+        super().__init__(
+            client,
+            topic,
+            name,
+            dispatcher=dispatcher,
+            history=history,
+            reading_topic=reading_topic,
+            field=field,
+        )
+
+    @property
+    def value(self) -> Optional[float]:
+        """Aggregate of all devices that are not stale"""
+        self.expire()
+        if not self.devices:
+            return None
+        if self.aggregate == "min":
+            return self._sorted[0]
+        if self.aggregate == "median":
+            n = len(self._sorted)
+            middle = n // 2
+            if n % 2:
+                return self._sorted[middle]
+            return (self._sorted[middle - 1] + self._sorted[middle]) / 2
+        if not self._weight_total:
+            return None
+        return self._weighted_sum / self._weight_total
+
+    def _weight(self, device_id: str) -> float:
+        if self.aggregate == "weighted":
+            return self.weights.get(device_id, 1.0)
+        return 1.0
+
+    def _remove(self, device_id: str) -> None:
+        value, _ = self.devices.pop(device_id)
+        if self._keep_sorted:
+            del self._sorted[bisect_left(self._sorted, value)]
+        weight = self._weight(device_id)
+        self._weighted_sum -= weight * value
+        self._weight_total -= weight
+        if not self.devices:
+            # Avoid accumulating rounding errors
+            self._weighted_sum = self._weight_total = 0.0
+
+    def expire(self) -> None:
+        """Drops devices that have not been updated within the stale timeout"""
+        if self.stale_timeout is None:
+            return
+        limit = loop_time() - self.stale_timeout
+        while self.devices:
+            device_id, (_, updated) = next(iter(self.devices.items()))
+            if updated >= limit:
+                break
+            log.info(f"Dropped stale device {device_id} from {self.name}")
+            self._remove(device_id)
+
+    def _add(self, device_id: str, value: float, updated: float) -> None:
+        if device_id in self.devices:
+            self._remove(device_id)
+        self.devices[device_id] = (value, updated)
+        if self._keep_sorted:
+            insort(self._sorted, value)
+        weight = self._weight(device_id)
+        self._weighted_sum += weight * value
+        self._weight_total += weight
+
+    def _update(self, device_id: str, value: float, timestamp: datetime) -> None:
+        if not math.isfinite(value):
+            # A NaN would break the order of the sorted values
+            log.debug(f"Ignored {value} from {device_id} on {self.name}")
+            return
+        self._add(device_id, value, loop_time())
+        self.id = device_id
+        self.timestamp = timestamp
+        self._record()
+
+    def to_dict(self) -> dict:
+        return super().to_dict() | dict(
+            aggregate=self.aggregate,
+            devices={
+                device_id: value for device_id, (value, _) in self.devices.items()
+            },
+        )
+
+    def snapshot(self) -> dict:
+        # Loop times do not survive a restart, devices are kept in wall time
+        offset = time.time() - loop_time()
+        return super().snapshot() | dict(
+            devices={
+                device_id: (value, updated + offset)
+                for device_id, (value, updated) in self.devices.items()
+            }
+        )
+
+    def _restore_value(self, state: dict) -> None:
+        offset = time.time() - loop_time()
+        for device_id, (value, updated) in state["devices"].items():
+            if device_id not in self.devices:
+                self._add(device_id, value, updated - offset)
+        self.expire()
+        if self.devices:
+            self.id = state["id"]
+            self.timestamp = datetime.fromtimestamp(state["timestamp"])
@@ -0,0 +1,290 @@
+"""Offline replay of recorded MQTT traffic
+
+Recorded messages are fed to sensors, gateways and strategies through
+`ReplayClient`, a stand-in for `aiomqtt.Client`, on an event loop with a virtual
+clock. Whenever the loop has nothing to do it jumps straight to the next timer,
+so sleeps and strategy periods take no real time and a month of data replays in
+seconds. All publishes, e.g. writes from `set_variable`, are captured.
+
+Recordings are JSON lines with the epoch time, topic and payload of a message,
+read one line at a time:
+
+    {"t": 1700000000.0, "topic": "8cce4efb8623/HP/0007", "payload": "-3.5"}
+
+Binary payloads are given as hex with the key `payload_hex` instead.
+
+Example:
+
+    async def setup(client: ReplayClient) -> None:
+        dispatcher = MessageDispatcher(client)
+        rego = Rego1000(client, id="8cce4efb8623", dispatcher=dispatcher)
+        ...
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(dispatcher.run())
+            ...
+
+    client = run_replay(setup, ReplayClient("winter.jsonl"))
+    print(client.writes)
+"""
+
+import asyncio
+from collections import deque
+import json
+import logging
+from pathlib import Path
+import selectors
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    NoReturn,
+    Optional,
+)
+
+import aiomqtt
+
+from husdata.dispatcher import MessageDispatcher, message_timestamp
+
+log = logging.getLogger(__name__)
+
+
+class ReplayMessage(aiomqtt.Message):
+    """Message with the time it was recorded"""
+
+    def __init__(self, topic: str, payload: bytes, timestamp: float) -> None:
+        super().__init__(topic, payload, qos=0, retain=False, mid=0, properties=None)
+        self.timestamp = timestamp
+
+
+class Published:
+    """Message published during a replay"""
+
+    def __init__(self, timestamp: float, topic: str, payload: Any) -> None:
+        self.timestamp = timestamp
+        self.topic = topic
+        self.payload = payload
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(timestamp={self.timestamp}, "
+            f"topic={self.topic}, payload={self.payload})"
+        )
+
+
+def read_records(path: str | Path) -> Iterator[ReplayMessage]:
+    """Streams recorded messages from a JSON lines file"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "payload_hex" in record:
+                payload = bytes.fromhex(record["payload_hex"])
+            else:
+                payload = str(record["payload"]).encode("utf-8")
+            yield ReplayMessage(record["topic"], payload, float(record["t"]))
+
+
+def write_record(f, message: aiomqtt.Message, timestamp: float) -> None:
+    """Writes a message as a line of a recording"""
+    record: dict[str, Any] = {"t": timestamp, "topic": message.topic.value}
+    try:
+        record["payload"] = message.payload.decode("utf-8")
+    except UnicodeDecodeError:
+        record["payload_hex"] = message.payload.hex()
+    f.write(json.dumps(record) + "\n")
+
+
+async def record(
+    dispatcher: MessageDispatcher, path: str | Path, topic: str = "#"
+) -> NoReturn:
+    """Records live messages matching a topic to a JSON lines file"""
+    subscription = await dispatcher.subscribe(topic)
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            message = await subscription.get()
+            write_record(f, message, message_timestamp(message))
+
+
+class _VirtualClock:
+    def __init__(self, start: float) -> None:
+        self.now = start
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    """Selector that advances the virtual clock instead of waiting"""
+
+    def __init__(self, clock: _VirtualClock) -> None:
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout: Optional[float] = None):
+        events = super().select(0)
+        if events:
+            return events
+        if timeout is None:
+            # Nothing scheduled, only threads can wake the loop up
+            return super().select(None)
+        self._clock.now += timeout
+        return events
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """Event loop running on a virtual clock starting at `start` epoch seconds"""
+
+    def __init__(self, start: float = 0.0) -> None:
+        self._clock = _VirtualClock(start)
+        super().__init__(_VirtualTimeSelector(self._clock))
+        # Epoch based times have a precision of about a microsecond, timers closer
+        # than the resolution are run together so the clock always reaches them
+        self._clock_resolution = max(self._clock_resolution, 1e-6)
+
+    def time(self) -> float:
+        return self._clock.now
+
+
+class ReplayClient:
+    """Stand-in for `aiomqtt.Client` replaying recorded messages
+
+    All recorded messages are delivered, each at the virtual time it was recorded,
+    and consumers filter them by topic as with a shared client. Subscribing is
+    only recorded since subscriptions are usually made after the first message is
+    due.
+    """
+
+    def __init__(
+        self,
+        records: str | Path | Iterable[ReplayMessage],
+        echo_writes: bool = True,
+    ) -> None:
+        """
+        Args:
+            records: Path to a recording or an iterable of messages
+            echo_writes: Answer writes to an H60 with the new value on the register
+                topic, as the heat pump does when the value is applied
+        """
+        if isinstance(records, (str, Path)):
+            records = read_records(records)
+        self._records = iter(records)
+        self._first: Optional[ReplayMessage] = next(self._records, None)
+        self.echo_writes = echo_writes
+        self.published: list[Published] = []
+        self.finished = asyncio.Event()
+        self.subscriptions: list[str] = []
+        self._injected: deque[ReplayMessage] = deque()
+        self._has_injected = asyncio.Event()
+        self._iterator: Optional[AsyncIterator[aiomqtt.Message]] = None
+
+    @property
+    def start_time(self) -> float:
+        """Time of the first recorded message"""
+        return 0.0 if self._first is None else self._first.timestamp
+
+    @property
+    def writes(self) -> list[Published]:
+        """All writes to H60 registers, topics `{id}/HP/SET/{idx}`"""
+        return [p for p in self.published if "/HP/SET/" in p.topic]
+
+    async def __aenter__(self) -> "ReplayClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def subscribe(self, topic: str, *args, **kwargs) -> None:
+        self.subscriptions.append(topic)
+
+    async def unsubscribe(self, topic: str, *args, **kwargs) -> None:
+        self.subscriptions.remove(topic)
+
+    async def publish(self, topic: str, payload: Any = None, *args, **kwargs) -> None:
+        now = asyncio.get_running_loop().time()
+        self.published.append(Published(now, topic, payload))
+
+        parts = topic.split("/")
+        if self.echo_writes and len(parts) == 4 and parts[1:3] == ["HP", "SET"]:
+            echo_topic = f"{parts[0]}/HP/{parts[3]}"
+            self._injected.append(
+                ReplayMessage(echo_topic, str(payload).encode("utf-8"), now)
+            )
+            self._has_injected.set()
+
+    async def _wait_until(self, timestamp: float) -> None:
+        """Sleeps until a virtual time, wakes up early for injected messages"""
+        delay = timestamp - asyncio.get_running_loop().time()
+        if delay <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._has_injected.wait(), delay)
+        except TimeoutError:
+            pass
+
+    async def _messages(self) -> AsyncIterator[aiomqtt.Message]:
+        records = self._records
+        pending = self._first
+        while pending is not None or self._injected:
+            self._has_injected.clear()
+            while self._injected:
+                yield self._injected.popleft()
+
+            if pending is None:
+                continue
+            await self._wait_until(pending.timestamp)
+            if self._injected and self._has_injected.is_set():
+                continue  # Deliver injected messages first
+            yield pending
+            pending = next(records, None)
+
+        self.finished.set()
+
+    @property
+    def messages(self) -> AsyncIterator[aiomqtt.Message]:
+        """Iterator of all messages, shared between all consumers as in aiomqtt"""
+        if self._iterator is None:
+            self._iterator = self._messages()
+        return self._iterator
+
+
+def run_replay(
+    setup: Callable[[ReplayClient], Awaitable[Any]],
+    client: ReplayClient,
+    startup: float = 1.0,
+    settle: float = 0.0,
+) -> ReplayClient:
+    """Runs a setup coroutine against a replay until all messages are delivered
+
+    Args:
+        setup: Coroutine function starting everything under test with the client
+        client: Client replaying the recording
+        startup: Virtual seconds before the first message, for subscribing
+        settle: Virtual seconds to keep running after the last message
+
+    Returns:
+        The client with all published messages
+    """
+
+    async def replay() -> None:
+        task = asyncio.create_task(setup(client))
+        finished = asyncio.create_task(client.finished.wait())
+        await asyncio.wait({task, finished}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            finished.cancel()
+            task.result()  # Raises if setup failed
+            return
+        await asyncio.sleep(settle)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    loop = VirtualClockEventLoop(start=client.start_time - startup)
+    try:
+        loop.run_until_complete(replay())
+    finally:
+        loop.close()
+    log.info(f"Replay finished with {len(client.published)} published messages")
+    return client
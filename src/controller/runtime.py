@@ -0,0 +1,220 @@
+"""Sets up and runs the sensors, heat pumps and strategies of sites
+
+A site is a heat pump, identified by the id of its H60, and the temperature
+sensors of the rooms it heats. All sites given to `run_sites` share one MQTT
+client, dispatcher, history and scheduler on the current event loop. The client
+reconnects when the broker goes away, so sites keep their state.
+
+Stored history and snapshots are kept per site in `STORAGE_DIR/{id}`, so a site
+resumes from its own data whichever process it runs in.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+import aiomqtt
+
+from controller.config import Config
+from controller.connection import ConnectionManager
+from controller.exporter import MetricsServer
+from controller.mqtt import READING_LEVEL, MQTTSensorGroup
+from controller.scheduler import Scheduler
+from controller.snapshot import SnapshotStore
+from controller.storage import SiteStore
+from controller.strategies import (
+    OffsetOutdoorTemperatureStrategy,
+    PredictiveOffsetStrategy,
+)
+from controller.thermal import ThermalModel
+from husdata.dispatcher import MessageDispatcher
+from husdata.history import History
+from husdata.registry import GatewayRegistry
+from husdata.writer import WriteQueue
+
+
+def setup_site(
+    config: Config,
+    id: str,
+    sensor_topic: str,
+    gateways: GatewayRegistry,
+    scheduler: Scheduler,
+    dispatcher: MessageDispatcher,
+    history: History,
+    snapshots: Optional[SnapshotStore] = None,
+) -> MQTTSensorGroup:
+    """Creates the heat pump, sensor and strategy of a site
+
+    Args:
+        config: Configuration parameters
+        id: Id of the H60 of the site
+        sensor_topic: Topic filter of the temperature sensors of the site
+        gateways: Registry the heat pump is added to
+        scheduler: Scheduler the strategy is registered in
+        dispatcher: Shared dispatcher
+        history: Shared history
+        snapshots: Store the state of the site is restored from and saved to
+
+    Returns:
+        The temperature sensor of the site, to be started
+    """
+    reading_topic = None
+    if config.SENSOR_BINARY and sensor_topic.endswith("/temperature"):
+        reading_topic = sensor_topic.removesuffix("temperature") + READING_LEVEL
+    temperature_sensor = MQTTSensorGroup(
+        client=gateways.client,
+        topic=sensor_topic,
+        name=f"{id}/temperature",
+        aggregate=config.SENSOR_AGGREGATE,
+        stale_timeout=config.SENSOR_STALE_TIMEOUT,
+        dispatcher=dispatcher,
+        history=history,
+        reading_topic=reading_topic,
+    )
+    rego = gateways.add(id)
+    rego.write_queue = WriteQueue(
+        rego,
+        max_writes=config.WRITE_MAX_PER_PERIOD,
+        period=config.WRITE_BUDGET_PERIOD,
+        tolerance=config.WRITE_TOLERANCE,
+    )
+
+    if config.STRATEGY == "predictive":
+        strategy = PredictiveOffsetStrategy(
+            rego=rego,
+            temperature_sensor=temperature_sensor,
+            influence=config.STRATEGY_INFLUENCE,
+            sample_period=config.PREDICTIVE_SAMPLE_PERIOD,
+            control_period=config.STRATEGY_PERIOD,
+            horizon=config.PREDICTIVE_HORIZON,
+            offset_step=config.PREDICTIVE_OFFSET_STEP,
+            model=ThermalModel(
+                config.PREDICTIVE_SAMPLE_PERIOD,
+                forgetting=config.PREDICTIVE_FORGETTING,
+                min_samples=config.PREDICTIVE_MIN_SAMPLES,
+            ),
+            confirm_timeout=config.STRATEGY_CONFIRM_TIMEOUT,
+        )
+    else:
+        strategy = OffsetOutdoorTemperatureStrategy(
+            rego=rego,
+            temperature_sensor=temperature_sensor,
+            influence=config.STRATEGY_INFLUENCE,
+            period=config.STRATEGY_PERIOD,
+            confirm_timeout=config.STRATEGY_CONFIRM_TIMEOUT,
+        )
+    if snapshots is not None:
+        snapshots.register(f"{id}/rego", rego)
+        snapshots.register(f"{id}/temperature", temperature_sensor)
+        snapshots.register(f"{id}/offset_outdoor_temperature", strategy)
+    if isinstance(strategy, PredictiveOffsetStrategy) and not strategy.model.ready:
+        history_names = (
+            temperature_sensor.name,
+            rego.history_prefix + rego.ID.OUTDOOR,
+            rego.history_prefix + rego.ID.HEAT_CARRIER_FORWARD,
+        )
+        if all(name in history for name in history_names):
+            strategy.model.fit_history(
+                *(history[name] for name in history_names),
+                offset=history.get(rego.history_prefix + rego.ID.OUTDOOR_TEMP_OFFSET),
+            )
+    last_run = None
+    if strategy.last_trigger is not None:
+        # Restored, the heat pump already has the offset of the last run
+        last_run = strategy.last_trigger.timestamp()
+    scheduled = scheduler.register(
+        f"offset_outdoor_temperature/{id}",
+        strategy,
+        align=config.STRATEGY_ALIGN,
+        jitter=config.STRATEGY_JITTER,
+        last_run=last_run,
+    )
+    if config.STRATEGY_REACTIVE:
+        strategy.watch_inputs(
+            lambda key, value: scheduler.request_run(
+                scheduled.name, delay=config.STRATEGY_DEBOUNCE
+            ),
+            deadband=config.STRATEGY_DEADBAND,
+        )
+    return temperature_sensor
+
+
+async def run_sites(
+    config: Config,
+    sites: dict[str, str],
+    storage_dir: Optional[str] = None,
+    discover: bool = True,
+    metrics_port: Optional[int] = None,
+) -> None:
+    """Runs sites until cancelled
+
+    Args:
+        config: Configuration parameters
+        sites: Heat pump id to topic filter of its temperature sensors
+        storage_dir: Directory of the stored history and snapshots of the
+            sites, defaults to config
+        discover: Track heat pumps that are not in `sites` as well
+        metrics_port: Port of the metrics endpoint, defaults to config
+    """
+    client = ConnectionManager(
+        aiomqtt.Client(config.MQTT_HOST, username="climate-control"),
+        min_delay=config.MQTT_RECONNECT_MIN,
+        max_delay=config.MQTT_RECONNECT_MAX,
+        buffer_size=config.MQTT_OFFLINE_BUFFER_SIZE,
+        queue_size=config.MQTT_QUEUE_SIZE,
+    )
+    dispatcher = MessageDispatcher(client, maxsize=config.MQTT_QUEUE_SIZE)
+    storage_dir = storage_dir or config.STORAGE_DIR
+    store = SiteStore(
+        storage_dir,
+        segment_duration=config.STORAGE_SEGMENT_DURATION,
+        flush_interval=config.STORAGE_FLUSH_INTERVAL,
+    )
+    history = History(capacity=config.HISTORY_CAPACITY, sink=store)
+    store.load(history, sites, since=time.time() - config.STORAGE_RESUME_PERIOD)
+
+    gateways = GatewayRegistry(
+        client, dispatcher, history=history, discover=discover
+    )
+    scheduler = Scheduler()
+    snapshots: dict[str, SnapshotStore] = {}
+    if config.SNAPSHOT_ENABLED:
+        for id in sites:
+            snapshots[id] = SnapshotStore(
+                store.site_directory(id) / "snapshot.json",
+                interval=config.SNAPSHOT_INTERVAL,
+                max_age=config.SNAPSHOT_MAX_AGE,
+            )
+            snapshots[id].load()
+    sensors = [
+        setup_site(
+            config,
+            id,
+            sensor_topic,
+            gateways,
+            scheduler,
+            dispatcher,
+            history,
+            snapshots=snapshots.get(id),
+        )
+        for id, sensor_topic in sites.items()
+    ]
+
+    metrics = MetricsServer(config.HOST, metrics_port or config.PORT)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(client.run())
+            tg.create_task(metrics.run())
+            tg.create_task(dispatcher.run())
+            tg.create_task(store.run())
+            for site_snapshots in snapshots.values():
+                tg.create_task(site_snapshots.run())
+            tg.create_task(gateways.run())
+            for sensor in sensors:
+                tg.create_task(sensor.start_sensor())
+            for rego in list(gateways):
+                tg.create_task(rego.write_queue.run())
+            tg.create_task(scheduler.run())
+    finally:
+        store.close()
@@ -0,0 +1,226 @@
+"""Scheduling of strategies
+
+All registered strategies are scheduled from a single task using a heap of due
+times on the monotonic clock of the event loop. Next runs are computed from the
+previous due time and not from when a run finished, so the schedule does not
+drift with the execution time of the strategies. Each run is a separate task so
+a slow strategy does not delay the others.
+"""
+
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import NoReturn, Optional, Protocol
+
+from controller.exceptions import AlreadyRegisteredError, StrategyError
+from husdata.metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+TRIGGER_SECONDS = REGISTRY.histogram(
+    "strategy_trigger_seconds", "Duration of strategy triggers", ("strategy",)
+)
+
+
+class Strategy(Protocol):
+    async def trigger(self) -> None: ...
+
+
+class ScheduledStrategy:
+    def __init__(
+        self,
+        name: str,
+        strategy: Strategy,
+        period: float,
+        align: bool = False,
+        jitter: float = 0.0,
+    ) -> None:
+        self.name = name
+        self.strategy = strategy
+        self.period = period
+        self.align = align
+        self.jitter = jitter
+        self.next_run: float = 0.0
+        self.runs: int = 0
+        self.last_duration: Optional[float] = None
+        self.running: bool = False
+        self.rerun: bool = False  # Run requested while running
+        self.requested: Optional[float] = None  # Due time of requested run
+        self._duration = TRIGGER_SECONDS.labels(name)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name}, period={self.period})"
+
+
+class Scheduler:
+    """Runs many strategies periodically or on request from one task"""
+
+    def __init__(self) -> None:
+        self._strategies: dict[str, ScheduledStrategy] = {}
+        # Due time, tie breaker, strategy and if it is a periodic run
+        self._heap: list[tuple[float, int, ScheduledStrategy, bool]] = []
+        self._counter = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+
+    def register(
+        self,
+        name: str,
+        strategy: Strategy,
+        period: Optional[float] = None,
+        align: bool = False,
+        jitter: float = 0.0,
+        last_run: Optional[float] = None,
+    ) -> ScheduledStrategy:
+        """Registers a strategy to be triggered periodically
+
+        Args:
+            name: Unique name of the strategy
+            strategy: Strategy to trigger
+            period: Seconds between runs, defaults to `period` of the strategy
+            align: Align runs to multiples of the period in wall clock time, e.g.
+                on the hour for a period of 3600
+            jitter: Maximum random delay in seconds added to each run, spreading
+                strategies with equal periods
+            last_run: Unix time of the last run, e.g. before a restart. The first
+                run is then a period after it instead of now. Ignored if aligned.
+
+        Raises:
+            AlreadyRegisteredError: If a strategy with the name is registered
+        """
+        if name in self._strategies:
+            raise AlreadyRegisteredError(f"Strategy {name} is already registered")
+        if period is None:
+            period = getattr(strategy, "period", None)
+        if not period or period <= 0:
+            raise StrategyError(f"Strategy {name} needs a positive period")
+
+        scheduled = ScheduledStrategy(name, strategy, period, align, jitter)
+        self._strategies[name] = scheduled
+        scheduled.next_run = self._first_run(scheduled, last_run)
+        self._push(scheduled.next_run, scheduled, periodic=True)
+        return scheduled
+
+    def unregister(self, name: str) -> None:
+        """Removes a strategy, its entries in the heap are skipped when due"""
+        self._strategies.pop(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._strategies
+
+    def get(self, name: str) -> Optional[ScheduledStrategy]:
+        return self._strategies.get(name)
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _push(self, due: float, scheduled: ScheduledStrategy, periodic: bool) -> None:
+        self._counter += 1
+        heapq.heappush(self._heap, (due, self._counter, scheduled, periodic))
+        self._wakeup.set()
+
+    def _first_run(
+        self, scheduled: ScheduledStrategy, last_run: Optional[float] = None
+    ) -> float:
+        now = self._now()
+        if not scheduled.align:
+            if last_run is None:
+                return now
+            return now + max(0.0, last_run + scheduled.period - time.time())
+        # Map the next wall clock multiple of the period to the monotonic clock
+        wall = time.time()
+        return now + (-wall % scheduled.period)
+
+    def request_run(self, name: str, delay: float = 0.0) -> None:
+        """Requests an extra run of a strategy, e.g. on an input event
+
+        A new request replaces a pending one, so requests within `delay` of each
+        other are debounced into one run. The periodic schedule is kept.
+
+        Args:
+            name: Name of the strategy
+            delay: Seconds to wait before running
+        """
+        if name not in self._strategies:
+            raise StrategyError(f"Strategy {name} is not registered")
+        scheduled = self._strategies[name]
+        scheduled.requested = self._now() + delay
+        self._push(scheduled.requested, scheduled, periodic=False)
+
+    async def _run(self, scheduled: ScheduledStrategy) -> None:
+        scheduled.running = True
+        started = self._now()
+        try:
+            await scheduled.strategy.trigger()
+        except Exception:
+            log.exception(f"Strategy {scheduled.name} failed")
+        finally:
+            scheduled.running = False
+        scheduled.runs += 1
+        scheduled.last_duration = self._now() - started
+        scheduled._duration.observe(scheduled.last_duration)
+
+        if scheduled.rerun:
+            scheduled.rerun = False
+            scheduled.requested = self._now()
+            self._push(scheduled.requested, scheduled, periodic=False)
+
+    def _start(self, scheduled: ScheduledStrategy, periodic: bool) -> None:
+        if scheduled.running:
+            if periodic:
+                log.warning(f"Strategy {scheduled.name} still running, skips a run")
+            else:
+                scheduled.rerun = True
+            return
+        task = asyncio.create_task(self._run(scheduled))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _reschedule(self, scheduled: ScheduledStrategy) -> None:
+        """Schedules the next periodic run, skipping runs that were missed"""
+        now = self._now()
+        next_run = scheduled.next_run + scheduled.period
+        if next_run < now:
+            missed = int((now - next_run) // scheduled.period) + 1
+            next_run += missed * scheduled.period
+            log.warning(f"Strategy {scheduled.name} missed {missed} runs")
+        scheduled.next_run = next_run
+        due = next_run + random.uniform(0, scheduled.jitter)
+        self._push(due, scheduled, periodic=True)
+
+    async def run(self) -> NoReturn:
+        try:
+            await self._loop()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def _loop(self) -> NoReturn:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due, _, scheduled, periodic = self._heap[0]
+            delay = due - self._now()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if self._strategies.get(scheduled.name) is not scheduled:
+                continue  # Unregistered
+            if not periodic:
+                if due != scheduled.requested:
+                    continue  # Replaced by a later request
+                scheduled.requested = None
+
+            self._start(scheduled, periodic)
+            if periodic:
+                self._reschedule(scheduled)
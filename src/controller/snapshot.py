@@ -0,0 +1,122 @@
+"""Snapshots of controller state for warm restarts
+
+Sensors, heat pumps and strategies are saved periodically to one JSON file,
+written atomically so a crash never leaves a partial snapshot. At startup each
+object is restored from the snapshot as it is registered, unless the snapshot
+is older than `max_age`, so strategies resume with the last good values instead
+of waiting for retained messages.
+"""
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Any, NoReturn, Protocol
+
+from controller.storage import write_json_atomic
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+class Snapshottable(Protocol):
+    def snapshot(self) -> dict[str, Any]: ...
+
+    def restore(self, state: dict[str, Any], max_age: float) -> None: ...
+
+
+class SnapshotStore:
+    def __init__(
+        self, path: str | Path, interval: float = 60.0, max_age: float = 3600.0
+    ) -> None:
+        """
+        Args:
+            path: Snapshot file
+            interval: Seconds between snapshots
+            max_age: Snapshots and values older than this in seconds are not
+                restored
+        """
+        self.path = Path(path)
+        self.interval = interval
+        self.max_age = max_age
+        self._objects: dict[str, Snapshottable] = {}
+        self._loaded: dict[str, dict[str, Any]] = {}
+
+    def load(self) -> int:
+        """Reads the snapshot to restore objects from when registered
+
+        Returns:
+            Number of objects in the snapshot, 0 if missing or too old
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            log.warning(f"Could not read snapshot {self.path}: {e}")
+            return 0
+
+        age = time.time() - snapshot.get("time", 0)
+        if snapshot.get("version") != VERSION:
+            log.warning(f"Ignored snapshot of version {snapshot.get('version')}")
+        elif age > self.max_age:
+            log.info(f"Ignored snapshot from {age:.0f}s ago")
+        else:
+            self._loaded = snapshot["objects"]
+            log.info(f"Loaded snapshot of {len(self._loaded)} objects from {age:.0f}s ago")
+        return len(self._loaded)
+
+    def register(self, name: str, obj: Snapshottable) -> bool:
+        """Includes an object in snapshots and restores it from the loaded one
+
+        Returns:
+            True if the object was restored
+        """
+        self._objects[name] = obj
+        state = self._loaded.pop(name, None)
+        if state is None:
+            return False
+        try:
+            obj.restore(state, self.max_age)
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning(f"Could not restore {name} from snapshot: {e}")
+            return False
+        return True
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "version": VERSION,
+            "time": time.time(),
+            "objects": {name: obj.snapshot() for name, obj in self._objects.items()},
+        }
+
+    def save(self) -> None:
+        self._write(self.snapshot())
+
+    def _write(self, snapshot: dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.path, snapshot)
+
+    async def run(self) -> NoReturn:
+        """Saves snapshots periodically, and a last one when cancelled
+
+        A failed save is logged and retried at the next interval, the previous
+        snapshot is kept until then.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                # State is collected on the loop, only the I/O runs in a thread
+                snapshot = self.snapshot()
+                try:
+                    await asyncio.to_thread(self._write, snapshot)
+                except OSError as e:
+                    log.error(f"Could not save snapshot {self.path}: {e}")
+        finally:
+            try:
+                self.save()
+            except OSError as e:
+                log.error(f"Could not save last snapshot {self.path}: {e}")
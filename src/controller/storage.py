@@ -0,0 +1,370 @@
+"""Persistent storage of telemetry
+
+Samples are written as fixed-width binary records to append-only segment files,
+one segment per time period. Writes are buffered in memory and flushed with a
+single write and fsync per batch to spare the SD card. When running, full and
+rotated buffers are handed to a worker thread so the event loop never waits for
+the disk. Queries read the segments through memory maps.
+
+`SiteStore` keeps the segments of each site in a directory of its own, so the
+history of a site goes with it when it moves to another worker process.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+import struct
+import time
+from typing import Any, Iterable, Iterator, NoReturn, Optional
+
+from husdata.history import History
+
+log = logging.getLogger(__name__)
+
+# Signal id, epoch timestamp in milliseconds and value
+RECORD = struct.Struct("<Iqd")
+SEGMENT_SUFFIX = ".seg"
+SIGNALS_FILE = "signals.json"
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    """Writes JSON to a temporary file, syncs it and replaces the target"""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentStore:
+    """Append-only store of samples split into time based segment files
+
+    Each segment file is named after the epoch second its period starts. Samples
+    are written to the segment of their timestamp at the time of writing, a sample
+    arriving late is written to the current segment.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        segment_duration: int = 86400,
+        flush_interval: float = 60.0,
+        flush_size: int = 4096,
+    ) -> None:
+        """
+        Args:
+            directory: Directory of the segment files, created if missing
+            segment_duration: Time period in seconds covered by each segment
+            flush_interval: Seconds between periodic flushes when running
+            flush_size: Number of buffered records that triggers a flush
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_duration = segment_duration
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._signal_ids: dict[str, int] = self._read_signals()
+        self._signal_names = {idx: name for name, idx in self._signal_ids.items()}
+        self._buffer = bytearray()
+        self._segment_start: Optional[int] = None
+        # Segment start and records handed off to be written, oldest first
+        self._pending: list[tuple[int, bytes]] = []
+        self._writing: list[tuple[int, bytes]] = []  # Being written by run
+        self._signals_changed = False
+        self._wakeup = asyncio.Event()
+
+    def _read_signals(self) -> dict[str, int]:
+        path = self.directory / SIGNALS_FILE
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text())
+
+    def _signal_id(self, signal: str) -> int:
+        try:
+            return self._signal_ids[signal]
+        except KeyError:
+            idx = len(self._signal_ids)
+            self._signal_ids[signal] = idx
+            self._signal_names[idx] = signal
+            self._signals_changed = True
+            return idx
+
+    def _segment_path(self, start: int) -> Path:
+        return self.directory / f"{start:010d}{SEGMENT_SUFFIX}"
+
+    def segments(self) -> list[tuple[int, Path]]:
+        """Start time and path of all segments, oldest first"""
+        return sorted(
+            (int(path.stem), path)
+            for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+            if path.stem.isdigit()
+        )
+
+    def append(self, signal: str, timestamp: float, value: float) -> None:
+        """Buffers a sample to be written on next flush"""
+        segment_start = int(timestamp) - int(timestamp) % self.segment_duration
+        if self._segment_start is None:
+            self._segment_start = segment_start
+        elif segment_start > self._segment_start:
+            self._hand_off()
+            self._segment_start = segment_start
+
+        self._buffer += RECORD.pack(
+            self._signal_id(signal), int(timestamp * 1000), value
+        )
+        if len(self._buffer) >= self.flush_size * RECORD.size:
+            self._hand_off()
+
+    def _hand_off(self) -> None:
+        """Queues the buffer to be written by `run` or the next flush"""
+        if self._buffer:
+            self._pending.append(self._take_buffer())
+            self._wakeup.set()
+
+    def _take_buffer(self) -> tuple[Optional[int], bytes]:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return self._segment_start, data
+
+    def _take_pending(
+        self,
+    ) -> tuple[Optional[dict[str, int]], list[tuple[int, bytes]]]:
+        """Signal ids if changed and all records to write, the buffer included"""
+        signals = dict(self._signal_ids) if self._signals_changed else None
+        self._signals_changed = False
+        if self._buffer:
+            self._pending.append(self._take_buffer())
+        pending, self._pending = self._pending, []
+        return signals, pending
+
+    def _write_pending(
+        self, signals: Optional[dict[str, int]], pending: list[tuple[int, bytes]]
+    ) -> None:
+        """Writes signal ids before the records using them, safe in a thread
+
+        Records are removed from pending once written, so after an error it
+        only holds the records still to be written.
+        """
+        if signals is not None:
+            write_json_atomic(self.directory / SIGNALS_FILE, signals)
+        while pending:
+            self._write(*pending[0])
+            del pending[0]
+
+    def _requeue(
+        self, signals: Optional[dict[str, int]], pending: list[tuple[int, bytes]]
+    ) -> None:
+        """Queues records that failed to be written ahead of newer ones"""
+        self._pending[:0] = pending
+        self._signals_changed |= signals is not None
+
+    def _write(self, segment_start: int, data: bytes) -> None:
+        """Appends whole records to a segment and syncs it to disk
+
+        A failed write is cut off again, and a partial record left by an earlier
+        failure or crash is cut off before appending, so records stay aligned.
+        """
+        path = self._segment_path(segment_start)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.lseek(fd, 0, os.SEEK_END)
+            end = size - size % RECORD.size
+            if end != size:
+                log.warning(f"Removed partly written record at the end of {path}")
+                os.ftruncate(fd, end)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                os.fsync(fd)
+            except OSError:
+                with contextlib.suppress(OSError):
+                    os.ftruncate(fd, end)  # Written again on retry
+                raise
+        finally:
+            os.close(fd)
+
+    def flush(self) -> None:
+        """Writes all buffered records and syncs to disk, blocking"""
+        signals, pending = self._take_pending()
+        try:
+            self._write_pending(signals, pending)
+        except OSError:
+            self._requeue(signals, pending)
+            raise
+
+    def _records(self, path: Path) -> Iterator[tuple[int, int, float]]:
+        size = path.stat().st_size
+        size -= size % RECORD.size  # Skip partly written record
+        if size == 0:
+            return
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            records = RECORD.iter_unpack(memoryview(mm)[:size])
+            try:
+                yield from records
+            finally:
+                # Release the buffer before the map is closed
+                del records
+
+    def read(
+        self,
+        signal: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> Iterator[tuple[str, float, float]]:
+        """Reads stored samples, buffered samples not yet flushed included
+
+        Args:
+            signal: Only read samples of this signal, all signals if not given
+            start: Epoch time in seconds, inclusive
+            end: Epoch time in seconds, inclusive
+
+        Yields:
+            Signal name, timestamp in epoch seconds and value
+        """
+        signal_id = None
+        if signal is not None:
+            signal_id = self._signal_ids.get(signal)
+            if signal_id is None:
+                return
+        start_ms = None if start is None else int(start * 1000)
+        end_ms = None if end is None else int(end * 1000)
+
+        def matches(idx: int, ms: int) -> bool:
+            return (
+                (signal_id is None or idx == signal_id)
+                and (start_ms is None or ms >= start_ms)
+                and (end_ms is None or ms <= end_ms)
+            )
+
+        segments = self.segments()
+        for i, (segment_start, path) in enumerate(segments):
+            if end is not None and segment_start > end:
+                break
+            next_start = segments[i + 1][0] if i + 1 < len(segments) else None
+            if start is not None and next_start is not None and next_start <= start:
+                continue
+            for idx, ms, value in self._records(path):
+                if matches(idx, ms):
+                    yield self._signal_names[idx], ms / 1000, value
+
+        unwritten = [data for _, data in self._writing + self._pending]
+        for data in [*unwritten, bytes(self._buffer)]:
+            for idx, ms, value in RECORD.iter_unpack(data):
+                if matches(idx, ms):
+                    yield self._signal_names[idx], ms / 1000, value
+
+    def load(self, history: History, since: Optional[float] = None) -> int:
+        """Fills the ring buffers of a history with stored samples
+
+        Samples are added directly to the buffers and not passed on to the sink
+        of the history.
+
+        Returns:
+            Number of loaded samples
+        """
+        count = 0
+        for signal, timestamp, value in self.read(start=since):
+            history.buffer(signal).append(timestamp, value)
+            count += 1
+        log.info(f"Loaded {count} samples from {self.directory}")
+        return count
+
+    def close(self) -> None:
+        self.flush()
+
+    async def run(self) -> NoReturn:
+        """Writes records in a worker thread, periodically and when handed off
+
+        Records that failed to be written are kept and retried on the next
+        write, the ones written before the failure are not written again.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            signals, self._writing = self._take_pending()
+            if signals is None and not self._writing:
+                continue
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_pending, signals, self._writing)
+            except OSError as e:
+                log.error(f"Could not write storage, retries later: {e}")
+                self._requeue(signals, self._writing)
+            finally:
+                self._writing = []
+            log.debug(f"Flushed storage in {time.perf_counter() - started:.3f}s")
+
+
+class SiteStore:
+    """Segment stores of sites, one directory per site
+
+    Samples are routed by the site id their signal name starts with, e.g.
+    `{id}/temperature`, see `husdata.registry.GatewayRegistry`. A store is
+    created for a site when first used.
+    """
+
+    def __init__(self, directory: str | Path, **kwargs: Any) -> None:
+        """
+        Args:
+            directory: Directory of the site directories, created if missing
+            kwargs: Arguments of the `SegmentStore` of each site
+        """
+        self.directory = Path(directory)
+        self.stores: dict[str, SegmentStore] = {}
+        self._kwargs = kwargs
+        self._added = asyncio.Event()
+
+    def site_directory(self, site: str) -> Path:
+        return self.directory / site
+
+    def store(self, site: str) -> SegmentStore:
+        """Store of a site, created if not used before"""
+        try:
+            return self.stores[site]
+        except KeyError:
+            store = self.stores[site] = SegmentStore(
+                self.site_directory(site), **self._kwargs
+            )
+            self._added.set()
+            return store
+
+    def append(self, signal: str, timestamp: float, value: float) -> None:
+        self.store(signal.split("/", 1)[0]).append(signal, timestamp, value)
+
+    def load(
+        self, history: History, sites: Iterable[str], since: Optional[float] = None
+    ) -> int:
+        """Fills the ring buffers of a history with the stored samples of sites
+
+        Returns:
+            Number of loaded samples
+        """
+        return sum(self.store(site).load(history, since) for site in sites)
+
+    def close(self) -> None:
+        for store in self.stores.values():
+            store.close()
+
+    async def run(self) -> NoReturn:
+        """Runs the store of every site, including sites added later"""
+        running: set[str] = set()
+        async with asyncio.TaskGroup() as tg:
+            while True:
+                self._added.clear()
+                for site, store in list(self.stores.items()):
+                    if site not in running:
+                        running.add(site)
+                        tg.create_task(store.run())
+                await self._added.wait()
@@ -2,8 +2,11 @@ import asyncio
 from datetime import datetime
 from typing import NoReturn, Optional
 
-from controller.mqtt import MQTTSensor
+from controller.mqtt import MQTTSensor, loop_time
+from controller.thermal import ThermalModel
 from husdata.controllers import Rego1000
+from husdata.events import ChangeCallback
+from husdata.exceptions import WriteTimeoutError
 
 import logging
 
@@ -22,6 +25,7 @@ class OffsetOutdoorTemperatureStrategy():
         temperature_sensor: MQTTSensor,
         influence: float,
         period: int = 3600,
+        confirm_timeout: Optional[float] = None,
     ) -> None:
         self._rego = rego
         self._temperature_sensor = temperature_sensor
@@ -31,6 +35,7 @@ class OffsetOutdoorTemperatureStrategy():
         self.temperature_setpoint: Optional[float] = None
         self.last_trigger: Optional[datetime] = None
         self.period = period
+        self.confirm_timeout = confirm_timeout
 
     async def trigger(self) -> None:
         self._update_temperatures()
@@ -46,12 +51,20 @@ class OffsetOutdoorTemperatureStrategy():
             self.temperature_offest = (
                 self.temperature_indoor - self.temperature_setpoint
             ) * self.influence
+        await self._write_offset()
 
-        await self._rego.set_variable(
+    async def _write_offset(self) -> None:
+        handle = await self._rego.set_variable(
             self._rego.ID.OUTDOOR_TEMP_OFFSET, self.temperature_offest
         )
         self.last_trigger = datetime.now()
 
+        if self.confirm_timeout is not None:
+            try:
+                await handle.wait(self.confirm_timeout)
+            except WriteTimeoutError as e:
+                log.warning(e)
+
     def _update_temperatures(self) -> None:
         """Updates temperatuers needed for this strategy."""
         self.temperature_indoor = self._temperature_sensor.value
@@ -61,7 +74,185 @@ class OffsetOutdoorTemperatureStrategy():
         else:
             log.info("Could not update setpoint temperature, uses old value")
 
+    def snapshot(self) -> dict:
+        """State to restore after a restart, see `controller.snapshot`"""
+        return dict(
+            temperature_offest=self.temperature_offest,
+            temperature_indoor=self.temperature_indoor,
+            temperature_setpoint=self.temperature_setpoint,
+            last_trigger=(
+                self.last_trigger.isoformat() if self.last_trigger is not None else None
+            ),
+        )
+
+    def restore(self, state: dict, max_age: float) -> None:
+        """Restores the last offset and inputs if triggered within max_age seconds"""
+        if state["last_trigger"] is None:
+            return
+        last_trigger = datetime.fromisoformat(state["last_trigger"])
+        if (datetime.now() - last_trigger).total_seconds() > max_age:
+            return
+        self.last_trigger = last_trigger
+        self.temperature_offest = state["temperature_offest"]
+        self.temperature_indoor = state["temperature_indoor"]
+        self.temperature_setpoint = state["temperature_setpoint"]
+
+    def watch_inputs(self, callback: ChangeCallback, deadband: float = 0.0) -> None:
+        """Calls back when an input of the strategy changes more than deadband"""
+        self._temperature_sensor.changes.watch(callback, deadband=deadband)
+        self._rego.changes.watch(
+            callback, key=self._rego.ID.ROOM_TEMP_SETPOINT, deadband=deadband
+        )
+
     async def start(self) -> NoReturn:
         while True:
             await self.trigger()
             await asyncio.sleep(self.period)
+
+
+class PredictiveOffsetStrategy(OffsetOutdoorTemperatureStrategy):
+    """
+    Chooses the outdoor temperature offset from predictions of a thermal model
+    of the building, fitted online from the indoor, outdoor and supply
+    temperatures, see `controller.thermal`.
+
+    Triggered every `sample_period` to fit the model, and every
+    `control_period` a new offset is chosen over a receding horizon. A heavy
+    floor heating slab responds hours after a change, which the proportional
+    strategy overshoots on. Until the model is ready the offset is proportional
+    as in `OffsetOutdoorTemperatureStrategy`.
+
+    Both periods are measured on the clock of the event loop, so a replay on a
+    virtual clock samples and controls as the live controller would.
+    """
+
+    def __init__(
+        self,
+        rego: Rego1000,
+        temperature_sensor: MQTTSensor,
+        influence: float,
+        sample_period: float = 60.0,
+        control_period: float = 3600.0,
+        horizon: float = 6 * 3600.0,
+        offset_step: float = 1.0,
+        model: Optional[ThermalModel] = None,
+        confirm_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            rego: Heat pump to control
+            temperature_sensor: Indoor temperature sensor
+            influence: Influence of the proportional offset used until the
+                model is ready
+            sample_period: Seconds between triggers, and samples of the model
+            control_period: Seconds between new offsets
+            horizon: Seconds of predictions an offset is chosen over
+            offset_step: Resolution of the offsets
+            model: Thermal model, e.g. fitted from history, a new one if not
+                given
+            confirm_timeout: Seconds to wait for the heat pump to confirm a write
+        """
+        super().__init__(
+            rego,
+            temperature_sensor,
+            influence,
+            period=sample_period,
+            confirm_timeout=confirm_timeout,
+        )
+        self.control_period = control_period
+        self.horizon = horizon
+        self.offset_step = offset_step
+        self.model = model or ThermalModel(sample_period)
+        self.temperature_outdoor: Optional[float] = None
+        self.temperature_supply: Optional[float] = None
+        self._last_sample: Optional[float] = None  # Loop time
+        self._last_control: Optional[float] = None  # Loop time of last offset
+
+    async def trigger(self) -> None:
+        self._update_temperatures()
+        self._sample()
+        if (
+            self._last_control is not None
+            and loop_time() - self._last_control < self.control_period
+        ):
+            return
+
+        inputs = (
+            self.temperature_indoor,
+            self.temperature_outdoor,
+            self.temperature_supply,
+            self.temperature_setpoint,
+        )
+        if not self.model.ready or None in inputs:
+            log.info("Thermal model not ready, uses proportional offset")
+            await super().trigger()
+            return
+
+        self.temperature_offest = self.model.best_offset(
+            self.temperature_indoor,
+            self.temperature_outdoor,
+            self.temperature_supply,
+            self.temperature_setpoint,
+            current_offset=self._applied_offset(),
+            horizon=self.horizon,
+            step=self.offset_step,
+        )
+        log.info(f"Predicted best offset {self.temperature_offest} with {inputs=}")
+        await self._write_offset()
+
+    async def _write_offset(self) -> None:
+        started = loop_time()
+        await super()._write_offset()
+        self._last_control = started
+
+    def _update_temperatures(self) -> None:
+        super()._update_temperatures()
+        self.temperature_outdoor = self._number(self._rego.ID.OUTDOOR)
+        self.temperature_supply = self._number(self._rego.ID.HEAT_CARRIER_FORWARD)
+
+    def _number(self, idx: str) -> Optional[float]:
+        value = self._rego.get_variable(idx)
+        if isinstance(value, (int, float)):
+            return float(value)
+        return None
+
+    def _applied_offset(self) -> float:
+        """Offset reported by the heat pump, the last one written if not known"""
+        offset = self._number(self._rego.ID.OUTDOOR_TEMP_OFFSET)
+        return self.temperature_offest if offset is None else offset
+
+    def _sample(self) -> None:
+        """Fits the model with the current temperatures, one per sample period
+
+        Extra triggers, e.g. on input changes, are not sampled and after a gap
+        the model starts over from the next sample.
+        """
+        now = loop_time()
+        period = self.model.sample_period
+        if self._last_sample is not None and now - self._last_sample < period / 2:
+            return
+        if self._last_sample is None or now - self._last_sample > period * 1.5:
+            self.model.reset()
+        self._last_sample = now
+
+        values = (
+            self.temperature_indoor,
+            self.temperature_outdoor,
+            self.temperature_supply,
+        )
+        if None in values:
+            self.model.reset()
+            return
+        self.model.update(*values, self._applied_offset())
+
+    def snapshot(self) -> dict:
+        return super().snapshot() | dict(model=self.model.snapshot())
+
+    def restore(self, state: dict, max_age: float) -> None:
+        """Restores the model, and the last offset if within max_age seconds"""
+        self.model.restore(state["model"])
+        super().restore(state, max_age)
+        if self.last_trigger is not None:
+            # The control period continues from the last offset before restart
+            age = (datetime.now() - self.last_trigger).total_seconds()
+            self._last_control = loop_time() - age
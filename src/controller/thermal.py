@@ -0,0 +1,278 @@
+"""Online thermal model of a building for predictive control
+
+The model is fitted one sample at a time with recursive least squares, so an
+update costs the same however much history has been seen. Two linear models
+are fitted, each on samples `sample_period` seconds apart:
+
+Heating curve, the supply temperature the heat pump settles at given the
+outdoor temperature it sees, i.e. the measured one plus the offset:
+
+    supply[k+1] = p0 + p1 * supply[k] + p2 * (outdoor[k] + offset[k])
+
+Building, an ARX model of the indoor temperature where the previous change
+carries the inertia of e.g. a floor heating slab:
+
+    dT[k+1] = a * (outdoor[k] - T[k]) + b * (supply[k] - T[k]) + d * dT[k] + c
+
+`ThermalModel.best_offset` simulates both over a horizon for every candidate
+offset and picks the one that keeps the indoor temperature closest to the
+setpoint.
+"""
+
+import logging
+import math
+from typing import Optional, Sequence
+
+from husdata.history import RingBuffer
+
+log = logging.getLogger(__name__)
+
+OFFSET_LIMIT = 10.0  # Rego 1000 accepts offsets within ±10 °C
+
+
+class RecursiveLeastSquares:
+    """Linear least squares fitted one sample at a time with forgetting
+
+    Each update is O(n²) in the number of parameters, which is fixed and small.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        forgetting: float = 0.999,
+        delta: float = 100.0,
+        max_trace: float = 1e6,
+    ) -> None:
+        """
+        Args:
+            n: Number of parameters
+            forgetting: Weight of the previous samples per new sample, 1 to
+                never forget. The memory is about 1 / (1 - forgetting) samples.
+            delta: Initial variance of the parameters, large for fast learning
+            max_trace: Stops forgetting when the covariance grows this large,
+                avoiding wind-up while the inputs do not change
+        """
+        self.n = n
+        self.forgetting = forgetting
+        self.max_trace = max_trace
+        self.theta: list[float] = [0.0] * n
+        self.P: list[list[float]] = [
+            [delta if i == j else 0.0 for j in range(n)] for i in range(n)
+        ]
+        self.samples: int = 0
+
+    def predict(self, x: Sequence[float]) -> float:
+        return sum(t * xi for t, xi in zip(self.theta, x))
+
+    def update(self, x: Sequence[float], y: float) -> float:
+        """Fits a sample
+
+        Returns:
+            Error of the prediction before the update
+        """
+        n = self.n
+        P = self.P
+        Px = [sum(P[i][j] * x[j] for j in range(n)) for i in range(n)]
+        denominator = self.forgetting + sum(xi * pxi for xi, pxi in zip(x, Px))
+        gain = [pxi / denominator for pxi in Px]
+        error = y - self.predict(x)
+        for i in range(n):
+            self.theta[i] += gain[i] * error
+
+        trace = sum(P[i][i] for i in range(n))
+        forgetting = self.forgetting if trace < self.max_trace else 1.0
+        for i in range(n):
+            for j in range(n):
+                P[i][j] = (P[i][j] - gain[i] * Px[j]) / forgetting
+        self.samples += 1
+        return error
+
+    def snapshot(self) -> dict:
+        return dict(theta=self.theta, P=self.P, samples=self.samples)
+
+    def restore(self, state: dict) -> None:
+        if len(state["theta"]) != self.n:
+            raise ValueError(f"Expected {self.n} parameters")
+        self.theta = [float(t) for t in state["theta"]]
+        self.P = [[float(p) for p in row] for row in state["P"]]
+        self.samples = state["samples"]
+
+
+class ThermalModel:
+    """Heating curve and building model fitted from periodic samples"""
+
+    def __init__(
+        self,
+        sample_period: float = 60.0,
+        forgetting: float = 0.999,
+        min_samples: int = 720,
+    ) -> None:
+        """
+        Args:
+            sample_period: Seconds between samples passed to `update`
+            forgetting: Forgetting factor of the fits, see `RecursiveLeastSquares`
+            min_samples: Samples before the model is used for predictions
+        """
+        self.sample_period = sample_period
+        self.min_samples = min_samples
+        self.curve = RecursiveLeastSquares(3, forgetting)
+        self.building = RecursiveLeastSquares(4, forgetting)
+        # Previous sample of indoor, outdoor, supply and offset
+        self._previous: Optional[tuple[float, float, float, float]] = None
+        self._change: float = 0.0
+
+    @property
+    def ready(self) -> bool:
+        """Enough samples fitted and a physically plausible building model"""
+        if min(self.curve.samples, self.building.samples) < self.min_samples:
+            return False
+        a, b, d, _ = self.building.theta
+        _, p1, p2 = self.curve.theta
+        # Heat is lost outdoors and gained from the supply, both are stable, and
+        # the heat pump supplies less the warmer it sees it is outdoors
+        return a > 0 and b > 0 and abs(d) < 1 and abs(p1) < 1 and p2 < 0
+
+    def reset(self) -> None:
+        """Forgets the previous sample, e.g. after a gap in the data"""
+        self._previous = None
+        self._change = 0.0
+
+    def update(
+        self, indoor: float, outdoor: float, supply: float, offset: float
+    ) -> None:
+        """Fits a sample taken `sample_period` after the previous one"""
+        if self._previous is not None:
+            last_indoor, last_outdoor, last_supply, last_offset = self._previous
+            self.curve.update(
+                self._curve_inputs(last_supply, last_outdoor + last_offset), supply
+            )
+            change = indoor - last_indoor
+            self.building.update(
+                self._building_inputs(last_indoor, last_outdoor, last_supply),
+                change,
+            )
+            self._change = change
+        self._previous = (indoor, outdoor, supply, offset)
+
+    def _curve_inputs(self, supply: float, seen_outdoor: float) -> list[float]:
+        return [1.0, supply, seen_outdoor]
+
+    def _building_inputs(
+        self, indoor: float, outdoor: float, supply: float
+    ) -> list[float]:
+        return [outdoor - indoor, supply - indoor, self._change, 1.0]
+
+    def predict(
+        self,
+        indoor: float,
+        outdoor: float,
+        supply: float,
+        offset: float,
+        steps: int,
+    ) -> list[float]:
+        """Indoor temperatures of the coming samples with a constant offset
+
+        The outdoor temperature is assumed to stay the same.
+        """
+        change = self._change
+        p0, p1, p2 = self.curve.theta
+        a, b, d, c = self.building.theta
+        seen_outdoor = outdoor + offset
+        temperatures = []
+        for _ in range(steps):
+            change = a * (outdoor - indoor) + b * (supply - indoor) + d * change + c
+            supply = p0 + p1 * supply + p2 * seen_outdoor
+            indoor += change
+            temperatures.append(indoor)
+        return temperatures
+
+    def best_offset(
+        self,
+        indoor: float,
+        outdoor: float,
+        supply: float,
+        setpoint: float,
+        current_offset: float,
+        horizon: float,
+        step: float = 1.0,
+        change_penalty: float = 0.01,
+    ) -> float:
+        """Offset minimizing the predicted setpoint error over a horizon
+
+        Candidates are the offsets from -`OFFSET_LIMIT` to `OFFSET_LIMIT` in
+        steps of `step`, each held over the horizon. Only the first is applied
+        before the search is repeated with new measurements.
+
+        Args:
+            indoor: Indoor temperature
+            outdoor: Measured outdoor temperature
+            supply: Supply temperature
+            setpoint: Indoor temperature setpoint
+            current_offset: Offset applied now
+            horizon: Seconds to predict, the longer the slower the building
+            step: Resolution of the candidate offsets
+            change_penalty: Cost per squared degree of offset change relative
+                to a squared degree of indoor error per sample, avoiding writes
+                that barely improve anything
+        """
+        steps = max(1, math.ceil(horizon / self.sample_period))
+        candidates = int(OFFSET_LIMIT // step)
+        best, best_cost = current_offset, math.inf
+        for i in range(-candidates, candidates + 1):
+            offset = i * step
+            predicted = self.predict(indoor, outdoor, supply, offset, steps)
+            cost = sum((t - setpoint) ** 2 for t in predicted)
+            cost += change_penalty * steps * (offset - current_offset) ** 2
+            if cost < best_cost:
+                best, best_cost = offset, cost
+        return best
+
+    def fit_history(
+        self,
+        indoor: RingBuffer,
+        outdoor: RingBuffer,
+        supply: RingBuffer,
+        offset: Optional[RingBuffer] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> int:
+        """Fits samples resampled from recorded history, e.g. at startup
+
+        Args:
+            indoor: Indoor temperatures
+            outdoor: Outdoor temperatures
+            supply: Supply temperatures
+            offset: Applied offsets, 0 if not recorded
+            start: Epoch time in seconds, from the oldest indoor sample if not
+                given
+            end: Epoch time in seconds, to the latest indoor sample if not given
+
+        Returns:
+            Number of samples fitted
+        """
+        timestamps, _ = indoor.window(start, end)
+        if not timestamps:
+            return 0
+        fitted = 0
+        t = timestamps[0]
+        while t <= timestamps[-1]:
+            values = [
+                buffer.value_at(t) if buffer is not None else 0.0
+                for buffer in (indoor, outdoor, supply, offset)
+            ]
+            if None in values:
+                self.reset()
+            else:
+                self.update(*values)
+                fitted += 1
+            t += self.sample_period
+        self.reset()
+        log.info(f"Fitted thermal model with {fitted} samples of history")
+        return fitted
+
+    def snapshot(self) -> dict:
+        return dict(curve=self.curve.snapshot(), building=self.building.snapshot())
+
+    def restore(self, state: dict) -> None:
+        self.curve.restore(state["curve"])
+        self.building.restore(state["building"])
@@ -0,0 +1,168 @@
+"""Parameter sweeps of strategies over historical data
+
+Evaluates `OffsetOutdoorTemperatureStrategy` for a grid of `influence` and
+`period` candidates at once using NumPy. The offset of each candidate is the
+indoor temperature error at its latest trigger multiplied by the influence and
+clamped to the limits of the Rego 1000.
+
+The metrics are open loop, the recorded indoor temperature does not respond to
+the candidates. Use them to rank candidates and the replay harness to run the
+strategy in full.
+
+Requires the `analysis` extra, i.e. NumPy.
+"""
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError(
+        "controller.tuning requires numpy, install the analysis extra"
+    ) from e
+
+OFFSET_LIMIT = 10.0  # Rego 1000 accepts offsets within ±10 °C
+MAX_CHUNK_ELEMENTS = 1 << 22
+
+METRICS = (
+    "mean_offset",
+    "offset_degree_hours",
+    "saturated_fraction",
+    "tracking_rms",
+    "writes_per_day",
+)
+
+
+def _errors(indoor: np.ndarray, setpoint: np.ndarray) -> np.ndarray:
+    """Indoor temperature error, zero where a value is missing as in the strategy"""
+    indoor = np.asarray(indoor, dtype=np.float64)
+    setpoint = np.asarray(setpoint, dtype=np.float64)
+    if indoor.shape != setpoint.shape or indoor.ndim != 1:
+        raise ValueError("indoor and setpoint must be 1-d arrays of equal length")
+    return np.nan_to_num(indoor - setpoint, nan=0.0)
+
+
+def _trigger_steps(period: float, sample_period: float) -> int:
+    return max(1, int(round(period / sample_period)))
+
+
+def offset_series(
+    indoor: np.ndarray,
+    setpoint: np.ndarray,
+    influence: float,
+    period: float,
+    sample_period: float = 60.0,
+) -> np.ndarray:
+    """Offset applied by the strategy at every sample for one candidate
+
+    Args:
+        indoor: Indoor temperature per sample, NaN where missing
+        setpoint: Room temperature setpoint per sample, NaN where missing
+        influence: Influence of the strategy
+        period: Seconds between triggers of the strategy
+        sample_period: Seconds between samples
+    """
+    errors = _errors(indoor, setpoint)
+    steps = _trigger_steps(period, sample_period)
+    held = np.repeat(errors[::steps], steps)[: errors.size]
+    return np.clip(held * influence, -OFFSET_LIMIT, OFFSET_LIMIT)
+
+
+class SweepResult:
+    """Metrics per candidate, arrays indexed by period and influence
+
+    Metrics:
+        mean_offset: Mean applied offset in °C. Positive offsets make the heat
+            pump see a warmer outdoor temperature and reduce heating.
+        offset_degree_hours: Sum of the applied offset over time in °C·h, a
+            proxy of the change in heating energy
+        saturated_fraction: Fraction of time the offset is at its limits and
+            the strategy has no authority left
+        tracking_rms: RMS difference in °C between the applied offset and the
+            offset an instant unclamped strategy would apply, a comfort proxy
+        writes_per_day: Number of offset changes per day
+    """
+
+    def __init__(
+        self, influences: np.ndarray, periods: np.ndarray, metrics: dict
+    ) -> None:
+        self.influences = influences
+        self.periods = periods
+        self.metrics = metrics
+
+    def __getitem__(self, metric: str) -> np.ndarray:
+        return self.metrics[metric]
+
+    def best(self, metric: str, minimize: bool = True) -> tuple[float, float]:
+        """Period and influence of the best candidate for a metric"""
+        values = self.metrics[metric]
+        index = np.nanargmin(values) if minimize else np.nanargmax(values)
+        i, j = np.unravel_index(index, values.shape)
+        return float(self.periods[i]), float(self.influences[j])
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(periods={self.periods.size}, "
+            f"influences={self.influences.size})"
+        )
+
+
+def sweep(
+    indoor: np.ndarray,
+    setpoint: np.ndarray,
+    influences: np.ndarray,
+    periods: np.ndarray,
+    sample_period: float = 60.0,
+    write_tolerance: float = 0.05,
+) -> SweepResult:
+    """Evaluates all combinations of influence and period candidates
+
+    Args:
+        indoor: Indoor temperature per sample, NaN where missing
+        setpoint: Room temperature setpoint per sample, NaN where missing
+        influences: Influence candidates
+        periods: Candidates of seconds between triggers
+        sample_period: Seconds between samples
+        write_tolerance: Offset changes within tolerance are not counted as
+            writes, as in the write queue
+    """
+    errors = _errors(indoor, setpoint)
+    influences = np.atleast_1d(np.asarray(influences, dtype=np.float64))
+    periods = np.atleast_1d(np.asarray(periods, dtype=np.float64))
+    n = errors.size
+    if n == 0:
+        raise ValueError("History is empty")
+    days = n * sample_period / 86400
+    shape = (periods.size, influences.size)
+    metrics = {name: np.empty(shape) for name in METRICS}
+    chunk = max(1, MAX_CHUNK_ELEMENTS // n)
+
+    for i, period in enumerate(periods):
+        steps = _trigger_steps(period, sample_period)
+        triggered = errors[::steps]
+        # Number of samples each triggered offset is held
+        counts = np.full(triggered.size, steps, dtype=np.float64)
+        counts[-1] = n - steps * (triggered.size - 1)
+        held = np.repeat(triggered, steps)[:n]
+
+        for start in range(0, influences.size, chunk):
+            gains = influences[start : start + chunk, None]
+            columns = slice(start, start + gains.shape[0])
+
+            offsets = np.clip(triggered * gains, -OFFSET_LIMIT, OFFSET_LIMIT)
+            weighted = offsets @ counts
+            metrics["mean_offset"][i, columns] = weighted / n
+            metrics["offset_degree_hours"][i, columns] = (
+                weighted * sample_period / 3600
+            )
+            saturated = (np.abs(offsets) >= OFFSET_LIMIT) @ counts
+            metrics["saturated_fraction"][i, columns] = saturated / n
+            changes = np.abs(np.diff(offsets, axis=1)) > write_tolerance
+            metrics["writes_per_day"][i, columns] = (1 + changes.sum(axis=1)) / days
+
+            # Instant unclamped offset minus applied offset at every sample
+            deviation = errors * gains
+            deviation -= np.clip(held * gains, -OFFSET_LIMIT, OFFSET_LIMIT)
+            metrics["tracking_rms"][i, columns] = np.sqrt(
+                np.einsum("ij,ij->i", deviation, deviation) / n
+            )
+
+    return SweepResult(influences, periods, metrics)
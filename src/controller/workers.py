@@ -0,0 +1,296 @@
+"""Sharded runtime spreading sites over worker processes
+
+Sites are assigned to shards by a stable hash of the heat pump id, and each
+shard is served by a worker process with its own event loop, MQTT client and
+subscriptions for only its heat pumps and sensors. Parsing, conversion and
+strategies of many sites then use all cores of the host.
+
+The `Supervisor` in the main process watches the heartbeat of every worker and
+restarts workers that died or stopped responding. A worker that keeps failing
+is retired and its sites are reassigned to the remaining workers.
+
+Workers run with the configuration of the main process, including overrides
+from the command line, instead of reading it again. History and snapshots are
+stored per site, see `controller.runtime`, so reassigned sites keep their data.
+Worker `i` serves its metrics on port `PORT + 1 + i`.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing.context import BaseContext
+import os
+import signal
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+import zlib
+
+from controller.exceptions import WorkerError
+from husdata.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from controller.config import Config
+
+log = logging.getLogger(__name__)
+
+RESTARTS = REGISTRY.counter(
+    "worker_restarts_total", "Restarts of worker processes", ("worker",)
+)
+
+# Called with config, worker index, sites, shared heartbeat value and heartbeat
+# interval
+WorkerTarget = Callable[[Any, int, dict[str, str], Any, float], None]
+
+
+def shard_for(id: str, shards: int) -> int:
+    """Stable shard of a heat pump id, the same in every process and run"""
+    return zlib.crc32(id.encode("utf-8")) % shards
+
+
+def assign_shards(sites: dict[str, str], shards: int) -> list[dict[str, str]]:
+    """Splits sites, heat pump id to sensor topic, into shards"""
+    if shards < 1:
+        raise ValueError("Number of shards must be at least 1")
+    assigned: list[dict[str, str]] = [{} for _ in range(shards)]
+    for id, sensor_topic in sites.items():
+        assigned[shard_for(id, shards)][id] = sensor_topic
+    return assigned
+
+
+async def _beat(heartbeat, interval: float) -> None:
+    while True:
+        heartbeat.value = time.monotonic()
+        await asyncio.sleep(interval)
+
+
+async def _serve(
+    config, index: int, sites: dict[str, str], heartbeat, interval: float
+) -> None:
+    from controller.runtime import run_sites
+
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    async with asyncio.TaskGroup() as tg:
+        # Beats from the same loop so a blocked loop is detected as well
+        tg.create_task(_beat(heartbeat, interval))
+        tg.create_task(
+            run_sites(
+                config,
+                sites,
+                discover=False,
+                metrics_port=config.PORT + 1 + index,
+            )
+        )
+
+
+async def _exited(
+    process: multiprocessing.process.BaseProcess,
+    timeout: Optional[float] = None,
+    poll_interval: float = 0.05,
+) -> bool:
+    """Waits for a process to exit, False if still alive after timeout seconds"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while process.is_alive():
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(poll_interval)
+    return True
+
+
+def run_worker(
+    config: "Config", index: int, sites: dict[str, str], heartbeat, interval: float
+) -> None:
+    """Entry point of a worker process serving a shard of sites"""
+    from controller.logs import setup_logging_from_config
+
+    if config.LOG_FILE is not None:
+        # Rotation is not safe with several processes writing the same file
+        root, ext = os.path.splitext(config.LOG_FILE)
+        setup_logging_from_config(config, filename=f"{root}_worker-{index}{ext}")
+    else:
+        setup_logging_from_config(config)
+    log.info(f"Worker {index} started with sites {list(sites)}")
+    try:
+        asyncio.run(_serve(config, index, sites, heartbeat, interval))
+    except asyncio.CancelledError:
+        log.info(f"Worker {index} stopped")
+
+
+class Worker:
+    """Worker process of the supervisor and the sites assigned to it"""
+
+    def __init__(self, index: int, sites: dict[str, str]) -> None:
+        self.index = index
+        self.sites = sites
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.heartbeat = None
+        self.started: Optional[float] = None  # Monotonic time of last spawn
+        self.restarts: int = 0
+        self.retired: bool = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(index={self.index}, sites={len(self.sites)}, "
+            f"restarts={self.restarts}, retired={self.retired})"
+        )
+
+
+class Supervisor:
+    def __init__(
+        self,
+        sites: dict[str, str],
+        config: Optional["Config"] = None,
+        workers: int = os.cpu_count() or 1,
+        heartbeat_interval: float = 5.0,
+        heartbeat_timeout: float = 30.0,
+        max_restarts: int = 5,
+        stable_period: float = 3600.0,
+        target: WorkerTarget = run_worker,
+        context: Optional[BaseContext] = None,
+    ) -> None:
+        """
+        Args:
+            sites: Heat pump id to topic filter of its temperature sensors
+            config: Configuration the workers run with, passed to the target
+            workers: Number of worker processes
+            heartbeat_interval: Seconds between heartbeats and health checks
+            heartbeat_timeout: Seconds without heartbeat before a worker is
+                restarted, also the time a worker gets to start up
+            max_restarts: Restarts of a worker before its sites are reassigned
+            stable_period: Seconds a worker has to run healthy before its
+                restarts are forgotten, so occasional crashes never add up to
+                retirement
+            target: Function run by the worker processes
+            context: Multiprocessing context, defaults to spawn
+        """
+        self.config = config
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_restarts = max_restarts
+        self.stable_period = stable_period
+        self.target = target
+        self.context = context or multiprocessing.get_context("spawn")
+        self.workers = [
+            Worker(index, shard)
+            for index, shard in enumerate(assign_shards(sites, workers))
+        ]
+
+    @property
+    def active(self) -> list[Worker]:
+        """Workers that are not retired"""
+        return [worker for worker in self.workers if not worker.retired]
+
+    def _spawn(self, worker: Worker) -> None:
+        worker.started = time.monotonic()
+        worker.heartbeat = self.context.Value("d", worker.started, lock=False)
+        worker.process = self.context.Process(
+            target=self.target,
+            args=(
+                self.config,
+                worker.index,
+                worker.sites,
+                worker.heartbeat,
+                self.heartbeat_interval,
+            ),
+            name=f"controller-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    async def _stop(self, worker: Worker, timeout: float = 10.0) -> None:
+        """Terminates a worker, killed if still alive after timeout seconds
+
+        Waits without blocking the event loop, so the metrics of the main
+        process are served meanwhile.
+        """
+        if worker.process is None:
+            return
+        if worker.process.is_alive():
+            worker.process.terminate()
+            if not await _exited(worker.process, timeout):
+                worker.process.kill()
+                await _exited(worker.process)
+        worker.process.join()  # Exited, only reaps the process
+        worker.process = None
+
+    def start(self) -> None:
+        for worker in self.active:
+            if worker.sites:
+                self._spawn(worker)
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            await self._stop(worker)
+
+    def healthy(self, worker: Worker) -> bool:
+        if not worker.alive:
+            return False
+        return time.monotonic() - worker.heartbeat.value < self.heartbeat_timeout
+
+    async def check(self) -> None:
+        """Restarts unhealthy workers and reassigns the sites of failing ones"""
+        for worker in self.active:
+            if worker.process is None:
+                continue
+            if self.healthy(worker):
+                if (
+                    worker.restarts
+                    and time.monotonic() - worker.started >= self.stable_period
+                ):
+                    log.info(f"Worker {worker.index} stable, restarts reset")
+                    worker.restarts = 0
+                continue
+            if worker.alive:
+                log.warning(f"Worker {worker.index} missed its heartbeat")
+            else:
+                log.warning(
+                    f"Worker {worker.index} exited with {worker.process.exitcode}"
+                )
+            await self._stop(worker)
+            if worker.restarts >= self.max_restarts:
+                await self._retire(worker)
+            else:
+                worker.restarts += 1
+                RESTARTS.labels(str(worker.index)).inc()
+                log.info(f"Restarting worker {worker.index} (restart {worker.restarts})")
+                self._spawn(worker)
+
+    async def _retire(self, worker: Worker) -> None:
+        worker.retired = True
+        remaining = self.active
+        if not remaining:
+            raise WorkerError("All workers failed")
+        log.error(
+            f"Retired worker {worker.index} after {worker.restarts} restarts, "
+            f"reassigning {len(worker.sites)} sites"
+        )
+
+        receivers: set[int] = set()
+        for id, sensor_topic in worker.sites.items():
+            receiver = remaining[shard_for(id, len(remaining))]
+            receiver.sites[id] = sensor_topic
+            receivers.add(receiver.index)
+        worker.sites = {}
+
+        for receiver in remaining:
+            if receiver.index in receivers:
+                await self._stop(receiver)
+                self._spawn(receiver)
+
+    async def run(self) -> None:
+        """Starts the workers and supervises them until cancelled"""
+        self.start()
+        try:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                await self.check()
+        finally:
+            await self.stop()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(workers={self.workers})"
@@ -3,7 +3,9 @@ from typing import Any
 
 from husdata.registers import ID_C30
 import husdata.exceptions as exceptions
+from husdata.energy import EnergyAccounting
 from husdata.gateway import H60
+from husdata.writer import WriteHandle
 from husdata.util import clamp_value
 
 log = logging.getLogger(__name__)
@@ -27,7 +29,44 @@ class Rego1000(H60):
         ID_C30.POOL_TEMP_SETPOINT,
     }
 
-    async def set_variable(self, idx: str, value: Any) -> None:
+    # Cumulative kWh counters accounted by `EnergyAccounting`
+    ENERGY_COUNTERS = {
+        idx.value: idx.name
+        for idx in (
+            ID_C30.SUPP_ENERGY_HEATING,
+            ID_C30.SUPP_ENERGY_HOTWATER,
+            ID_C30.COMPR_CONS_HEATING,
+            ID_C30.COMPR_CONS_HOTWATER,
+            ID_C30.AUX_CONS_HEATING,
+            ID_C30.AUX_CONS_HOTWATER,
+        )
+    }
+    # COP estimates, supplied over consumed energy
+    ENERGY_RATIOS = {
+        "COP_HEATING": (
+            ("SUPP_ENERGY_HEATING",),
+            ("COMPR_CONS_HEATING", "AUX_CONS_HEATING"),
+        ),
+        "COP_HOTWATER": (
+            ("SUPP_ENERGY_HOTWATER",),
+            ("COMPR_CONS_HOTWATER", "AUX_CONS_HOTWATER"),
+        ),
+        "COP": (
+            ("SUPP_ENERGY_HEATING", "SUPP_ENERGY_HOTWATER"),
+            (
+                "COMPR_CONS_HEATING",
+                "COMPR_CONS_HOTWATER",
+                "AUX_CONS_HEATING",
+                "AUX_CONS_HOTWATER",
+            ),
+        ),
+    }
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.energy = EnergyAccounting(self.ENERGY_COUNTERS, self.ENERGY_RATIOS)
+
+    async def set_variable(self, idx: str, value: Any) -> WriteHandle:
         if idx not in self.WRITABLE_VARS:
             raise exceptions.NotWritableError(f"{idx} is a read-only variable.")
 
@@ -35,7 +74,7 @@ class Rego1000(H60):
             # Only accepts values  within range of -10 to 10 °C
             value = clamp_value(value, -10, 10)
 
-        await super().set_variable(idx, value)
+        return await super().set_variable(idx, value)
 
     @classmethod
     def translate_data(cls, data: dict) -> dict:
@@ -0,0 +1,267 @@
+"""Routing of MQTT messages to several consumers
+
+A single `MessageDispatcher` owns the message iterator of a shared client and
+forwards every message to all consumers with a matching subscription. Topic
+filters are compiled into a trie so the routing cost depends on the depth of the
+topic and not on the number of subscriptions.
+"""
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, NoReturn
+import weakref
+
+from .metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import aiomqtt
+
+log = logging.getLogger(__name__)
+
+# Counted per subscription, a message matching several subscriptions is counted
+# once for each, so the totals are not messages received per topic
+MESSAGES = REGISTRY.counter(
+    "mqtt_subscription_messages_total",
+    "Messages queued per subscription",
+    ("subscription",),
+)
+DROPPED = REGISTRY.counter(
+    "mqtt_subscription_dropped_messages_total",
+    "Messages dropped from the full queue of a subscription",
+    ("subscription",),
+)
+UNMATCHED = REGISTRY.counter(
+    "mqtt_unmatched_messages_total", "Messages without a matching subscription"
+).labels()
+QUEUE_DEPTH = REGISTRY.gauge(
+    "mqtt_subscription_queue_depth",
+    "Messages waiting per subscription",
+    ("subscription",),
+)
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+
+
+def message_timestamp(message: "aiomqtt.Message") -> float:
+    """Epoch time a message was received, recorded messages carry their own"""
+    timestamp = getattr(message, "timestamp", None)
+    return time.time() if timestamp is None else timestamp
+
+
+class _Node:
+    __slots__ = ("children", "subscriptions")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.subscriptions: list[Any] = []
+
+
+class TopicTrie:
+    """Trie of MQTT topic filters supporting `+` and `#` wildcards"""
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self._filters: dict[str, int] = {}
+
+    def insert(self, topic_filter: str, item: Any) -> None:
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.subscriptions.append(item)
+        self._filters[topic_filter] = self._filters.get(topic_filter, 0) + 1
+
+    def remove(self, topic_filter: str, item: Any) -> None:
+        path = [self._root]
+        for level in topic_filter.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+
+        if item not in path[-1].subscriptions:
+            return
+        path[-1].subscriptions.remove(item)
+        self._filters[topic_filter] -= 1
+        if not self._filters[topic_filter]:
+            del self._filters[topic_filter]
+
+        # Prune empty branches
+        levels = topic_filter.split("/")
+        for parent, node, level in zip(
+            reversed(path[:-1]), reversed(path[1:]), reversed(levels)
+        ):
+            if node.children or node.subscriptions:
+                break
+            del parent.children[level]
+
+    def __contains__(self, topic_filter: str) -> bool:
+        return topic_filter in self._filters
+
+    @property
+    def filters(self) -> list[str]:
+        """All distinct topic filters in the trie"""
+        return list(self._filters)
+
+    def match(self, topic: str) -> list[Any]:
+        """Returns all items subscribed with a filter matching the topic"""
+        levels = topic.split("/")
+        matches = []
+        # Topics starting with $ are not matched by wildcards at the first level
+        self._match(self._root, levels, 0, matches, not topic.startswith("$"))
+        return matches
+
+    def _match(
+        self,
+        node: _Node,
+        levels: list[str],
+        depth: int,
+        matches: list,
+        wildcards: bool = True,
+    ) -> None:
+        children = node.children
+        if wildcards and MULTI_LEVEL in children:
+            # `#` also matches the parent level itself
+            matches.extend(children[MULTI_LEVEL].subscriptions)
+
+        if depth == len(levels):
+            matches.extend(node.subscriptions)
+            return
+
+        child = children.get(levels[depth])
+        if child is not None:
+            self._match(child, levels, depth + 1, matches)
+        if wildcards and SINGLE_LEVEL in children:
+            self._match(children[SINGLE_LEVEL], levels, depth + 1, matches)
+
+
+class Subscription:
+    """A consumers bounded queue of messages matching a topic filter
+
+    When the queue is full the oldest message is discarded in favour of the new
+    one, since consumers are only interested in the latest values.
+    """
+
+    def __init__(self, topic: str, maxsize: int) -> None:
+        self.topic = topic
+        # Topic filters the subscription is registered under
+        self.filters: list[str] = [topic]
+        self.queue: asyncio.Queue[aiomqtt.Message] = asyncio.Queue(maxsize)
+        self.dropped: int = 0
+        self._queued = MESSAGES.labels(topic)
+        self._dropped = DROPPED.labels(topic)
+
+    def put(self, message: "aiomqtt.Message") -> None:
+        self._queued.inc()
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+            self._dropped.inc()
+            log.warning(f"Queue for {self.topic} is full, dropped oldest message")
+
+    async def get(self) -> "aiomqtt.Message":
+        return await self.queue.get()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(topic={self.topic})"
+
+
+class MessageDispatcher:
+    """Owns the message iterator of a client and routes messages to subscribers"""
+
+    def __init__(self, client: "aiomqtt.Client", maxsize: int = 1000) -> None:
+        self.client = client
+        self.maxsize = maxsize
+        self._trie = TopicTrie()
+        self.subscriptions: list[Subscription] = []
+
+    async def subscribe(self, topic: str, maxsize: int | None = None) -> Subscription:
+        """Subscribes to a topic filter and returns the queue of matching messages
+
+        Args:
+            topic: MQTT topic filter, may contain `+` and `#` wildcards
+            maxsize: Size of the consumers queue, defaults to dispatcher setting
+        """
+        subscription = Subscription(
+            topic, self.maxsize if maxsize is None else maxsize
+        )
+        await self._register(subscription)
+        return subscription
+
+    async def subscribe_many(
+        self, topics: list[str], maxsize: int | None = None
+    ) -> Subscription:
+        """Subscribes one queue to several topic filters
+
+        The filters must not overlap, a message matching two of them is queued
+        twice.
+
+        Args:
+            topics: MQTT topic filters
+            maxsize: Size of the consumers queue, defaults to dispatcher setting
+        """
+        subscription = Subscription(
+            ",".join(topics), self.maxsize if maxsize is None else maxsize
+        )
+        subscription.filters = list(topics)
+        await self._register(subscription)
+        return subscription
+
+    async def _register(self, subscription: Subscription) -> None:
+        self.subscriptions.append(subscription)
+        dispatcher = weakref.ref(self)  # Not kept alive by the registry
+        topic = subscription.topic
+
+        def queue_depth() -> int:
+            alive = dispatcher()
+            return 0 if alive is None else alive._queue_depth(topic)
+
+        QUEUE_DEPTH.labels(topic).set_function(queue_depth)
+        for topic in subscription.filters:
+            is_new_filter = topic not in self._trie
+            self._trie.insert(topic, subscription)
+            if is_new_filter:
+                await self.client.subscribe(topic)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for topic in subscription.filters:
+            self._trie.remove(topic, subscription)
+        self.subscriptions.remove(subscription)
+
+    @property
+    def topics(self) -> list[str]:
+        return self._trie.filters
+
+    def _queue_depth(self, topic: str) -> int:
+        return sum(s.queue.qsize() for s in self.subscriptions if s.topic == topic)
+
+    @property
+    def dropped(self) -> int:
+        """Messages dropped from full queues of current subscriptions"""
+        return sum(s.dropped for s in self.subscriptions)
+
+    @property
+    def backlog(self) -> int:
+        """Messages waiting in the queues of current subscriptions"""
+        return sum(s.queue.qsize() for s in self.subscriptions)
+
+    def dispatch(self, message: "aiomqtt.Message") -> int:
+        """Routes a message to all matching subscriptions
+
+        Returns:
+            Number of subscriptions the message was delivered to
+        """
+        subscriptions = self._trie.match(message.topic.value)
+        if not subscriptions:
+            UNMATCHED.inc()
+        for subscription in subscriptions:
+            subscription.put(message)
+        return len(subscriptions)
+
+    async def run(self) -> NoReturn:
+        async for message in self.client.messages:
+            self.dispatch(message)
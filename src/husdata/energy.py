@@ -0,0 +1,150 @@
+"""Energy accounting from the cumulative kWh counters of a heat pump
+
+Counters only ever grow, except when the heat pump resets them. Each new value
+is turned into a delta since the previous one and added to the totals of the
+current hour, day and month as it arrives, so totals and COP estimates are
+always up to date without going through history. Only the latest periods of
+each granularity are kept, in bounded deques.
+
+A decrease of a counter is taken as a reset to 0, so the new value is the
+delta. Periods start in local time, and a delta is added to the period of the
+value that completes it.
+"""
+
+from collections import deque
+from datetime import datetime
+import logging
+from typing import Any, Mapping, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+PREFIX = "ENERGY"
+# Periods kept per granularity
+DEFAULT_CAPACITY = {"hour": 48, "day": 62, "month": 24}
+
+
+def period_start(granularity: str, timestamp: float) -> float:
+    """Epoch time of the start of the local period containing a timestamp"""
+    moment = datetime.fromtimestamp(timestamp).replace(
+        minute=0, second=0, microsecond=0
+    )
+    if granularity in ("day", "month"):
+        moment = moment.replace(hour=0)
+    if granularity == "month":
+        moment = moment.replace(day=1)
+    return moment.timestamp()
+
+
+class EnergyAccounting:
+    def __init__(
+        self,
+        counters: Mapping[str, str],
+        ratios: Optional[Mapping[str, tuple[Sequence[str], Sequence[str]]]] = None,
+        capacity: Optional[Mapping[str, int]] = None,
+    ) -> None:
+        """
+        Args:
+            counters: Name per index of the kWh counters to account
+            ratios: Numerator and denominator counter names per ratio, e.g. a
+                COP is supplied energy over consumed energy
+            capacity: Periods kept per granularity, see `DEFAULT_CAPACITY`
+        """
+        self.counters = dict(counters)
+        self.ratios = dict(ratios or {})
+        capacity = capacity or DEFAULT_CAPACITY
+        # Start of period and totals per counter name, the current period last
+        self.periods: dict[str, deque[tuple[float, dict[str, float]]]] = {
+            granularity: deque(maxlen=size) for granularity, size in capacity.items()
+        }
+        self.resets: int = 0
+        self._last: dict[str, float] = {}  # Last counter value per index
+
+    def key(self, granularity: str, name: str) -> str:
+        """Key of a total or ratio of the current period in the data of an H60"""
+        return f"{PREFIX}/{granularity}/{name}"
+
+    def update(self, idx: str, value: Any, timestamp: float) -> dict[str, Any]:
+        """Accounts a new counter value
+
+        Args:
+            idx: Index of the register
+            value: Converted value of the register
+            timestamp: Epoch time of the value
+
+        Returns:
+            Changed totals and ratios of the current periods by key
+        """
+        name = self.counters.get(idx)
+        if name is None or not isinstance(value, (int, float)):
+            return {}
+        last = self._last.get(idx)
+        self._last[idx] = value
+        if last is None:
+            return {}  # Only the baseline
+        delta = value - last
+        if delta < 0:
+            log.info(f"Energy counter {name} reset from {last} to {value}")
+            self.resets += 1
+            delta = value
+
+        changes: dict[str, Any] = {}
+        for granularity, periods in self.periods.items():
+            start = period_start(granularity, timestamp)
+            if not periods or periods[-1][0] < start:
+                periods.append((start, dict.fromkeys(self.counters.values(), 0.0)))
+                changes |= self.data(granularity)
+            totals = periods[-1][1]
+            totals[name] += delta
+            changes[self.key(granularity, name)] = totals[name]
+            for ratio, ratio_value in self._ratios(totals).items():
+                changes[self.key(granularity, ratio)] = ratio_value
+        return changes
+
+    def _ratios(self, totals: Mapping[str, float]) -> dict[str, Optional[float]]:
+        ratios: dict[str, Optional[float]] = {}
+        for ratio, (numerator, denominator) in self.ratios.items():
+            below = sum(totals[name] for name in denominator)
+            above = sum(totals[name] for name in numerator)
+            ratios[ratio] = above / below if below > 0 else None
+        return ratios
+
+    def totals(self, granularity: str) -> list[tuple[float, dict[str, float]]]:
+        """Start and totals of the kept periods of a granularity, oldest first"""
+        return [(start, dict(totals)) for start, totals in self.periods[granularity]]
+
+    def data(self, granularity: Optional[str] = None) -> dict[str, Any]:
+        """Totals and ratios of the current periods by key
+
+        Args:
+            granularity: Only of this granularity, otherwise of all
+        """
+        granularities = [granularity] if granularity else list(self.periods)
+        data: dict[str, Any] = {}
+        for granularity in granularities:
+            periods = self.periods[granularity]
+            if not periods:
+                continue
+            totals = periods[-1][1]
+            for name, total in (totals | self._ratios(totals)).items():
+                data[self.key(granularity, name)] = total
+        return data
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "last": self._last,
+            "periods": {
+                granularity: list(periods)
+                for granularity, periods in self.periods.items()
+            },
+        }
+
+    def restore(self, state: dict[str, Any]) -> None:
+        """Restores a snapshot, periods of unknown granularities are ignored"""
+        for idx, value in state["last"].items():
+            self._last.setdefault(idx, value)
+        for granularity, periods in state["periods"].items():
+            if granularity in self.periods and not self.periods[granularity]:
+                zeros = dict.fromkeys(self.counters.values(), 0.0)
+                self.periods[granularity].extend(
+                    (start, zeros | totals) for start, totals in periods
+                )
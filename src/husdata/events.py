@@ -0,0 +1,75 @@
+"""Change events of values
+
+A `ChangeNotifier` calls its watchers when a value has changed more than the
+deadband of the watcher since the value the watcher was last notified of.
+"""
+
+import logging
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+ChangeCallback = Callable[[str, Any], None]
+
+
+class Watch:
+    def __init__(
+        self, callback: ChangeCallback, key: Optional[str], deadband: float
+    ) -> None:
+        self.callback = callback
+        self.key = key
+        self.deadband = deadband
+        self._last: dict[str, Any] = {}
+
+    def _changed(self, last: Any, value: Any) -> bool:
+        try:
+            return abs(float(value) - float(last)) > self.deadband
+        except (TypeError, ValueError):
+            return value != last
+
+    def check(self, key: str, value: Any) -> None:
+        if key in self._last and not self._changed(self._last[key], value):
+            return
+        self._last[key] = value
+        try:
+            self.callback(key, value)
+        except Exception:
+            log.exception(f"Change callback for {key} failed")
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(key={self.key}, deadband={self.deadband})"
+
+
+class ChangeNotifier:
+    def __init__(self) -> None:
+        self._watches: dict[Optional[str], list[Watch]] = {}
+
+    def watch(
+        self,
+        callback: ChangeCallback,
+        key: Optional[str] = None,
+        deadband: float = 0.0,
+    ) -> Watch:
+        """Calls back with key and value when a value changes
+
+        Args:
+            callback: Called with key and new value
+            key: Key to watch, all keys if not given
+            deadband: Numeric changes smaller than or equal to this are ignored
+        """
+        watch = Watch(callback, key, deadband)
+        self._watches.setdefault(key, []).append(watch)
+        return watch
+
+    def unwatch(self, watch: Watch) -> None:
+        watches = self._watches.get(watch.key, [])
+        if watch in watches:
+            watches.remove(watch)
+
+    def notify(self, key: str, value: Any) -> None:
+        if not self._watches:
+            return
+        for watch in self._watches.get(key, ()):
+            watch.check(key, value)
+        for watch in self._watches.get(None, ()):
+            watch.check(key, value)
@@ -9,3 +9,6 @@ class TypeError(ControllerError):
 
 class TranslationError(ControllerError):
     pass
+
+class WriteTimeoutError(ControllerError):
+    pass
@@ -1,43 +1,152 @@
-from typing import Any, NoReturn, Optional
+import time
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Mapping, NoReturn
 import logging
-from .registers import DataType, is_data_type, is_in_data_types
+from .registers import get_converter
 from .exceptions import TranslationError
-import aiomqtt
+from .dispatcher import MessageDispatcher, message_timestamp
+from .energy import EnergyAccounting
+from .events import ChangeNotifier
+from .history import History
+from .writer import LatencyStats, WriteHandle, WriteQueue
+from .metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import aiomqtt
 
 log = logging.getLogger(__name__)
 
+MESSAGES = REGISTRY.counter("h60_messages_total", "Messages per H60", ("id",))
+CONVERT_SECONDS = REGISTRY.histogram(
+    "h60_convert_seconds", "Time converting raw register values"
+).labels()
+SET_PUBLISH_SECONDS = REGISTRY.histogram(
+    "h60_set_publish_seconds", "Time publishing writes to registers"
+).labels()
+SET_CONFIRM_SECONDS = REGISTRY.histogram(
+    "h60_set_confirm_seconds", "Time from publishing a write until confirmed"
+).labels()
+
 
 class H60:
+    # Unconfirmed writes tracked per register, older ones are forgotten
+    MAX_PENDING_WRITES = 16
+
     def __init__(
-        self, client: aiomqtt.Client, id: str | None = None, topic: str = "+/HP/#"
+        self,
+        client: "aiomqtt.Client",
+        id: str | None = None,
+        topic: str = "+/HP/#",
+        dispatcher: MessageDispatcher | None = None,
+        keep_raw: bool = False,
+        history: History | None = None,
+        history_prefix: str = "",
     ):
         """Instantiates an H60 unit
 
         Args:
-            address: IP Address to H60
+            client: MQTT client used for publishing
+            id: Id of the H60, taken from first message if not given
+            topic: Topic to subscribe to
+            dispatcher: Shared dispatcher to receive messages from. If not given
+                the messages are read directly from the client.
+            keep_raw: Keep the raw string values next to the converted ones,
+                needed for `get_all_data(convert=False)`
+            history: History to append all numeric values to
+            history_prefix: Prefix of the signal names in history, to tell
+                several H60s apart
         """
         self.client = client
         self.topic = topic
         self.id: str | None = id
-        self.raw_data: dict = {}
+        self.dispatcher = dispatcher
+        self.keep_raw = keep_raw
+        self.history = history
+        self.history_prefix = history_prefix
+        self.write_queue: WriteQueue | None = None
+        self.energy: EnergyAccounting | None = None
+        self.changes = ChangeNotifier()
+        self.write_latency: dict[str, LatencyStats] = {}
+        self._pending_writes: dict[str, list[WriteHandle]] = {}
+        self._data: dict[str, Any] = {}
+        self._raw_data: dict[str, str] = {}
+        self._messages = None if id is None else MESSAGES.labels(id)
+
+    @property
+    def raw_data(self) -> Mapping[str, str]:
+        """Raw string values, only tracked for incoming messages if `keep_raw`"""
+        return MappingProxyType(self._raw_data)
+
+    @raw_data.setter
+    def raw_data(self, data: Mapping[str, str]) -> None:
+        """Replaces all values, raw values are kept from then on"""
+        self.keep_raw = True
+        self._data.clear()
+        self._raw_data = dict(data)
+        for key, value in self._raw_data.items():
+            self._update_value(key, value)
 
     async def start(self) -> NoReturn:
+        if self.dispatcher is not None:
+            subscription = await self.dispatcher.subscribe(self.topic)
+            while True:
+                self._update_data_from_message(await subscription.get())
+
         await self.client.subscribe(self.topic)
         async for message in self.client.messages:
             if not message.topic.matches(self.topic):
                 continue
             self._update_data_from_message(message)
 
-    def _update_data_from_message(self, message: aiomqtt.Message) -> None:
+    def _update_data_from_message(self, message: "aiomqtt.Message") -> None:
         topic_parts = message.topic.value.split("/")
         if self.id is None:
             self.id = topic_parts[0]
+            self._messages = MESSAGES.labels(self.id)
+        elif topic_parts[0] != self.id:
+            # Another H60 on the same topic filter, see `GatewayRegistry`
+            return
+        self._messages.inc()
 
         if len(topic_parts) >= 3:
             key = "/".join(topic_parts[2:])
             value = message.payload.decode("utf-8")
 
-            self.raw_data |= {key: value}
+            if self.keep_raw:
+                self._raw_data[key] = value
+            self._update_value(key, value)
+            if key in self._pending_writes:
+                self._confirm_writes(key, self._data[key])
+            self.changes.notify(key, self._data[key])
+
+            timestamp = message_timestamp(message)
+            if self.history is not None:
+                converted = self._data[key]
+                if isinstance(converted, (float, bool)):
+                    self.history.append(
+                        self.history_prefix + key, float(converted), timestamp
+                    )
+            if self.energy is not None:
+                self._update_energy(key, timestamp)
+
+    def _update_energy(self, key: str, timestamp: float) -> None:
+        """Updates energy totals and ratios, kept next to the register values"""
+        for energy_key, value in self.energy.update(
+            key, self._data[key], timestamp
+        ).items():
+            self._data[energy_key] = value
+            self.changes.notify(energy_key, value)
+
+    def _update_value(self, key: str, value: str) -> None:
+        """Converts and stores a raw value, keeping the raw value if not possible"""
+        started = time.perf_counter()
+        try:
+            self._data[key] = self._convert_raw_value(key, value)
+            CONVERT_SECONDS.observe(time.perf_counter() - started)
+        except (TranslationError, ValueError) as e:
+            if key not in self._data:
+                log.error(e)
+            self._data[key] = value
 
     @staticmethod
     def _convert_raw_value(idx: str, value: str) -> Any:
@@ -53,53 +162,110 @@ class H60:
         if value is None:
             return value
 
-        if is_in_data_types(
-            idx,
-            {
-                DataType.DEGREES,
-                DataType.PERCENT,
-                DataType.AMPERE,
-            },
-        ):
-            value = float(value)
-        elif is_data_type(idx, DataType.KWH):
-            value = float(value)
-        elif is_data_type(idx, DataType.ON_OFF_BOOL):
-            value = bool(int(value))
-        elif is_in_data_types(
-            idx,
-            {
-                DataType.NUMBER,
-                DataType.HOURS,
-                DataType.MINUTES,
-                DataType.DEGREE_MINUTES,
-                DataType.KW,
-            },
-        ):
-            value = float(value)
-        elif idx == "STATUS":
-            value = str(value)
-        else:
-            raise TranslationError(f"Could not identify data type of {idx}")
-        return value
+        return get_converter(idx)(value)
 
-    def get_all_data(self, convert: bool = True) -> Optional[dict]:
-        data = self.raw_data.copy()
+    def get_all_data(self, convert: bool = True) -> Mapping[str, Any]:
+        """Read-only view of all data
+
+        Args:
+            convert: Return converted values, otherwise the raw values
+
+        Raises:
+            ValueError: If raw values are asked for but not kept, see `keep_raw`
+        """
         if convert:
-            for idx, value in data.items():
-                try:
-                    data[idx] = self._convert_raw_value(idx, value)
-                except TranslationError as e:
-                    log.error(e)
-        return data
-
-    async def set_variable(self, idx: str, value: str) -> None:
+            return MappingProxyType(self._data)
+        if not self.keep_raw:
+            raise ValueError(
+                "Raw values are not kept, create the H60 with keep_raw=True"
+            )
+        return self.raw_data
+
+    async def set_variable(self, idx: str, value: str) -> WriteHandle:
+        """Sets a variable, through the write queue if there is one
+
+        Returns:
+            Handle that is confirmed when the heat pump reports the new value
+        """
         if self.id is None:
             raise ValueError("Cant identify heatpump id, try set it manually")
 
+        handle = WriteHandle(self, idx, value)
+        pending = self._pending_writes.setdefault(idx, [])
+        pending.append(handle)
+        del pending[:-self.MAX_PENDING_WRITES]
+
+        if self.write_queue is not None:
+            if not self.write_queue.submit(idx, value):
+                self._confirm_writes(idx, value)
+        else:
+            await self._publish(idx, value)
+        return handle
+
+    async def _publish(self, idx: str, value: str) -> None:
+        started = time.perf_counter()
         await self.client.publish(f"{self.id}/HP/SET/{idx}", payload=value)
+        SET_PUBLISH_SECONDS.observe(time.perf_counter() - started)
+        for handle in self._pending_writes.get(idx, []):
+            handle._sent()
         log.info(f"Tried to set variable {idx} to {value}")
 
+    def _confirm_writes(self, idx: str, value: Any) -> None:
+        """Confirms pending writes of a value and all writes it superseded"""
+        pending = self._pending_writes[idx]
+        for i in range(len(pending) - 1, -1, -1):
+            if pending[i].matches(value):
+                break
+        else:
+            return
+
+        for handle in pending[: i + 1]:
+            handle._confirm()
+            if handle.latency is not None:
+                self.write_latency.setdefault(idx, LatencyStats()).add(handle.latency)
+                SET_CONFIRM_SECONDS.observe(handle.latency)
+                log.info(f"Confirmed {idx}={value} after {handle.latency:.2f}s")
+        del pending[: i + 1]
+        if not pending:
+            del self._pending_writes[idx]
+
+    def _discard_write(self, handle: WriteHandle) -> None:
+        pending = self._pending_writes.get(handle.idx, [])
+        if handle in pending:
+            pending.remove(handle)
+
     def get_variable(self, idx: str) -> Any:
-        data = self.get_all_data()
-        return data.get(idx)
+        return self._data.get(idx)
+
+    def snapshot(self) -> dict[str, Any]:
+        """Register values to restore after a restart, see `restore`"""
+        snapshot = {
+            "id": self.id,
+            "data": {
+                key: value
+                for key, value in self._data.items()
+                if isinstance(value, (str, int, float, bool))
+            },
+        }
+        if self.energy is not None:
+            snapshot["energy"] = self.energy.snapshot()
+        return snapshot
+
+    def restore(self, state: dict[str, Any], max_age: float) -> None:
+        """Restores register values that have not been received yet
+
+        Values are restored as is, without notifying watchers or appending to
+        history, since they were already when received before the restart.
+        Register values carry no time of their own, so `max_age` is left to the
+        age of the snapshot as a whole.
+        """
+        if self.id is None:
+            self.id = state["id"]
+            self._messages = MESSAGES.labels(self.id)
+        elif state["id"] != self.id:
+            raise ValueError(f"Snapshot of H60 {state['id']} restored to {self.id}")
+        for key, value in state["data"].items():
+            self._data.setdefault(key, value)
+        if self.energy is not None and "energy" in state:
+            self.energy.restore(state["energy"])
+            self._data.update(self.energy.data())
@@ -0,0 +1,203 @@
+"""Time-series history of signals
+
+Every signal has a fixed-capacity ring buffer backed by two typed arrays, float64
+values and int64 epoch timestamps in milliseconds, so samples are stored without
+any per-sample Python objects. The buffers grow until they reach their capacity
+and then overwrite the oldest samples.
+"""
+
+from array import array
+import time
+from typing import Iterator, Optional, Protocol
+
+DEFAULT_CAPACITY = 60_480  # One week of samples every 10 seconds
+
+
+def _to_ms(timestamp: float) -> int:
+    return int(timestamp * 1000)
+
+
+class SampleSink(Protocol):
+    """Receiver of all samples appended to a history, e.g. persistent storage"""
+
+    def append(self, signal: str, timestamp: float, value: float) -> None: ...
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of timestamped float values
+
+    Timestamps are expected to be appended in order. A sample older than the
+    latest one is stored with the latest timestamp to keep the buffer sorted.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._timestamps = array("q")
+        self._values = array("d")
+        self._start = 0  # Physical index of the oldest sample
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Appends a sample
+
+        Args:
+            timestamp: Epoch time in seconds
+            value: Value of the sample
+        """
+        ms = _to_ms(timestamp)
+        if self._values and ms < self._timestamps[self._start - 1]:
+            ms = self._timestamps[self._start - 1]
+
+        if len(self._values) < self.capacity:
+            self._timestamps.append(ms)
+            self._values.append(value)
+        else:
+            self._timestamps[self._start] = ms
+            self._values[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+
+    def _physical(self, index: int) -> int:
+        return (self._start + index) % len(self._values)
+
+    def _bisect(self, ms: int, right: bool) -> int:
+        """Logical index where a sample with timestamp `ms` would be inserted"""
+        lo, hi = 0, len(self._values)
+        timestamps = self._timestamps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ts = timestamps[self._physical(mid)]
+            if ts < ms or (right and ts == ms):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, start: Optional[float], end: Optional[float]) -> tuple[int, int]:
+        lo = 0 if start is None else self._bisect(_to_ms(start), right=False)
+        hi = len(self._values) if end is None else self._bisect(_to_ms(end), right=True)
+        return lo, max(lo, hi)
+
+    def _slices(self, lo: int, hi: int) -> Iterator[slice]:
+        """Physical slices covering the logical range lo to hi"""
+        if lo == hi:
+            return
+        first, last = self._physical(lo), self._physical(hi - 1)
+        if first <= last:
+            yield slice(first, last + 1)
+        else:
+            yield slice(first, len(self._values))
+            yield slice(0, last + 1)
+
+    def window(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> tuple[array, array]:
+        """Samples within a time window, both ends inclusive
+
+        Args:
+            start: Epoch time in seconds, from the oldest sample if not given
+            end: Epoch time in seconds, to the latest sample if not given
+
+        Returns:
+            Arrays of timestamps in epoch seconds and values
+        """
+        timestamps, values = array("d"), array("d")
+        for part in self._slices(*self._range(start, end)):
+            timestamps.extend(ts / 1000 for ts in self._timestamps[part])
+            values.extend(self._values[part])
+        return timestamps, values
+
+    def last(self, duration: float, now: Optional[float] = None) -> tuple[array, array]:
+        """Samples from the last `duration` seconds"""
+        now = time.time() if now is None else now
+        return self.window(now - duration, now)
+
+    def min(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Optional[float]:
+        parts = [min(self._values[s]) for s in self._slices(*self._range(start, end))]
+        return min(parts) if parts else None
+
+    def max(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Optional[float]:
+        parts = [max(self._values[s]) for s in self._slices(*self._range(start, end))]
+        return max(parts) if parts else None
+
+    def mean(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Optional[float]:
+        lo, hi = self._range(start, end)
+        if lo == hi:
+            return None
+        return sum(sum(self._values[s]) for s in self._slices(lo, hi)) / (hi - lo)
+
+    def value_at(self, timestamp: float) -> Optional[float]:
+        """Latest value at or before a point in time"""
+        index = self._bisect(_to_ms(timestamp), right=True)
+        if index == 0:
+            return None
+        return self._values[self._physical(index - 1)]
+
+    @property
+    def latest(self) -> Optional[tuple[float, float]]:
+        """Timestamp and value of the latest sample"""
+        if not self._values:
+            return None
+        index = self._start - 1
+        return self._timestamps[index] / 1000, self._values[index]
+
+
+class History:
+    """Collection of ring buffers, one per signal"""
+
+    def __init__(
+        self, capacity: int = DEFAULT_CAPACITY, sink: Optional[SampleSink] = None
+    ) -> None:
+        """
+        Args:
+            capacity: Maximum number of samples kept per signal
+            sink: Optional receiver of every appended sample
+        """
+        self.capacity = capacity
+        self.sink = sink
+        self._buffers: dict[str, RingBuffer] = {}
+
+    def append(
+        self, signal: str, value: float, timestamp: Optional[float] = None
+    ) -> None:
+        """Appends a sample to a signal, created if not seen before
+
+        Args:
+            signal: Name of the signal
+            value: Value of the sample
+            timestamp: Epoch time in seconds, defaults to now
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        self.buffer(signal).append(timestamp, value)
+        if self.sink is not None:
+            self.sink.append(signal, timestamp, value)
+
+    def buffer(self, signal: str) -> RingBuffer:
+        """Buffer of a signal, created if not seen before"""
+        try:
+            return self._buffers[signal]
+        except KeyError:
+            buffer = self._buffers[signal] = RingBuffer(self.capacity)
+            return buffer
+
+    def get(self, signal: str) -> Optional[RingBuffer]:
+        return self._buffers.get(signal)
+
+    def __getitem__(self, signal: str) -> RingBuffer:
+        return self._buffers[signal]
+
+    def __contains__(self, signal: str) -> bool:
+        return signal in self._buffers
+
+    @property
+    def signals(self) -> list[str]:
+        return list(self._buffers)
@@ -1,5 +1,5 @@
 import enum
-from typing import Iterable
+from typing import Any, Callable, Iterable
 
 from .exceptions import TranslationError
 
@@ -94,3 +94,63 @@ class ID_C30(enum.StrEnum):
     PROG_VER_MAJOR = "2F00"
     PROG_VER_MINOR = "2F01"
     PROG_VER_REVISION = "2F02"
+
+
+def _to_bool(value: str) -> bool:
+    return bool(int(value))
+
+
+# Converter per data type, based on H1 developer manual but modified to work with
+# Rego 1000 IVT Greenline
+_DATA_TYPE_CONVERTERS: dict[DataType, Callable[[str], Any]] = {
+    DataType.DEGREES: float,
+    DataType.ON_OFF_BOOL: _to_bool,
+    DataType.NUMBER: float,
+    DataType.PERCENT: float,
+    DataType.AMPERE: float,
+    DataType.KWH: float,
+    DataType.HOURS: float,
+    DataType.MINUTES: float,
+    DataType.DEGREE_MINUTES: float,
+    DataType.KW: float,
+}
+
+# Data types are identified by the first character of the index
+_PREFIX_CONVERTERS: dict[str, Callable[[str], Any]] = {
+    prefix: converter
+    for data_type, converter in _DATA_TYPE_CONVERTERS.items()
+    for prefix in data_type.value
+}
+
+_SPECIAL_CONVERTERS: dict[str, Callable[[str], Any]] = {
+    "STATUS": str,
+}
+
+
+def _resolve_converter(idx: str) -> Callable[[str], Any]:
+    if idx in _SPECIAL_CONVERTERS:
+        return _SPECIAL_CONVERTERS[idx]
+    if not idx or idx[0] not in _PREFIX_CONVERTERS:
+        raise TranslationError(f"Could not identify data type of {idx}")
+    return _PREFIX_CONVERTERS[idx[0]]
+
+
+_converters: dict[str, Callable[[str], Any]] = {
+    idx.value: _resolve_converter(idx.value) for idx in ID_C30
+}
+
+
+def get_converter(idx: str) -> Callable[[str], Any]:
+    """Returns function converting a raw value of the index to its data type
+
+    Converters for indexes not in the known registers are resolved and cached the
+    first time they are seen.
+
+    Raises:
+        TranslationError: If data type of index could not be identified
+    """
+    try:
+        return _converters[idx]
+    except KeyError:
+        converter = _converters[idx] = _resolve_converter(idx)
+        return converter
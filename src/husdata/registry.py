@@ -0,0 +1,107 @@
+"""Registry of many H60s behind one topic filter
+
+All gateways share a single subscription and messages are routed to them by the
+id in the topic, `{id}/HP/{idx}`. Gateways are created the first time their id
+is seen, or up front with `add`, so one process can serve a fleet of heat pumps
+without a task or subscription per device.
+"""
+
+import logging
+from typing import TYPE_CHECKING, Callable, Iterator, NoReturn, Optional
+
+from .controllers import Rego1000
+from .dispatcher import MessageDispatcher
+from .gateway import H60
+from .history import History
+
+if TYPE_CHECKING:
+    import aiomqtt
+
+log = logging.getLogger(__name__)
+
+GatewayFactory = Callable[..., H60]
+
+
+class GatewayRegistry:
+    def __init__(
+        self,
+        client: "aiomqtt.Client",
+        dispatcher: MessageDispatcher,
+        topic: str = "+/HP/#",
+        factory: GatewayFactory = Rego1000,
+        history: Optional[History] = None,
+        on_new: Optional[Callable[[H60], None]] = None,
+        discover: bool = True,
+    ) -> None:
+        """
+        Args:
+            client: MQTT client used by the gateways for publishing
+            dispatcher: Shared dispatcher to receive messages from
+            topic: Topic filter of all gateways, the first level is the id
+            factory: Class or function creating a gateway, called with the same
+                arguments as `H60`
+            history: History shared by all gateways, signals are prefixed by id
+            on_new: Called with every gateway created on demand
+            discover: Subscribe to `topic` and create gateways on demand.
+                Otherwise only the gateways added before `run` are subscribed
+                to, e.g. for a shard of all heat pumps.
+        """
+        self.client = client
+        self.dispatcher = dispatcher
+        self.topic = topic
+        self.factory = factory
+        self.history = history
+        self.on_new = on_new
+        self.discover = discover
+        self.gateways: dict[str, H60] = {}
+
+    def add(self, id: str) -> H60:
+        """Returns the gateway of an id, creating it if needed"""
+        gateway = self.gateways.get(id)
+        if gateway is None:
+            gateway = self.factory(
+                self.client,
+                id=id,
+                topic=f"{id}/HP/#",
+                history=self.history,
+                history_prefix=f"{id}/",
+            )
+            self.gateways[id] = gateway
+        return gateway
+
+    def __getitem__(self, id: str) -> H60:
+        return self.gateways[id]
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.gateways
+
+    def __iter__(self) -> Iterator[H60]:
+        return iter(self.gateways.values())
+
+    def __len__(self) -> int:
+        return len(self.gateways)
+
+    def route(self, message: "aiomqtt.Message") -> H60:
+        """Passes a message on to the gateway of the id in its topic"""
+        id = message.topic.value.split("/", 1)[0]
+        gateway = self.gateways.get(id)
+        if gateway is None:
+            gateway = self.add(id)
+            log.info(f"Discovered H60 {id}")
+            if self.on_new is not None:
+                self.on_new(gateway)
+        gateway._update_data_from_message(message)
+        return gateway
+
+    async def run(self) -> NoReturn:
+        if self.discover:
+            subscription = await self.dispatcher.subscribe(self.topic)
+        else:
+            subscription = await self.dispatcher.subscribe_many(
+                [gateway.topic for gateway in self]
+            )
+        while True:
+            self.route(await subscription.get())
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(gateways={list(self.gateways)})"
@@ -0,0 +1,239 @@
+"""Writes to an H60
+
+Writes are queued per register so only the latest value of a register is sent,
+and writes of a value the heat pump already reports are dropped. The queue is
+flushed within a budget of writes per time period since both the gateway and
+the parameter memory of the heat pump are slow and wear with each write.
+
+Every write returns a `WriteHandle` that is confirmed when the heat pump reports
+the written value back on the register topic.
+"""
+
+import asyncio
+from collections import deque
+import logging
+from typing import TYPE_CHECKING, Any, Generator, NoReturn, Optional
+
+from .exceptions import WriteTimeoutError
+
+if TYPE_CHECKING:
+    from .gateway import H60
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 0.05
+
+
+def values_equal(a: Any, b: Any, tolerance: float = DEFAULT_TOLERANCE) -> bool:
+    """Compares values numerically within tolerance if possible"""
+    if a is None or b is None:
+        return a is b
+    try:
+        return abs(float(a) - float(b)) <= tolerance
+    except (TypeError, ValueError):
+        return str(a) == str(b)
+
+
+class LatencyStats:
+    """Round-trip latency of confirmed writes to a register"""
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.last: Optional[float] = None
+        self.mean: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, latency: float) -> None:
+        self.count += 1
+        self.last = latency
+        self.mean = latency if self.mean is None else (
+            self.mean + (latency - self.mean) / self.count
+        )
+        self.max = latency if self.max is None else max(self.max, latency)
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, last=self.last, mean=self.mean, max=self.max)
+
+
+class WriteHandle:
+    """Awaitable handle of a write, resolved when the heat pump confirms the value
+
+    Awaiting the handle waits with the default timeout and no retries, use `wait`
+    for other settings.
+    """
+
+    def __init__(
+        self,
+        gateway: "H60",
+        idx: str,
+        value: Any,
+        tolerance: float = DEFAULT_TOLERANCE,
+    ) -> None:
+        self.gateway = gateway
+        self.idx = idx
+        self.value = value
+        self.tolerance = tolerance
+        self.sent_at: Optional[float] = None
+        self.latency: Optional[float] = None
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def confirmed(self) -> bool:
+        return self._future.done()
+
+    def matches(self, value: Any) -> bool:
+        return values_equal(self.value, value, self.tolerance)
+
+    def _sent(self) -> None:
+        if self.sent_at is None:
+            self.sent_at = asyncio.get_running_loop().time()
+
+    def _confirm(self) -> None:
+        if self._future.done():
+            return
+        if self.sent_at is not None:
+            self.latency = asyncio.get_running_loop().time() - self.sent_at
+        self._future.set_result(self.latency)
+
+    async def wait(self, timeout: float = 30.0, retries: int = 0) -> Optional[float]:
+        """Waits for the heat pump to confirm the write
+
+        Args:
+            timeout: Seconds to wait for confirmation of each attempt
+            retries: Number of times the write is published again on timeout,
+                not once a later write to the register has been made
+
+        Returns:
+            Round-trip latency in seconds, None if never sent since the value was
+            already confirmed
+
+        Raises:
+            WriteTimeoutError: If not confirmed within the timeout of all attempts
+        """
+        for attempt in range(retries + 1):
+            try:
+                return await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            except TimeoutError:
+                if attempt < retries and self._superseded():
+                    log.info(f"Write of {self.value} to {self.idx} superseded")
+                    break
+                if attempt < retries:
+                    log.warning(
+                        f"Write of {self.value} to {self.idx} not confirmed, retrying"
+                    )
+                    self.sent_at = None
+                    await self._retry()
+
+        self.gateway._discard_write(self)
+        raise WriteTimeoutError(
+            f"Write of {self.value} to {self.idx} not confirmed within {timeout}s"
+        )
+
+    def _superseded(self) -> bool:
+        """Checks if a later write to the register has been made
+
+        Retrying would then overwrite the newer value on the heat pump.
+        """
+        pending = self.gateway._pending_writes.get(self.idx, [])
+        return not pending or pending[-1] is not self
+
+    async def _retry(self) -> None:
+        """Writes again, through the write queue of the gateway if there is one
+
+        The queue keeps the write budget, or drops the retry if the value has
+        been confirmed.
+        """
+        queue = self.gateway.write_queue
+        if queue is None:
+            await self.gateway._publish(self.idx, self.value)
+        elif not queue.submit(self.idx, self.value):
+            self.gateway._confirm_writes(self.idx, self.value)
+
+    def __await__(self) -> Generator[Any, None, Optional[float]]:
+        return self.wait().__await__()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(idx={self.idx}, value={self.value}, "
+            f"confirmed={self.confirmed})"
+        )
+
+
+class WriteQueue:
+    def __init__(
+        self,
+        gateway: "H60",
+        max_writes: int = 6,
+        period: float = 60.0,
+        tolerance: float = DEFAULT_TOLERANCE,
+    ) -> None:
+        """
+        Args:
+            gateway: H60 to publish the writes to
+            max_writes: Maximum number of writes within `period`
+            period: Time period in seconds of the write budget
+            tolerance: Numeric values within tolerance of the confirmed value are
+                considered equal
+        """
+        self.gateway = gateway
+        self.max_writes = max_writes
+        self.period = period
+        self.tolerance = tolerance
+        self._pending: dict[str, Any] = {}
+        self._sent: deque[float] = deque()
+        self._has_pending = asyncio.Event()
+
+    @property
+    def pending(self) -> dict[str, Any]:
+        return dict(self._pending)
+
+    def is_confirmed(self, idx: str, value: Any) -> bool:
+        """Checks if the gateway already reports the value for the register"""
+        current = self.gateway.get_variable(idx)
+        return current is not None and values_equal(value, current, self.tolerance)
+
+    def submit(self, idx: str, value: Any) -> bool:
+        """Queues a write, replacing any pending write to the same register
+
+        Returns:
+            False if the write was dropped since the value is already confirmed
+        """
+        if self.is_confirmed(idx, value):
+            if self._pending.pop(idx, None) is not None:
+                log.debug(f"Cancelled pending write to {idx}, {value} is confirmed")
+            return False
+        self._pending[idx] = value
+        self._has_pending.set()
+        return True
+
+    async def _wait_for_budget(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._sent and self._sent[0] <= now - self.period:
+                self._sent.popleft()
+            if len(self._sent) < self.max_writes:
+                return
+            await asyncio.sleep(self._sent[0] + self.period - now)
+
+    async def _publish_next(self) -> None:
+        idx = next(iter(self._pending))
+        value = self._pending.pop(idx)
+        if self.is_confirmed(idx, value):
+            return
+        self._sent.append(asyncio.get_running_loop().time())
+        await self.gateway._publish(idx, value)
+
+    async def flush(self) -> None:
+        """Publishes all pending writes, ignoring the budget"""
+        while self._pending:
+            await self._publish_next()
+
+    async def run(self) -> NoReturn:
+        while True:
+            await self._has_pending.wait()
+            self._has_pending.clear()
+            while self._pending:
+                await self._wait_for_budget()
+                if self._pending:
+                    await self._publish_next()
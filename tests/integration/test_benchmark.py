@@ -0,0 +1,33 @@
+import asyncio
+
+from controller.benchmark import run_benchmark
+from controller.broker import InProcessBroker
+
+
+def test_broker_routes_and_retains():
+    async def run():
+        broker = InProcessBroker()
+        client = broker.client()
+        broker.publish("a/b", "retained", retain=True)
+        await client.subscribe("a/#")
+        await client.messages.__anext__()  # Retained message
+        await client.subscribe("a/+")  # Retained message again, as in MQTT
+        broker.publish("a/b", 1.5)
+        broker.publish("c/d", 2)
+        messages = client.messages
+        return [await anext(messages) for _ in range(client.pending)]
+
+    messages = asyncio.run(run())
+    assert [m.payload for m in messages] == [b"retained", b"1.5"]
+
+
+def test_benchmark_smoke():
+    results = asyncio.run(
+        run_benchmark(rate=500, devices=5, duration=0.2, set_variable_calls=100)
+    )
+    ingest = results["ingest"]
+    assert ingest["sent"] > 0
+    assert ingest["stored"] == ingest["sent"]
+    assert ingest["dropped"] == 0
+    assert ingest["latency_p50_ms"] <= ingest["latency_p99_ms"]
+    assert results["set_variable"]["calls_per_s"] > 0
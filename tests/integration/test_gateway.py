@@ -1,3 +1,4 @@
+import aiomqtt
 import pytest
 from unittest.mock import MagicMock
 
@@ -35,3 +36,28 @@ def test_get_all_data(do_convert: bool, h60: H60):
     data = h60.get_all_data(convert=do_convert)
 
     assert data # Non empty dict
+
+
+def make_message(topic: str, payload: str) -> aiomqtt.Message:
+    return aiomqtt.Message(
+        topic, payload.encode(), qos=0, retain=False, mid=0, properties=None
+    )
+
+
+@pytest.mark.parametrize("keep_raw", [True, False])
+def test_update_data_from_message(keep_raw: bool):
+    """Values are converted once on ingest and the raw value only kept on demand"""
+    h60 = H60(client=MagicMock(), keep_raw=keep_raw)
+    h60._update_data_from_message(make_message("abc/HP/0007", "-2.5"))
+    h60._update_data_from_message(make_message("abc/HP/1A01", "1"))
+    h60._update_data_from_message(make_message("abc/HP/0007", "-3.0"))
+
+    assert h60.id == "abc"
+    assert h60.get_variable("0007") == -3.0
+    assert h60.get_variable("1A01") is True
+    assert dict(h60.get_all_data()) == {"0007": -3.0, "1A01": True}
+    if keep_raw:
+        assert dict(h60.get_all_data(convert=False)) == {"0007": "-3.0", "1A01": "1"}
+    else:
+        with pytest.raises(ValueError):
+            h60.get_all_data(convert=False)
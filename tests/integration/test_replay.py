@@ -0,0 +1,58 @@
+import asyncio
+import json
+from pathlib import Path
+import time
+
+from controller.mqtt import MQTTSensor
+from controller.replay import ReplayClient, run_replay
+from controller.scheduler import Scheduler
+from controller.strategies import OffsetOutdoorTemperatureStrategy
+from husdata.controllers import Rego1000
+from husdata.dispatcher import MessageDispatcher
+from husdata.registers import ID_C30
+
+START = 1_700_000_000.0
+DAYS = 30
+
+
+def write_recording(path: Path) -> None:
+    """Indoor temperature every 10 minutes and the setpoint once a day"""
+    with open(path, "w") as f:
+        for i in range(DAYS * 144):
+            t = START + i * 600
+            if i % 144 == 0:
+                topic = f"abc/HP/{ID_C30.ROOM_TEMP_SETPOINT}"
+                f.write(json.dumps({"t": t, "topic": topic, "payload": "21.0"}) + "\n")
+            temperature = 21.0 + (1.0 if (i // 144) % 2 else -1.0)
+            topic = "dev/firstfloor/room/temperature"
+            f.write(json.dumps({"t": t, "topic": topic, "payload": temperature}) + "\n")
+
+
+def test_replay_strategy(tmp_path: Path):
+    path = tmp_path / "recording.jsonl"
+    write_recording(path)
+
+    async def setup(client: ReplayClient) -> None:
+        dispatcher = MessageDispatcher(client)
+        sensor = MQTTSensor(
+            client, "+/firstfloor/+/temperature", "temperature", dispatcher=dispatcher
+        )
+        rego = Rego1000(client, id="abc", topic="abc/HP/#", dispatcher=dispatcher)
+        strategy = OffsetOutdoorTemperatureStrategy(rego, sensor, influence=3.0)
+        scheduler = Scheduler()
+        scheduler.register("offset", strategy)
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(dispatcher.run())
+            tg.create_task(sensor.start_sensor())
+            tg.create_task(rego.start())
+            tg.create_task(scheduler.run())
+
+    started = time.perf_counter()
+    client = run_replay(setup, ReplayClient(path))
+
+    assert time.perf_counter() - started < 10
+    writes = client.writes
+    assert len(writes) == DAYS * 24
+    assert writes[0].timestamp == START - 1  # First run before any data
+    assert writes[0].payload == 0
+    assert {w.payload for w in writes[1:]} == {-3.0, 3.0}
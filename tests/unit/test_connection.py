@@ -0,0 +1,106 @@
+import asyncio
+import gc
+import weakref
+
+import aiomqtt
+
+from controller.connection import BUFFERED, ConnectionManager
+
+
+class FlakyClient:
+    """Client whose connection fails a number of times and can be dropped"""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.connects = 0
+        self.subscribed: list[str] = []
+        self.published: list[tuple[str, object]] = []
+        self._incoming: asyncio.Queue = asyncio.Queue()
+
+    async def __aenter__(self):
+        self.connects += 1
+        if self.failures:
+            self.failures -= 1
+            raise aiomqtt.MqttError("Connection refused")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def subscribe(self, topic, *args, **kwargs):
+        self.subscribed.append(topic)
+
+    async def publish(self, topic, payload=None, *args, **kwargs):
+        self.published.append((topic, payload))
+
+    def drop(self) -> None:
+        self._incoming.put_nowait(None)
+
+    def receive(self, topic: str) -> None:
+        self._incoming.put_nowait(
+            aiomqtt.Message(topic, b"1", qos=0, retain=False, mid=0, properties=None)
+        )
+
+    @property
+    def messages(self):
+        async def iterate():
+            while (message := await self._incoming.get()) is not None:
+                yield message
+            raise aiomqtt.MqttError("Disconnected during message iteration")
+
+        return iterate()
+
+
+def test_reconnect_restores_subscriptions_and_sends_buffered():
+    async def run():
+        client = FlakyClient(failures=2)
+        connection = ConnectionManager(client, min_delay=0.001, max_delay=0.002)
+        await connection.subscribe("a/#")
+        await connection.publish("id/HP/SET/0203", 1)
+        await connection.publish("id/HP/SET/0203", 2)  # Supersedes
+        task = asyncio.create_task(connection.run())
+
+        await asyncio.wait_for(connection.connected.wait(), 1)
+        assert client.connects == 3
+        assert client.subscribed == ["a/#"]
+        assert client.published == [("id/HP/SET/0203", 2)]
+
+        client.receive("a/b")
+        messages = connection.messages
+        assert (await anext(messages)).topic.value == "a/b"
+
+        client.drop()
+        await asyncio.sleep(0)
+        assert not connection.connected.is_set()
+        await connection.publish("id/HP/SET/0204", 3)
+        assert connection.buffered == 1
+
+        await asyncio.wait_for(connection.connected.wait(), 1)
+        task.cancel()
+        return client, connection
+
+    client, connection = asyncio.run(run())
+    assert client.subscribed == ["a/#", "a/#"]
+    assert client.published[-1] == ("id/HP/SET/0204", 3)
+    assert connection.buffered == 0
+    assert connection.reconnects == 3
+
+
+def test_offline_buffer_is_bounded():
+    async def run():
+        connection = ConnectionManager(FlakyClient(), buffer_size=2)
+        for i in range(3):
+            await connection.publish(f"t/{i}", i)
+        return connection
+
+    connection = asyncio.run(run())
+    assert list(connection._buffer) == ["t/1", "t/2"]
+
+
+def test_buffered_gauge_does_not_keep_manager_alive():
+    manager = ConnectionManager(FlakyClient())
+    retired = weakref.ref(manager)
+    del manager
+    gc.collect()
+    assert retired() is None
+    assert BUFFERED.labels().get() == 0
@@ -0,0 +1,27 @@
+from array import array
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+path = Path(__file__).parents[2] / "measurement_device" / "filters.py"
+spec = importlib.util.spec_from_file_location("device_filters", path)
+filters = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(filters)
+
+
+def test_median_ignores_spike_and_unused_slots():
+    values = array("f", [21.5, 85.0, 21.7, 0.0, 0.0])
+
+    assert filters.median(values, 3) == pytest.approx(21.7)
+    assert filters.median(array("f", [2.0, 1.0]), 2) == 1.5
+    with pytest.raises(ValueError):
+        filters.median(values, 0)
+
+
+def test_trimmed_mean():
+    values = array("f", [10, 1, 2, 3, 4, 5, 6, -100])
+
+    assert filters.trimmed_mean(values, 8, trim=0.25) == 3.5
+    assert list(values) == [-100, 1, 2, 3, 4, 5, 6, 10]
+    assert filters.trimmed_mean(array("f", [1.0]), 1) == 1.0
@@ -0,0 +1,88 @@
+import asyncio
+import gc
+from unittest.mock import AsyncMock, MagicMock
+import weakref
+
+import aiomqtt
+import pytest
+
+from husdata.dispatcher import QUEUE_DEPTH, MessageDispatcher, TopicTrie
+
+
+def make_message(topic: str, payload: bytes = b"1") -> aiomqtt.Message:
+    return aiomqtt.Message(topic, payload, qos=0, retain=False, mid=0, properties=None)
+
+
+@pytest.mark.parametrize(
+    "topic_filter,topic,expected",
+    [
+        ("a/b/c", "a/b/c", True),
+        ("a/b/c", "a/b", False),
+        ("a/+/c", "a/b/c", True),
+        ("a/+/c", "a/b/d", False),
+        ("+/HP/#", "8cce4efb8623/HP/0007", True),
+        ("+/HP/#", "8cce4efb8623/HP", True),
+        ("+/HP/#", "8cce4efb8623/XX/0007", False),
+        ("#", "any/topic", True),
+        ("#", "$SYS/broker", False),
+    ],
+)
+def test_trie_match(topic_filter: str, topic: str, expected: bool):
+    trie = TopicTrie()
+    trie.insert(topic_filter, "item")
+
+    assert (trie.match(topic) == ["item"]) == expected
+    if not topic.startswith("$"):
+        assert aiomqtt.Topic(topic).matches(topic_filter) == expected
+
+
+def test_trie_remove_prunes():
+    trie = TopicTrie()
+    trie.insert("a/+/c", 1)
+    trie.insert("a/b", 2)
+    trie.remove("a/+/c", 1)
+
+    assert trie.match("a/b/c") == []
+    assert trie.match("a/b") == [2]
+    assert trie.filters == ["a/b"]
+
+
+def test_dispatch_to_all_consumers():
+    async def run():
+        client = MagicMock()
+        client.subscribe = AsyncMock()
+        dispatcher = MessageDispatcher(client, maxsize=2)
+        sensor = await dispatcher.subscribe("+/firstfloor/+/temperature")
+        everything = await dispatcher.subscribe("#")
+        await dispatcher.subscribe("#")
+
+        dispatcher.dispatch(make_message("dev/firstfloor/room/temperature"))
+        dispatcher.dispatch(make_message("id/HP/0007"))
+        dispatcher.dispatch(make_message("id/HP/0008"))
+
+        assert client.subscribe.await_count == 2  # Only new filters subscribed
+        assert sensor.queue.qsize() == 1
+        assert everything.queue.qsize() == 2
+        assert everything.dropped == 1
+        assert dispatcher.dropped == 2  # Both subscriptions to everything
+        assert dispatcher.backlog == 5
+        assert (await everything.get()).topic.value == "id/HP/0007"
+
+    asyncio.run(run())
+
+
+def test_queue_depth_gauge_does_not_keep_dispatcher_alive():
+    async def run():
+        dispatcher = MessageDispatcher(MagicMock(subscribe=AsyncMock()))
+        subscription = await dispatcher.subscribe("gc/test")
+        subscription.put(make_message("gc/test"))
+        gauge = QUEUE_DEPTH.labels("gc/test")
+        assert gauge.get() == 1
+
+        retired = weakref.ref(dispatcher)
+        del dispatcher
+        gc.collect()
+        assert retired() is None
+        assert gauge.get() == 0
+
+    asyncio.run(run())
@@ -0,0 +1,88 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import aiomqtt
+import pytest
+
+from husdata.controllers import Rego1000
+from husdata.energy import EnergyAccounting, period_start
+from husdata.registers import ID_C30
+
+START = datetime(2024, 1, 31, 22, 30).timestamp()
+
+
+def make_energy(**kwargs) -> EnergyAccounting:
+    return EnergyAccounting(Rego1000.ENERGY_COUNTERS, Rego1000.ENERGY_RATIOS, **kwargs)
+
+
+def test_period_start():
+    assert period_start("hour", START) == datetime(2024, 1, 31, 22).timestamp()
+    assert period_start("day", START) == datetime(2024, 1, 31).timestamp()
+    assert period_start("month", START) == datetime(2024, 1, 1).timestamp()
+
+
+def test_totals_and_cop():
+    energy = make_energy()
+    supplied, consumed = ID_C30.SUPP_ENERGY_HEATING, ID_C30.COMPR_CONS_HEATING
+    assert energy.update(supplied, 1000.0, START) == {}  # Baseline
+    energy.update(consumed, 300.0, START)
+
+    energy.update(supplied, 1006.0, START + 600)
+    changes = energy.update(consumed, 302.0, START + 600)
+    assert changes["ENERGY/hour/COMPR_CONS_HEATING"] == 2.0
+    assert changes["ENERGY/hour/COP_HEATING"] == 3.0
+    assert changes["ENERGY/day/COP"] == 3.0
+
+    # Next hour and next month, the day and month totals start over
+    energy.update(supplied, 1010.0, START + 5400)
+    data = energy.data()
+    assert data["ENERGY/hour/SUPP_ENERGY_HEATING"] == 4.0
+    assert data["ENERGY/hour/COP_HEATING"] is None
+    assert data["ENERGY/day/SUPP_ENERGY_HEATING"] == 4.0
+    [(_, january), (_, february)] = energy.totals("month")
+    assert january["SUPP_ENERGY_HEATING"] == 6.0
+    assert february["SUPP_ENERGY_HEATING"] == 4.0
+
+
+def test_counter_reset():
+    energy = make_energy()
+    energy.update(ID_C30.AUX_CONS_HEATING, 500.0, START)
+    changes = energy.update(ID_C30.AUX_CONS_HEATING, 3.0, START + 60)
+    assert changes["ENERGY/hour/AUX_CONS_HEATING"] == 3.0
+    assert energy.resets == 1
+
+
+def test_bounded_periods():
+    energy = make_energy(capacity={"hour": 3})
+    for hour in range(10):
+        energy.update(ID_C30.SUPP_ENERGY_HEATING, float(hour), START + hour * 3600)
+    assert len(energy.totals("hour")) == 3
+
+
+def test_snapshot_restore():
+    energy = make_energy()
+    energy.update(ID_C30.SUPP_ENERGY_HEATING, 10.0, START)
+    energy.update(ID_C30.SUPP_ENERGY_HEATING, 12.0, START + 60)
+
+    restored = make_energy()
+    restored.restore(energy.snapshot())
+    restored.update(ID_C30.SUPP_ENERGY_HEATING, 13.0, START + 120)
+    assert restored.data()["ENERGY/hour/SUPP_ENERGY_HEATING"] == 3.0
+
+
+def test_rego_data_access():
+    rego = Rego1000(MagicMock(), id="abc")
+    for payload in (b"1000", b"1003"):
+        rego._update_data_from_message(
+            aiomqtt.Message(
+                f"abc/HP/{ID_C30.SUPP_ENERGY_HEATING}",
+                payload,
+                qos=0,
+                retain=False,
+                mid=0,
+                properties=None,
+            )
+        )
+    assert rego.get_variable(ID_C30.SUPP_ENERGY_HEATING) == 1003.0
+    assert rego.get_variable("ENERGY/day/SUPP_ENERGY_HEATING") == pytest.approx(3.0)
+    assert "ENERGY/month/COP" in rego.get_all_data()
@@ -0,0 +1,28 @@
+from husdata.events import ChangeNotifier
+
+
+def test_deadband():
+    changes = []
+    notifier = ChangeNotifier()
+    notifier.watch(lambda key, value: changes.append((key, value)), "temp", 0.2)
+
+    for value in [21.0, 21.1, 21.2, 21.25, 20.9, 20.9]:
+        notifier.notify("temp", value)
+    notifier.notify("other", 1.0)
+
+    assert changes == [("temp", 21.0), ("temp", 21.25), ("temp", 20.9)]
+
+
+def test_watch_all_keys():
+    changes = []
+    notifier = ChangeNotifier()
+    watch = notifier.watch(lambda key, value: changes.append(key))
+
+    notifier.notify("a", "ON")
+    notifier.notify("b", 1)
+    notifier.notify("a", "ON")
+    notifier.notify("a", "OFF")
+    notifier.unwatch(watch)
+    notifier.notify("a", "ON")
+
+    assert changes == ["a", "b", "a"]
@@ -0,0 +1,55 @@
+import pytest
+
+from husdata.history import History, RingBuffer
+
+
+@pytest.fixture
+def buffer() -> RingBuffer:
+    """Buffer that has wrapped around, holding samples at t=3..7 with value t*10"""
+    buffer = RingBuffer(capacity=5)
+    for t in range(8):
+        buffer.append(t, t * 10.0)
+    return buffer
+
+
+def test_ring_buffer_wraps(buffer: RingBuffer):
+    timestamps, values = buffer.window()
+
+    assert len(buffer) == 5
+    assert list(timestamps) == [3, 4, 5, 6, 7]
+    assert list(values) == [30, 40, 50, 60, 70]
+    assert buffer.latest == (7, 70)
+
+
+def test_ring_buffer_queries(buffer: RingBuffer):
+    assert list(buffer.window(4, 5.5)[1]) == [40, 50]
+    assert list(buffer.last(2, now=7)[1]) == [50, 60, 70]
+    assert buffer.min(4) == 40
+    assert buffer.max(end=5) == 50
+    assert buffer.mean(5, 7) == 60
+    assert buffer.mean(100) is None
+    assert buffer.value_at(5.9) == 50
+    assert buffer.value_at(2) is None
+
+
+def test_ring_buffer_keeps_order():
+    buffer = RingBuffer(capacity=3)
+    buffer.append(10, 1.0)
+    buffer.append(9, 2.0)
+
+    assert list(buffer.window()[0]) == [10, 10]
+
+
+def test_history_sink():
+    samples = []
+
+    class Sink:
+        def append(self, signal, timestamp, value):
+            samples.append((signal, timestamp, value))
+
+    history = History(capacity=10, sink=Sink())
+    history.append("temperature", 21.5, timestamp=100)
+
+    assert "temperature" in history
+    assert history["temperature"].latest == (100, 21.5)
+    assert samples == [("temperature", 100, 21.5)]
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY = ("aiomqtt", "paho", "pydantic", "pydantic_settings", "numpy")
+# Share of the import time of the MQTT and settings stack, measured in the same
+# run so a slow or loaded host slows down both
+IMPORT_BUDGET = 1 / 3
+
+SCRIPT = """
+import json, sys, time
+import argparse, asyncio, logging, multiprocessing, struct, typing
+started = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "loaded": [m for m in sys.modules if m.split(".")[0] in %r],
+}))
+""" % (HEAVY,)
+
+
+def cold_import(*modules: str) -> dict:
+    """Imports modules in a new interpreter with the same path"""
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT, *modules],
+        capture_output=True,
+        check=True,
+        text=True,
+        env=os.environ | {"PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.fixture(scope="module")
+def heavy_seconds() -> float:
+    """Seconds to import the MQTT and settings stack"""
+    return cold_import("aiomqtt", "pydantic_settings")["seconds"]
+
+
+@pytest.mark.parametrize(
+    "modules",
+    [
+        ("husdata.registers", "controller.util"),
+        ("controller.main",),
+        ("husdata.gateway", "husdata.registry", "controller.strategies"),
+    ],
+)
+def test_cold_import(modules: tuple[str, ...], heavy_seconds: float):
+    result = cold_import(*modules)
+    assert result["loaded"] == []
+    assert result["seconds"] < IMPORT_BUDGET * heavy_seconds
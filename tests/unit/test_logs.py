@@ -0,0 +1,77 @@
+import json
+import logging
+
+from controller import logs
+from controller.logs import JsonFormatter, RateLimitFilter, setup_logging
+
+
+def make_record(
+    msg: str, level: int = logging.INFO, lineno: int = 1
+) -> logging.LogRecord:
+    return logging.LogRecord(
+        "controller.strategies", level, __file__, lineno, msg, (), None
+    )
+
+
+def test_rate_limit(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(logs.time, "monotonic", lambda: now[0])
+    limit = RateLimitFilter(rate=2, period=10)
+    chatty = "Could not update setpoint temperature, uses old value"
+
+    assert [limit.filter(make_record(chatty)) for _ in range(3)] == [
+        True, True, False
+    ]
+    # Same line with another value, e.g. from an f-string
+    assert not limit.filter(make_record(f"{chatty} 21.5"))
+    assert limit.filter(make_record("Other message", lineno=2))
+    assert limit.filter(make_record(chatty, logging.ERROR))
+
+    now[0] = 5.0  # One token refilled
+    record = make_record(chatty)
+    assert limit.filter(record)
+    assert record.getMessage() == f"{chatty} (2 similar suppressed)"
+    assert not limit.filter(make_record(chatty))
+
+
+def test_json_formatter():
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = logging.LogRecord(
+            "husdata", logging.ERROR, __file__, 1, "Failed %s", ("x",),
+            exc_info=__import__("sys").exc_info(),
+        )
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "husdata"
+    assert entry["message"] == "Failed x"
+    assert "ValueError: bad" in entry["exception"]
+
+
+def test_setup_logging(tmp_path):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    path = tmp_path / "log.txt"
+    try:
+        listener = setup_logging(str(path), console=False)
+        logging.getLogger("test").info("Hello")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            logging.getLogger("test").exception("Failed")
+        listener.stop()
+        assert not listener.running
+        listener.stop()  # As at exit
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+    hello, failed = map(json.loads, path.read_text().splitlines()[-2:])
+    assert hello["message"] == "Hello"
+    assert failed["message"] == "Failed"
+    assert "ValueError: bad" in failed["exception"]
@@ -0,0 +1,88 @@
+import asyncio
+import math
+
+import pytest
+
+from controller.exporter import MetricsServer
+from husdata.metrics import Registry
+
+
+def test_render():
+    registry = Registry()
+    messages = registry.counter("messages_total", "Messages", ("topic",))
+    messages.labels('a/"b"').inc()
+    messages.labels('a/"b"').inc(2)
+    age = registry.gauge("age_seconds", "Age", ("sensor",))
+    age.labels("t").set_function(lambda: None)
+    duration = registry.histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        duration.observe(value)
+
+    assert registry.counter("messages_total", "Messages", ("topic",)) is messages
+    with pytest.raises(ValueError):
+        registry.counter("messages_total", "Messages", ("gateway",))
+    with pytest.raises(ValueError):
+        registry.gauge("messages_total", "Messages", ("topic",))
+    assert registry.render().splitlines() == [
+        "# HELP messages_total Messages",
+        "# TYPE messages_total counter",
+        'messages_total{topic="a/\\"b\\""} 3.0',
+        "# HELP age_seconds Age",
+        "# TYPE age_seconds gauge",
+        'age_seconds{sensor="t"} NaN',
+        "# HELP duration_seconds Duration",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{le="0.1"} 2',
+        'duration_seconds_bucket{le="1.0"} 3',
+        'duration_seconds_bucket{le="+Inf"} 4',
+        "duration_seconds_sum 5.65",
+        "duration_seconds_count 4",
+    ]
+
+
+def test_histogram_child():
+    registry = Registry()
+    child = registry.histogram("h", "H", ("a",), buckets=(1, 2)).labels("x")
+    child.observe(math.inf)
+    child.observe(2)
+
+    assert child.counts == [0, 1, 1]
+    assert child.count == 2
+
+
+def test_server():
+    async def get(path: str) -> bytes:
+        registry = Registry()
+        registry.counter("c_total", "C").inc()
+        metrics = MetricsServer(registry=registry)
+        server = await asyncio.start_server(metrics._handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+        return response
+
+    response = asyncio.run(get("/metrics"))
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert response.endswith(b"c_total 1.0\n")
+    assert asyncio.run(get("/other")).startswith(b"HTTP/1.1 404")
+
+
+def test_server_failure_does_not_stop_other_tasks():
+    async def run():
+        taken = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = taken.sockets[0].getsockname()[1]
+        control = asyncio.Event()
+
+        async def control_loop():
+            await asyncio.sleep(0.05)
+            control.set()
+
+        async with taken, asyncio.TaskGroup() as tg:
+            tg.create_task(MetricsServer("127.0.0.1", port).run())
+            tg.create_task(control_loop())
+        assert control.is_set()
+
+    asyncio.run(run())
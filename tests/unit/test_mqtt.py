@@ -0,0 +1,200 @@
+import asyncio
+import gc
+import importlib.util
+from pathlib import Path
+import struct
+import sys
+from unittest.mock import MagicMock, patch
+import weakref
+
+import aiomqtt
+import pytest
+
+from controller.mqtt import VALUE_AGE, MQTTSensor, MQTTSensorGroup
+from controller.replay import VirtualClockEventLoop
+
+
+def make_message(topic: str, payload: bytes) -> aiomqtt.Message:
+    return aiomqtt.Message(topic, payload, qos=0, retain=False, mid=0, properties=None)
+
+
+def test_sensor_update():
+    sensor = MQTTSensor(MagicMock(), "+/firstfloor/+/temperature", "temperature")
+    topic = "dev1/firstfloor/kitchen/temperature"
+    sensor.update_from_message(make_message(topic, b"21.5"))
+
+    assert sensor.id == "dev1"
+    assert sensor.value == 21.5
+
+
+@pytest.mark.parametrize(
+    "aggregate,expected",
+    [("mean", 21.0), ("median", 21.0), ("min", 19.0), ("weighted", 130 / 6)],
+)
+def test_group_aggregate(aggregate: str, expected: float):
+    group = MQTTSensorGroup(
+        MagicMock(),
+        "+/firstfloor/+/temperature",
+        "temperature",
+        aggregate=aggregate,
+        weights={"dev3": 3.0},
+    )
+    readings = [
+        ("dev1", b"30.0"),
+        ("dev2", b"19.0"),
+        ("dev3", b"23.0"),
+        ("dev1", b"20.0"),  # Replaces the first reading
+        ("dev4", b"22.0"),
+        ("dev2", b"nan"),  # Ignored, as are infinite values
+        ("dev5", b"inf"),
+    ]
+    for device_id, payload in readings:
+        topic = f"{device_id}/firstfloor/room/temperature"
+        group.update_from_message(make_message(topic, payload))
+
+    assert len(group.devices) == 4
+    assert group.value == pytest.approx(expected)
+    # Order statistics only, mean and weighted are kept as running sums
+    assert len(group._sorted) == (4 if aggregate in ("median", "min") else 0)
+    with pytest.raises(AttributeError):
+        group.value = None
+
+
+def test_group_drops_stale_devices(monkeypatch: pytest.MonkeyPatch):
+    now = 1000.0
+    monkeypatch.setattr("controller.mqtt.time.monotonic", lambda: now)
+    group = MQTTSensorGroup(
+        MagicMock(), "+/temperature", "temperature", stale_timeout=60
+    )
+    group.update_from_message(make_message("dev1/temperature", b"20.0"))
+    now += 50
+    group.update_from_message(make_message("dev2/temperature", b"22.0"))
+    assert group.value == 21.0
+
+    now += 20
+    assert group.value == 22.0
+    assert list(group.devices) == ["dev2"]
+
+    now += 100
+    assert group.value is None
+
+
+def load_device_module(name: str, **imports):
+    """Module of the MicroPython sensor that only needs the standard library"""
+    path = Path(__file__).parents[2] / "measurement_device" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(f"device_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(sys.modules, imports):
+        spec.loader.exec_module(module)
+    return module
+
+
+def test_age_gauge_does_not_keep_sensor_alive():
+    sensor = MQTTSensor(MagicMock(), "+/temperature", "age_test")
+    sensor.update_from_message(make_message("dev1/temperature", b"20.0"))
+    gauge = VALUE_AGE.labels("age_test")
+    assert gauge.get() >= 0
+
+    retired = weakref.ref(sensor)
+    del sensor
+    gc.collect()
+    assert retired() is None
+    assert gauge.get() is None
+
+    # A new sensor with the same name, e.g. after a restart, takes over
+    sensor = MQTTSensor(MagicMock(), "+/temperature", "age_test")
+    sensor.update_from_message(make_message("dev1/temperature", b"20.0"))
+    assert gauge.get() >= 0
+
+
+def test_group_stale_on_virtual_clock():
+    async def run():
+        group = MQTTSensorGroup(
+            MagicMock(), "+/temperature", "temperature", stale_timeout=600
+        )
+        group.update_from_message(make_message("dev1/temperature", b"20.0"))
+        await asyncio.sleep(3600)  # An hour of replay, no real time
+        assert group.value is None
+
+    with asyncio.Runner(loop_factory=VirtualClockEventLoop) as runner:
+        runner.run(run())
+
+
+def test_binary_reading():
+    payload = load_device_module("payload")
+    sensor = MQTTSensorGroup(
+        MagicMock(),
+        "+/floor/+/temperature",
+        "temperature",
+        reading_topic="+/floor/+/reading",
+    )
+
+    def publish(device: str, sequence: int, timestamp: int, temperature: float):
+        message = make_message(
+            f"{device}/floor/room/reading",
+            payload.pack_reading(sequence, timestamp, temperature, 40.0),
+        )
+        sensor.update_from_message(message)
+
+    publish("a", 0, 1_700_000_000, 21.5)
+    assert sensor.value == 21.5
+    assert sensor.timestamp.timestamp() == 1_700_000_000
+
+    publish("a", 3, 1_700_000_030, 22.5)  # 1 and 2 lost
+    publish("a", 3, 1_700_000_030, 30.0)  # Duplicate
+    publish("a", 0, 0, 23.5)  # Restarted, clock not set
+    sensor.update_from_message(make_message("b/floor/room/temperature", b"19.5"))
+
+    assert sensor.lost == 2
+    assert sensor.devices["a"][0] == 23.5
+    assert sensor.value == 21.5
+    assert sensor.timestamp.year >= 2024
+
+    sensor.update_from_message(make_message("a/floor/room/reading", b"\x02" * 17))
+    assert sensor.devices["a"][0] == 23.5
+
+
+def test_batch_of_readings():
+    payload = load_device_module("payload")
+    batch = load_device_module("batch", payload=payload)
+
+    buffer = batch.ReadingBuffer(3)
+    for i in range(5):  # The first two are overwritten
+        buffer.append(1_700_000_000 + 60 * i, 20.0 + i, 40.0)
+    received = []
+    sensor = MQTTSensor(
+        MagicMock(), "+/floor/+/temperature", "temperature",
+        reading_topic="+/floor/+/reading",
+    )
+    sensor.changes.watch(lambda key, value: received.append(
+        (sensor.timestamp.timestamp(), value)
+    ))
+    sensor.update_from_message(make_message("a/floor/room/reading", buffer.pack()))
+    buffer.clear()
+    buffer.append(1_700_000_300, 25.0, 40.0)
+    sensor.update_from_message(make_message("a/floor/room/reading", buffer.pack()))
+
+    assert received == [
+        (1_700_000_120, 22.0),
+        (1_700_000_180, 23.0),
+        (1_700_000_240, 24.0),
+        (1_700_000_300, 25.0),
+    ]
+    assert sensor.sequences["a"] == 5
+    assert sensor.lost == 0  # Lost on the device before the first batch
+
+
+def test_batch_kept_over_deep_sleep():
+    payload = load_device_module("payload")
+    batch = load_device_module("batch", payload=payload)
+
+    buffer = batch.ReadingBuffer(4)
+    for i in range(3):  # Before the clock is set
+        buffer.append(0, 20.0 + i, 40.0)
+    restored = batch.ReadingBuffer(4)
+    assert restored.loads(buffer.dumps())
+    assert not batch.ReadingBuffer(5).loads(buffer.dumps())
+
+    restored.backfill(1_700_000_120, 60)
+    _, _, _, *records = struct.unpack("<BBI" + "Iff" * 3, restored.pack())
+    assert records[::3] == [1_700_000_000, 1_700_000_060, 1_700_000_120]
@@ -16,4 +16,25 @@ from husdata import registers as reg
     ]
 )
 def test_is_data_type(idx: str, data_type: reg.DataType):
-    assert reg.is_data_type(idx, data_type)
\ No newline at end of file
+    assert reg.is_data_type(idx, data_type)
+
+@pytest.mark.parametrize(
+    "idx,raw,expected",
+    [
+        ("0007", "-3.5", -3.5),
+        ("1A01", "1", True),
+        ("1A01", "0", False),
+        ("B20A", "2", 2.0),
+        ("5C52", "1234.5", 1234.5),
+        ("STATUS", "OK", "OK"),
+        ("0FFF", "12", 12.0),  # Unknown index resolved from its prefix
+    ]
+)
+def test_get_converter(idx: str, raw: str, expected):
+    assert reg.get_converter(idx)(raw) == expected
+
+
+@pytest.mark.parametrize("idx", ["", "SET/0217"])
+def test_get_converter_unknown(idx: str):
+    with pytest.raises(reg.TranslationError):
+        reg.get_converter(idx)
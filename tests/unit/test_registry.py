@@ -0,0 +1,83 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import aiomqtt
+
+from husdata.dispatcher import MessageDispatcher
+from husdata.controllers import Rego1000
+from husdata.history import History
+from husdata.registry import GatewayRegistry
+
+
+def make_message(topic: str, payload: str) -> aiomqtt.Message:
+    return aiomqtt.Message(
+        topic, payload.encode(), qos=0, retain=False, mid=0, properties=None
+    )
+
+
+def test_route_by_id():
+    client = MagicMock(subscribe=AsyncMock())
+    history = History(capacity=10)
+    discovered = []
+    registry = GatewayRegistry(
+        client, MessageDispatcher(client), history=history, on_new=discovered.append
+    )
+    configured = registry.add("a")
+
+    registry.route(make_message("a/HP/0007", "-3.5"))
+    registry.route(make_message("b/HP/0007", "4.5"))
+
+    assert isinstance(registry["b"], Rego1000)
+    assert discovered == [registry["b"]]
+    assert len(registry) == 2
+    assert configured.get_variable("0007") == -3.5
+    assert registry["b"].get_variable("0007") == 4.5
+    assert history["a/0007"].latest[1] == -3.5
+    assert history["b/0007"].latest[1] == 4.5
+
+
+def test_gateway_ignores_other_ids():
+    rego = Rego1000(MagicMock(), id="a")
+    rego._update_data_from_message(make_message("a/HP/0007", "1.0"))
+    rego._update_data_from_message(make_message("b/HP/0007", "2.0"))
+
+    assert rego.get_variable("0007") == 1.0
+
+
+def test_run_uses_one_subscription():
+    async def run():
+        client = MagicMock(subscribe=AsyncMock())
+        dispatcher = MessageDispatcher(client)
+        registry = GatewayRegistry(client, dispatcher)
+        task = asyncio.create_task(registry.run())
+        await asyncio.sleep(0)
+        for i in range(3):
+            dispatcher.dispatch(make_message(f"hp{i}/HP/0007", "1.0"))
+        await asyncio.sleep(0)
+        task.cancel()
+        return registry, client
+
+    registry, client = asyncio.run(run())
+    assert client.subscribe.await_count == 1
+    assert len(registry) == 3
+
+
+def test_shard_subscribes_to_own_gateways():
+    async def run():
+        client = MagicMock(subscribe=AsyncMock())
+        dispatcher = MessageDispatcher(client)
+        registry = GatewayRegistry(client, dispatcher, discover=False)
+        registry.add("a")
+        registry.add("b")
+        task = asyncio.create_task(registry.run())
+        await asyncio.sleep(0)
+        for id in "abc":
+            dispatcher.dispatch(make_message(f"{id}/HP/0007", "1.0"))
+        await asyncio.sleep(0)
+        task.cancel()
+        return registry, dispatcher
+
+    registry, dispatcher = asyncio.run(run())
+    assert dispatcher.topics == ["a/HP/#", "b/HP/#"]
+    assert len(registry) == 2
+    assert registry["b"].get_variable("0007") == 1.0
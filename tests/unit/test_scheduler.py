@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from controller.exceptions import AlreadyRegisteredError
+from controller.replay import VirtualClockEventLoop
+from controller.scheduler import Scheduler
+
+
+def run_virtual(coroutine) -> None:
+    """Runs on a virtual clock, so sleeps take no time and counts are exact"""
+    with asyncio.Runner(loop_factory=VirtualClockEventLoop) as runner:
+        runner.run(coroutine)
+
+
+class CountingStrategy:
+    def __init__(self, period: float, duration: float = 0.0) -> None:
+        self.period = period
+        self.duration = duration
+        self.triggers: list[float] = []
+
+    async def trigger(self) -> None:
+        self.triggers.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(self.duration)
+
+
+def test_periodic_without_drift():
+    async def run():
+        scheduler = Scheduler()
+        slow = CountingStrategy(period=0.05, duration=0.02)
+        fast = CountingStrategy(period=0.02)
+        scheduler.register("slow", slow)
+        scheduler.register("fast", fast)
+        with pytest.raises(AlreadyRegisteredError):
+            scheduler.register("slow", slow)
+
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.23)
+        task.cancel()
+
+        assert len(slow.triggers) == 5
+        # Runs are a period apart even though each run takes time
+        offsets = [t - slow.triggers[0] - i * 0.05 for i, t in enumerate(slow.triggers)]
+        assert max(offsets) < 0.03
+        assert len(fast.triggers) >= 8
+
+    run_virtual(run())
+
+
+def test_request_run():
+    async def run():
+        scheduler = Scheduler()
+        strategy = CountingStrategy(period=10)
+        scheduler.register("strategy", strategy)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+
+        scheduler.request_run("strategy", delay=0.01)
+        await asyncio.sleep(0.03)
+        task.cancel()
+
+        assert len(strategy.triggers) == 2
+        assert scheduler.get("strategy").runs == 2
+
+    run_virtual(run())
+
+
+def test_request_run_debounced():
+    async def run():
+        scheduler = Scheduler()
+        strategy = CountingStrategy(period=10)
+        scheduler.register("strategy", strategy)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+
+        for _ in range(5):
+            scheduler.request_run("strategy", delay=0.02)
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.04)
+        task.cancel()
+
+        assert len(strategy.triggers) == 2  # Periodic and one debounced run
+
+    run_virtual(run())
@@ -0,0 +1,149 @@
+import asyncio
+import json
+from pathlib import Path
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import aiomqtt
+
+from controller.mqtt import MQTTSensorGroup
+from controller.scheduler import Scheduler
+from controller.snapshot import SnapshotStore
+from controller.strategies import OffsetOutdoorTemperatureStrategy
+from husdata.controllers import Rego1000
+
+
+def make_message(topic: str, payload: bytes) -> aiomqtt.Message:
+    return aiomqtt.Message(topic, payload, qos=0, retain=False, mid=0, properties=None)
+
+
+def make_site(id: str = "abc"):
+    client = MagicMock(publish=AsyncMock())
+    rego = Rego1000(client, id=id)
+    sensor = MQTTSensorGroup(client, "+/firstfloor/+/temperature", f"{id}/temperature")
+    strategy = OffsetOutdoorTemperatureStrategy(rego, sensor, influence=2.0)
+    return rego, sensor, strategy
+
+
+def register_site(store: SnapshotStore, rego, sensor, strategy) -> list[bool]:
+    return [
+        store.register("abc/rego", rego),
+        store.register("abc/temperature", sensor),
+        store.register("abc/offset_outdoor_temperature", strategy),
+    ]
+
+
+def test_save_and_restore(tmp_path: Path):
+    rego, sensor, strategy = make_site()
+    store = SnapshotStore(tmp_path / "snapshot.json")
+    assert store.load() == 0
+    register_site(store, rego, sensor, strategy)
+
+    setpoint = rego.ID.ROOM_TEMP_SETPOINT
+    rego._update_data_from_message(make_message(f"abc/HP/{setpoint}", b"21.0"))
+    for device, payload in [("dev1", b"20.0"), ("dev2", b"22.0")]:
+        sensor.update_from_message(
+            make_message(f"{device}/firstfloor/kitchen/temperature", payload)
+        )
+    asyncio.run(strategy.trigger())
+    store.save()
+
+    rego, sensor, strategy = make_site()
+    store = SnapshotStore(tmp_path / "snapshot.json")
+    assert store.load() == 3
+    assert register_site(store, rego, sensor, strategy) == [True, True, True]
+
+    assert rego.get_variable(setpoint) == 21.0
+    assert sensor.value == 21.0
+    assert sensor.devices.keys() == {"dev1", "dev2"}
+    assert strategy.temperature_setpoint == 21.0
+    assert strategy.temperature_offest == 0.0
+    assert strategy.last_trigger is not None
+
+
+def test_restore_keeps_newer_values(tmp_path: Path):
+    rego, sensor, strategy = make_site()
+    store = SnapshotStore(tmp_path / "snapshot.json")
+    register_site(store, rego, sensor, strategy)
+    sensor.update_from_message(make_message("dev1/firstfloor/a/temperature", b"20.0"))
+    store.save()
+
+    rego, sensor, strategy = make_site()
+    sensor.update_from_message(make_message("dev2/firstfloor/a/temperature", b"23.0"))
+    store = SnapshotStore(tmp_path / "snapshot.json")
+    store.load()
+    register_site(store, rego, sensor, strategy)
+    assert sensor.value == 23.0
+    assert sensor.devices.keys() == {"dev2"}
+
+
+def test_stale_snapshot_ignored(tmp_path: Path):
+    path = tmp_path / "snapshot.json"
+    rego, sensor, strategy = make_site()
+    store = SnapshotStore(path)
+    register_site(store, rego, sensor, strategy)
+    snapshot = store.snapshot()
+    snapshot["time"] -= 7200
+    path.write_text(json.dumps(snapshot))
+
+    assert SnapshotStore(path, max_age=3600).load() == 0
+    assert SnapshotStore(path, max_age=86400).load() == 3
+
+
+def test_corrupt_snapshot_ignored(tmp_path: Path):
+    path = tmp_path / "snapshot.json"
+    path.write_text('{"version": 1, "ti')
+    store = SnapshotStore(path)
+    assert store.load() == 0
+    assert not store.register("abc/rego", make_site()[0])
+
+
+def test_run_saves_when_cancelled(tmp_path: Path):
+    async def run():
+        store = SnapshotStore(tmp_path / "data" / "snapshot.json", interval=10)
+        store.register("abc/rego", make_site()[0])
+        task = asyncio.create_task(store.run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    snapshot = json.loads((tmp_path / "data" / "snapshot.json").read_text())
+    assert snapshot["objects"]["abc/rego"]["id"] == "abc"
+
+
+def test_run_continues_after_failed_save(tmp_path: Path, caplog):
+    blocked = tmp_path / "data"
+    blocked.write_text("")  # A file where the directory should be
+
+    async def run():
+        store = SnapshotStore(blocked / "snapshot.json", interval=0.01)
+        store.register("abc/rego", make_site()[0])
+        task = asyncio.create_task(store.run())
+        while "Could not save snapshot" not in caplog.text:
+            await asyncio.sleep(0.01)
+        blocked.unlink()
+        while not (blocked / "snapshot.json").exists():
+            await asyncio.sleep(0.01)
+        assert not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_first_run_after_last_run():
+    async def run():
+        scheduler = Scheduler()
+        strategy = MagicMock(trigger=AsyncMock())
+        now = asyncio.get_running_loop().time()
+        scheduled = scheduler.register(
+            "strategy", strategy, period=60, last_run=time.time() - 20
+        )
+        assert 39 < scheduled.next_run - now < 41
+        scheduled = scheduler.register(
+            "overdue", strategy, period=60, last_run=time.time() - 120
+        )
+        assert scheduled.next_run - now < 1
+
+    asyncio.run(run())
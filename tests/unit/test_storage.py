@@ -0,0 +1,114 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from controller.storage import RECORD, SegmentStore, SiteStore
+from husdata.history import History
+
+
+def test_store_and_read(tmp_path: Path):
+    store = SegmentStore(tmp_path, segment_duration=100)
+    for t in range(0, 300, 50):
+        store.append("temperature", t, t / 10)
+    store.append("0007", 250, -5.0)  # Stays in buffer until flushed
+
+    # Rotated buffers are only handed off, read from memory until written
+    assert store.segments() == []
+    assert list(store.read("temperature", start=100, end=200)) == [
+        ("temperature", 100, 10.0),
+        ("temperature", 150, 15.0),
+        ("temperature", 200, 20.0),
+    ]
+    assert list(store.read("0007")) == [("0007", 250, -5.0)]
+    assert next(store.read()) == ("temperature", 0, 0.0)
+
+    store.close()
+    assert [path.name for _, path in store.segments()] == [
+        "0000000000.seg",
+        "0000000100.seg",
+        "0000000200.seg",
+    ]
+    assert (tmp_path / "0000000200.seg").stat().st_size == 3 * RECORD.size
+    assert list(store.read("temperature", start=100, end=100)) == [
+        ("temperature", 100, 10.0)
+    ]
+
+
+def test_run_writes_handed_off_buffers(tmp_path: Path):
+    async def run():
+        store = SegmentStore(tmp_path, flush_interval=60, flush_size=2)
+        task = asyncio.create_task(store.run())
+        store.append("temperature", 10, 21.0)
+        store.append("temperature", 20, 21.5)  # Full, handed off
+        assert store.segments() == []
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    assert json.loads((tmp_path / "signals.json").read_text()) == {"temperature": 0}
+    assert (tmp_path / "0000000000.seg").stat().st_size == 2 * RECORD.size
+
+
+def test_failed_write_is_retried_once(tmp_path: Path):
+    store = SegmentStore(tmp_path, segment_duration=100)
+    store.append("temperature", 10, 21.0)
+    store.append("temperature", 110, 21.5)  # Next segment, handed off
+    store.append("temperature", 120, 22.0)
+    # Partly written record of a failed write
+    with open(tmp_path / "0000000100.seg", "wb") as f:
+        f.write(b"\x00" * (RECORD.size // 2))
+
+    write = store._write
+    calls = []
+
+    def failing_write(segment_start, data):
+        calls.append(segment_start)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        write(segment_start, data)
+
+    store._write = failing_write
+    with pytest.raises(OSError):
+        store.flush()
+    store.flush()
+
+    assert calls == [0, 100, 100]
+    assert [value for _, _, value in store.read()] == [21.0, 21.5, 22.0]
+    assert (tmp_path / "0000000100.seg").stat().st_size == 2 * RECORD.size
+
+
+def test_resume_history(tmp_path: Path):
+    store = SegmentStore(tmp_path)
+    history = History(sink=store)
+    history.append("temperature", 21.0, timestamp=1000)
+    history.append("temperature", 21.5, timestamp=1010)
+    store.close()
+
+    resumed_store = SegmentStore(tmp_path)
+    resumed = History(sink=resumed_store)
+    assert resumed_store.load(resumed, since=1005) == 1
+    assert resumed["temperature"].latest == (1010, 21.5)
+    assert list(resumed_store.read()) == list(store.read())  # Nothing re-written
+
+
+def test_site_store(tmp_path: Path):
+    async def run():
+        store = SiteStore(tmp_path, flush_interval=0.01)
+        task = asyncio.create_task(store.run())
+        store.append("abc/temperature", 10, 21.0)
+        await asyncio.sleep(0)
+        store.append("def/temperature", 10, 19.0)  # Added while running
+        await asyncio.sleep(0.1)
+        assert (tmp_path / "def" / "0000000000.seg").exists()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        store.close()
+
+    asyncio.run(run())
+    # A site moved to another process resumes from its own directory
+    history = History()
+    assert SiteStore(tmp_path).load(history, ["def"]) == 1
+    assert "def/temperature" in history
+    assert "abc/temperature" not in history
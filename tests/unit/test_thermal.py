@@ -0,0 +1,153 @@
+import asyncio
+import math
+import random
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from controller.replay import VirtualClockEventLoop
+from controller.strategies import PredictiveOffsetStrategy
+from controller.thermal import RecursiveLeastSquares, ThermalModel
+from husdata.controllers import Rego1000
+from husdata.history import History
+
+# Heating curve and building of the simulated house, see `controller.thermal`
+CURVE = (4.0, 0.9, -0.2)
+BUILDING = (0.0005, 0.004, 0.6, 0.0)
+
+
+def simulate(model: ThermalModel, samples: int, seed: int = 1) -> tuple:
+    """Runs the simulated house with varying weather and offsets"""
+    rng = random.Random(seed)
+    indoor, supply, change = 21.0, 30.0, 0.0
+    for k in range(samples):
+        outdoor = 5.0 * math.sin(2 * math.pi * k / 1440)
+        offset = float(rng.randint(-5, 5)) if k % 180 == 0 else offset
+        model.update(indoor, outdoor, supply, offset)
+        a, b, d, c = BUILDING
+        change = a * (outdoor - indoor) + b * (supply - indoor) + d * change + c
+        p0, p1, p2 = CURVE
+        supply = p0 + p1 * supply + p2 * (outdoor + offset) + rng.gauss(0, 0.01)
+        indoor += change
+    return indoor, outdoor, supply
+
+
+def test_recursive_least_squares():
+    rls = RecursiveLeastSquares(2, forgetting=1.0)
+    for x in range(20):
+        rls.update([1.0, x], 3.0 + 2.0 * x)
+    assert rls.theta == pytest.approx([3.0, 2.0], abs=0.01)
+    assert rls.predict([1.0, 100.0]) == pytest.approx(203.0, abs=0.1)
+
+
+def test_model_fit():
+    model = ThermalModel(sample_period=60, min_samples=100)
+    assert not model.ready
+    simulate(model, 3000)
+
+    assert model.ready
+    assert model.curve.theta == pytest.approx(CURVE, abs=0.05)
+    assert model.building.theta[:3] == pytest.approx(BUILDING[:3], rel=0.2)
+
+    # An offset that does not reduce the supply cannot be controlled with
+    model.curve.theta[2] = 0.01
+    assert not model.ready
+
+
+def test_best_offset():
+    model = ThermalModel(sample_period=60, min_samples=100)
+    indoor, outdoor, supply = simulate(model, 3000)
+
+    too_warm = model.best_offset(indoor, outdoor, supply, indoor - 1, 0.0, 6 * 3600)
+    too_cold = model.best_offset(indoor, outdoor, supply, indoor + 1, 0.0, 6 * 3600)
+    # Seeing a warmer outdoor temperature reduces heating
+    assert too_warm > too_cold
+    assert -10 <= too_cold < too_warm <= 10
+
+
+def test_fit_history():
+    history = History()
+    for k in range(200):
+        t = 1_700_000_000 + 60 * k
+        history.append("indoor", 21.0 + 0.01 * k, t)
+        history.append("outdoor", 0.0, t)
+        history.append("supply", 30.0, t)
+    model = ThermalModel(sample_period=60)
+
+    fitted = model.fit_history(
+        history["indoor"], history["outdoor"], history["supply"]
+    )
+    assert fitted == 200
+    assert model.building.samples == 199
+
+
+def test_predictive_strategy_falls_back_to_proportional():
+    async def run():
+        rego = Rego1000(MagicMock(publish=AsyncMock()), id="abc")
+        sensor = MagicMock(value=22.0)
+        strategy = PredictiveOffsetStrategy(
+            rego, sensor, influence=2.0, sample_period=60, control_period=3600
+        )
+        rego._data[rego.ID.ROOM_TEMP_SETPOINT] = 21.0
+        rego._data[rego.ID.OUTDOOR] = 0.0
+        rego._data[rego.ID.HEAT_CARRIER_FORWARD] = 30.0
+
+        await strategy.trigger()
+        assert strategy.temperature_offest == 2.0
+        assert strategy.model.building.samples == 0  # First sample
+        # Sampled every period but the offset is kept until the control period
+        strategy._last_sample -= 60
+        sensor.value = 23.0
+        await strategy.trigger()
+        assert strategy.model.building.samples == 1
+        assert strategy.temperature_offest == 2.0
+
+    asyncio.run(run())
+
+
+def test_predictive_strategy_uses_ready_model():
+    async def run():
+        rego = Rego1000(MagicMock(publish=AsyncMock()), id="abc")
+        sensor = MagicMock()
+        strategy = PredictiveOffsetStrategy(rego, sensor, influence=2.0)
+        strategy.model.min_samples = 100
+        indoor, outdoor, supply = simulate(strategy.model, 3000)
+        assert strategy.model.ready
+        sensor.value = indoor
+        rego._data[rego.ID.ROOM_TEMP_SETPOINT] = indoor + 1
+        rego._data[rego.ID.OUTDOOR] = outdoor
+        rego._data[rego.ID.HEAT_CARRIER_FORWARD] = supply
+        # The proportional offset would be -2
+        strategy.model.best_offset = MagicMock(return_value=-3.0)
+
+        await strategy.trigger()
+        strategy.model.best_offset.assert_called_once_with(
+            indoor, outdoor, supply, indoor + 1,
+            current_offset=0.0, horizon=strategy.horizon, step=1.0,
+        )
+        assert strategy.temperature_offest == -3.0
+
+    asyncio.run(run())
+
+
+def test_predictive_strategy_periods_on_loop_clock():
+    async def run():
+        client = MagicMock(publish=AsyncMock())
+        rego = Rego1000(client, id="abc")
+        strategy = PredictiveOffsetStrategy(
+            rego, MagicMock(value=22.0), influence=2.0, control_period=3600
+        )
+        rego._data[rego.ID.ROOM_TEMP_SETPOINT] = 21.0
+        rego._data[rego.ID.OUTDOOR] = 0.0
+        rego._data[rego.ID.HEAT_CARRIER_FORWARD] = 30.0
+
+        for _ in range(60):  # An hour of samples on the virtual clock
+            await strategy.trigger()
+            await asyncio.sleep(60)
+        assert strategy.model.building.samples == 59
+        assert client.publish.await_count == 1
+        await strategy.trigger()
+        assert client.publish.await_count == 2
+
+    with asyncio.Runner(loop_factory=VirtualClockEventLoop) as runner:
+        runner.run(run())
@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from controller import tuning  # noqa: E402
+
+
+def test_offset_series_matches_strategy():
+    indoor = np.array([22.0, 22.5, np.nan, 18.0, 25.0])
+    setpoint = np.full(5, 21.0)
+
+    offsets = tuning.offset_series(indoor, setpoint, influence=3.0, period=120)
+
+    # Triggered every second sample, missing values give 0, clamped to ±10
+    np.testing.assert_allclose(offsets, [3.0, 3.0, 0.0, 0.0, 10.0])
+
+
+def test_sweep_against_single_candidates():
+    rng = np.random.default_rng(1)
+    indoor = 21 + np.cumsum(rng.normal(0, 0.05, 5000))
+    setpoint = np.full(indoor.size, 21.0)
+    influences = np.linspace(0.5, 6, 12)
+    periods = np.array([600, 3600])
+
+    result = tuning.sweep(indoor, setpoint, influences, periods)
+
+    for i, period in enumerate(periods):
+        for j, influence in enumerate(influences):
+            offsets = tuning.offset_series(indoor, setpoint, influence, period)
+            instant = (indoor - setpoint) * influence
+            assert result["mean_offset"][i, j] == pytest.approx(offsets.mean())
+            assert result["saturated_fraction"][i, j] == pytest.approx(
+                np.mean(np.abs(offsets) >= 10)
+            )
+            assert result["tracking_rms"][i, j] == pytest.approx(
+                np.sqrt(np.mean((instant - offsets) ** 2))
+            )
+    assert result.best("tracking_rms") == (600, 0.5)
+
+
+def test_sweep_year_of_minute_data():
+    n = 365 * 24 * 60
+    indoor = 21 + np.sin(np.arange(n) / 1440)
+    started = time.perf_counter()
+    result = tuning.sweep(indoor, np.full(n, 21.0), np.linspace(0, 10, 200), [3600])
+
+    assert result["writes_per_day"].shape == (1, 200)
+    assert time.perf_counter() - started < 30
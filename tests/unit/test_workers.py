@@ -0,0 +1,164 @@
+import asyncio
+import multiprocessing
+import signal
+import time
+
+import pytest
+
+from controller.exceptions import WorkerError
+from controller.workers import Supervisor, assign_shards, shard_for
+
+FORK = multiprocessing.get_context("fork")
+
+
+def beating_worker(config, index, sites, heartbeat, interval):
+    while True:
+        heartbeat.value = time.monotonic()
+        time.sleep(interval)
+
+
+def crashing_worker(config, index, sites, heartbeat, interval):
+    if index == 0:
+        raise SystemExit(1)
+    beating_worker(config, index, sites, heartbeat, interval)
+
+
+def flaky_worker(config, index, sites, heartbeat, interval):
+    if config["crashes"].value:
+        config["crashes"].value -= 1
+        raise SystemExit(1)
+    beating_worker(config, index, sites, heartbeat, interval)
+
+
+def hanging_worker(config, index, sites, heartbeat, interval):
+    time.sleep(60)
+
+
+def stubborn_worker(config, index, sites, heartbeat, interval):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    beating_worker(config, index, sites, heartbeat, interval)
+
+
+def reporting_worker(config, index, sites, heartbeat, interval):
+    config["reports"].put((index, config["LOG_LEVEL"]))
+    beating_worker(config, index, sites, heartbeat, interval)
+
+
+def make_sites(n: int) -> dict[str, str]:
+    return {f"hp{i:04d}": f"hp{i:04d}/+/+/temperature" for i in range(n)}
+
+
+def test_assign_shards_is_stable_and_complete():
+    sites = make_sites(100)
+    shards = assign_shards(sites, 4)
+
+    assert sum(len(shard) for shard in shards) == 100
+    assert all(shard for shard in shards)
+    assert shards == assign_shards(dict(reversed(sites.items())), 4)
+    for index, shard in enumerate(shards):
+        assert all(shard_for(id, 4) == index for id in shard)
+
+
+def supervise(target, sites, checks=3, **kwargs) -> Supervisor:
+    supervisor = Supervisor(
+        sites,
+        heartbeat_interval=0.05,
+        heartbeat_timeout=0.5,
+        target=target,
+        context=FORK,
+        **kwargs,
+    )
+
+    async def run():
+        supervisor.start()
+        try:
+            for _ in range(checks):
+                await asyncio.sleep(0.2)
+                await supervisor.check()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+    return supervisor
+
+
+def test_healthy_workers_are_kept():
+    supervisor = supervise(beating_worker, make_sites(10), workers=2)
+
+    assert [w.restarts for w in supervisor.workers] == [0, 0]
+
+
+def test_workers_get_config_of_main_process():
+    config = {"reports": FORK.SimpleQueue(), "LOG_LEVEL": "DEBUG"}
+    supervise(reporting_worker, make_sites(10), checks=1, workers=2, config=config)
+
+    reports = {config["reports"].get(), config["reports"].get()}
+    assert reports == {(0, "DEBUG"), (1, "DEBUG")}
+
+
+def test_failing_worker_sites_are_reassigned():
+    sites = make_sites(10)
+    supervisor = supervise(crashing_worker, sites, workers=2, max_restarts=1)
+    failed, remaining = supervisor.workers
+
+    assert failed.retired and failed.restarts == 1
+    assert failed.sites == {}
+    assert remaining.sites == sites
+    assert remaining.restarts == 0
+
+
+def test_restarts_reset_when_stable():
+    config = {"crashes": FORK.Value("i", 1)}
+    supervisor = supervise(
+        flaky_worker,
+        make_sites(1),
+        checks=4,
+        workers=1,
+        max_restarts=1,
+        stable_period=0.3,
+        config=config,
+    )
+
+    assert config["crashes"].value == 0  # Crashed and was restarted once
+    assert supervisor.workers[0].restarts == 0
+    assert not supervisor.workers[0].retired
+
+
+def test_hanging_worker_is_restarted():
+    supervisor = supervise(
+        hanging_worker, make_sites(1), checks=4, workers=1, max_restarts=10
+    )
+
+    assert supervisor.workers[0].restarts >= 1
+
+
+def test_all_workers_failing():
+    with pytest.raises(WorkerError):
+        supervise(crashing_worker, make_sites(1), workers=1, max_restarts=0)
+
+
+def test_stopping_worker_does_not_block_loop():
+    async def run():
+        supervisor = Supervisor(
+            make_sites(1), workers=1, target=stubborn_worker, context=FORK
+        )
+        supervisor.start()
+        worker = supervisor.workers[0]
+        process = worker.process
+        await asyncio.sleep(0.1)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await supervisor._stop(worker, timeout=0.3)
+        ticker.cancel()
+        return ticks, process
+
+    ticks, process = asyncio.run(run())
+    assert ticks >= 10  # The loop ran while waiting for the worker to exit
+    assert process.exitcode == -signal.SIGKILL
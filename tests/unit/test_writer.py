@@ -0,0 +1,116 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import aiomqtt
+import pytest
+
+from husdata.controllers import Rego1000
+from husdata.exceptions import WriteTimeoutError
+from husdata.registers import ID_C30
+from husdata.writer import WriteQueue
+
+
+def make_rego(confirmed: dict) -> Rego1000:
+    rego = Rego1000(client=MagicMock(publish=AsyncMock()), id="abc")
+    rego.raw_data = confirmed
+    rego._publish = AsyncMock(wraps=rego._publish)
+    return rego
+
+
+def test_coalesce_and_drop_confirmed():
+    async def run():
+        rego = make_rego({ID_C30.OUTDOOR_TEMP_OFFSET: "2.0"})
+        rego.write_queue = WriteQueue(rego, tolerance=0.05)
+
+        await rego.set_variable(ID_C30.OUTDOOR_TEMP_OFFSET, 3.0)
+        await rego.set_variable(ID_C30.OUTDOOR_TEMP_OFFSET, 15.0)  # Clamped to 10
+        await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 21.0)
+        assert rego.write_queue.pending == {
+            ID_C30.OUTDOOR_TEMP_OFFSET: 10,
+            ID_C30.ROOM_TEMP_SETPOINT: 21.0,
+        }
+
+        # Back to the confirmed value cancels the pending write
+        await rego.set_variable(ID_C30.OUTDOOR_TEMP_OFFSET, 2.01)
+        await rego.write_queue.flush()
+
+        rego._publish.assert_awaited_once_with(ID_C30.ROOM_TEMP_SETPOINT, 21.0)
+
+    asyncio.run(run())
+
+
+def test_write_budget():
+    async def run():
+        rego = make_rego({})
+        queue = rego.write_queue = WriteQueue(rego, max_writes=2, period=0.1)
+        task = asyncio.create_task(queue.run())
+
+        for value in range(3):
+            await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 20.0 + value)
+            await rego.set_variable(ID_C30.HEAT_SET_1_CURVE_L, 1.0 + value)
+            await asyncio.sleep(0)
+
+        await asyncio.sleep(0.05)
+        assert rego._publish.await_count == 2
+        await asyncio.sleep(0.1)
+        assert rego._publish.await_count == 4
+        assert not queue.pending
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_write_confirmation():
+    async def run():
+        rego = make_rego({})
+        first = await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 20.0)
+        second = await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 21.0)
+        assert not first.confirmed
+
+        with pytest.raises(WriteTimeoutError):
+            await first.wait(timeout=0.01, retries=1)
+        # Not published again, it would overwrite the newer write
+        assert rego._publish.await_count == 2
+        rego._publish.assert_awaited_with(ID_C30.ROOM_TEMP_SETPOINT, 21.0)
+        assert first not in rego._pending_writes[ID_C30.ROOM_TEMP_SETPOINT]
+
+        rego._update_data_from_message(
+            aiomqtt.Message(
+                f"abc/HP/{ID_C30.ROOM_TEMP_SETPOINT}", b"21.0", 0, False, 0, None
+            )
+        )
+        assert await second >= 0
+        assert rego.write_latency[ID_C30.ROOM_TEMP_SETPOINT].count == 1
+
+        # The latest write is retried
+        third = await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 22.0)
+        with pytest.raises(WriteTimeoutError):
+            await third.wait(timeout=0.01, retries=1)
+        assert rego._publish.await_count == 4
+
+        # Dropped by the queue since value already confirmed
+        rego.write_queue = WriteQueue(rego)
+        handle = await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 21.0)
+        assert handle.confirmed
+        assert await handle is None
+
+    asyncio.run(run())
+
+
+def test_retry_through_queue():
+    async def run():
+        rego = make_rego({})
+        queue = rego.write_queue = WriteQueue(rego, max_writes=1, period=60)
+        task = asyncio.create_task(queue.run())
+        handle = await rego.set_variable(ID_C30.ROOM_TEMP_SETPOINT, 20.0)
+        await asyncio.sleep(0)
+        assert rego._publish.await_count == 1
+
+        with pytest.raises(WriteTimeoutError):
+            await handle.wait(timeout=0.01, retries=1)
+        # The retry waits for the write budget instead of being published
+        assert queue.pending == {ID_C30.ROOM_TEMP_SETPOINT: 20.0}
+        assert rego._publish.await_count == 1
+        task.cancel()
+
+    asyncio.run(run())